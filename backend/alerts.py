@@ -0,0 +1,255 @@
+"""
+backend.alerts
+
+Streaming trend alerts for new glucose readings.
+
+Each user gets a sliding window of recent readings with running
+least-squares sums, so adding a reading and reading off the slope are
+O(1) amortized (old points are dropped from the front as the window slides).
+From the slope we predict whether the user will cross the low or high
+threshold within a short horizon.
+
+Alerts are debounced per (user, alert kind) with a keyed timer structure:
+a dict of expiry times plus a min-heap used to purge expired keys, so
+repeated high readings enqueue one scheduler task per debounce period
+instead of one per reading.
+
+Times are when each reading was taken (its ``created_at``, which clients
+send), not when it arrived, and a slope only counts once the window spans
+``min_span_minutes``: a CGM uploading its backlog after reconnecting
+posts readings milliseconds apart, which would otherwise look like a
+very steep trend. A reading taken longer ago than the trend window (by
+the server clock) still updates the window but never enqueues an alert:
+months of backlog are history, not an emergency. ``observe`` runs on
+request threads, so the evaluator keeps one lock around its windows and
+timers.
+"""
+import heapq
+import threading
+from collections import deque
+from datetime import datetime
+
+from .recommendations import parse_timestamp
+
+# Scheduler priorities: lower number runs first.
+PRIORITY_URGENT = 1
+PRIORITY_HIGH = 2
+PRIORITY_NORMAL = 3
+
+
+class SlidingTrend:
+    """Per-user sliding window with running sums for a least-squares slope."""
+
+    __slots__ = ('window_seconds', 'points', 'origin', 'n', 'st', 'sg', 'stt', 'stg')
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.points = deque()
+        self.origin = None
+        self.n = 0
+        self.st = self.sg = self.stt = self.stg = 0.0
+
+    def _add(self, t, g):
+        self.n += 1
+        self.st += t
+        self.sg += g
+        self.stt += t * t
+        self.stg += t * g
+
+    def _remove(self, t, g):
+        self.n -= 1
+        self.st -= t
+        self.sg -= g
+        self.stt -= t * t
+        self.stg -= t * g
+
+    def push(self, when, glucose):
+        """Add a reading. Returns False (and ignores it) if it is out of order."""
+        if self.origin is None or not self.points:
+            self.origin = when
+            self.n = 0
+            self.st = self.sg = self.stt = self.stg = 0.0
+        t = (when - self.origin).total_seconds()
+        if self.points and t < self.points[-1][0]:
+            return False
+        g = float(glucose)
+        self.points.append((t, g))
+        self._add(t, g)
+        while self.points and t - self.points[0][0] > self.window_seconds:
+            self._remove(*self.points.popleft())
+        return True
+
+    def with_point(self, when, glucose):
+        """A copy of the window with one more reading pushed; ``self`` is unchanged."""
+        trend = SlidingTrend(self.window_seconds)
+        trend.points = deque(self.points)
+        trend.origin = self.origin
+        trend.n, trend.st, trend.sg, trend.stt, trend.stg = self.n, self.st, self.sg, self.stt, self.stg
+        trend.push(when, glucose)
+        return trend
+
+    def span(self):
+        """Seconds between the oldest and newest point in the window."""
+        return self.points[-1][0] - self.points[0][0] if self.points else 0.0
+
+    def slope(self):
+        """Slope in mg/dL per minute, or None with fewer than two distinct times."""
+        denom = self.n * self.stt - self.st * self.st
+        if self.n < 2 or denom <= 1e-9:
+            return None
+        return (self.n * self.stg - self.st * self.sg) / denom * 60.0
+
+
+class AlertDebouncer:
+    """Keyed timers: ``allow(key, now)`` is True at most once per period per key.
+
+    A key whose timer is still running is let through again only when the
+    new alert is more urgent (lower priority number), so a predicted low
+    can escalate without waiting out the period.
+    """
+
+    def __init__(self, period_seconds):
+        self.period_seconds = period_seconds
+        self._timers = {}
+        self._heap = []
+
+    def _purge(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            timer = self._timers.get(key)
+            if timer is not None and timer[0] == expires_at:
+                del self._timers[key]
+
+    def allow(self, key, now, priority=PRIORITY_NORMAL):
+        """Start the key's timer and return True unless it is still running."""
+        self._purge(now)
+        timer = self._timers.get(key)
+        if timer is not None and priority >= timer[1]:
+            return False
+        expires_at = now + self.period_seconds
+        self._timers[key] = (expires_at, priority)
+        heapq.heappush(self._heap, (expires_at, key))
+        return True
+
+    def pending(self):
+        """Number of keys with a running timer."""
+        return len(self._timers)
+
+
+class TrendAlertEvaluator:
+    """Evaluate new readings and enqueue debounced alert tasks on a scheduler."""
+
+    def __init__(self, scheduler, low=70, urgent_low=54, very_high=250,
+                 window_minutes=30, horizon_minutes=30, min_points=3, min_span_minutes=10,
+                 debounce_minutes=60):
+        self.scheduler = scheduler
+        self.low = low
+        self.urgent_low = urgent_low
+        self.very_high = very_high
+        self.window_seconds = window_minutes * 60
+        self.horizon_minutes = horizon_minutes
+        self.min_points = min_points
+        self.min_span_seconds = min_span_minutes * 60
+        self.debouncer = AlertDebouncer(debounce_minutes * 60)
+        self._trends = {}
+        self._lock = threading.RLock()
+
+    def _slope(self, trend):
+        if trend is None or trend.n < self.min_points or trend.span() < self.min_span_seconds:
+            return None
+        return trend.slope()
+
+    def _crossing_minutes(self, glucose, slope, threshold):
+        """Minutes until ``threshold`` is crossed at the current slope, or None."""
+        if not slope:
+            return None
+        minutes = (threshold - glucose) / slope
+        if 0 < minutes <= self.horizon_minutes:
+            return minutes
+        return None
+
+    def check(self, glucose, slope):
+        """Return candidate alerts as ``(kind, priority, name)`` tuples."""
+        alerts = []
+        if glucose < self.urgent_low:
+            alerts.append(('hypo', PRIORITY_URGENT, 'Urgent low glucose alert'))
+        elif glucose < self.low:
+            alerts.append(('hypo', PRIORITY_URGENT, 'Low glucose alert'))
+        elif slope is not None and slope < 0:
+            minutes = self._crossing_minutes(glucose, slope, self.low)
+            if minutes is not None:
+                priority = PRIORITY_URGENT if minutes <= 15 else PRIORITY_HIGH
+                alerts.append(('hypo_predicted', priority, f'Predicted low in {minutes:.0f} min'))
+
+        if glucose > self.very_high:
+            alerts.append(('hyper', PRIORITY_HIGH, 'Very high glucose alert'))
+        elif slope is not None and slope > 0:
+            minutes = self._crossing_minutes(glucose, slope, self.very_high)
+            if minutes is not None:
+                alerts.append(('hyper_predicted', PRIORITY_NORMAL, f'Predicted high in {minutes:.0f} min'))
+        return alerts
+
+    def observe(self, reading, now=None):
+        """
+        Feed a newly inserted reading; return the scheduler tasks enqueued.
+        ``now`` (naive UTC, default the server clock) decides whether the
+        reading is recent enough to alert on.
+        """
+        user_id = reading.get('user_id')
+        when = parse_timestamp(reading['created_at'])
+        glucose = float(reading['glucose'])
+        stale = ((now or datetime.utcnow()) - when).total_seconds() > self.window_seconds
+
+        with self._lock:
+            trend = self._trends.get(user_id)
+            if trend is None:
+                trend = self._trends[user_id] = SlidingTrend(self.window_seconds)
+            trend.push(when, glucose)
+            slope = self._slope(trend)
+
+            enqueued = []
+            if stale:
+                return enqueued
+            now = when.timestamp()
+            for kind, priority, name in self.check(glucose, slope):
+                task = self.submit(user_id, kind, f'{name} (user {user_id})', priority, now)
+                if task:
+                    enqueued.append(task)
+            return enqueued
+
+    def submit(self, user_id, kind, name, priority, now, ticks=1):
+        """Enqueue a scheduler task unless the same (user, kind) fired recently."""
+        with self._lock:
+            if not self.debouncer.allow((user_id, kind), now, priority):
+                return None
+            return self.scheduler.submit(name, priority, ticks, user_id=user_id)
+
+    def slope(self, user_id, glucose=None, now=None):
+        """
+        Current slope (mg/dL per minute) for a user, or None. With ``glucose``,
+        the slope as if that value were read at ``now`` (naive UTC, default
+        the server clock), without adding it to the window.
+        """
+        with self._lock:
+            trend = self._trends.get(user_id)
+            if glucose is not None:
+                when = now or datetime.utcnow()
+                if trend is None:
+                    trend = SlidingTrend(self.window_seconds)
+                    trend.push(when, glucose)
+                else:
+                    trend = trend.with_point(when, glucose)
+            return self._slope(trend)
+
+
+if __name__ == '__main__':
+    from datetime import datetime, timedelta
+    from .scheduler import PriorityScheduler
+
+    s = PriorityScheduler()
+    ev = TrendAlertEvaluator(s)
+    start = datetime(2025, 11, 25, 8, 0)
+    for i, g in enumerate([140, 128, 117, 104, 93, 82]):
+        when = start + timedelta(minutes=5 * i)
+        print(g, ev.observe({'user_id': 1, 'glucose': g, 'created_at': when.isoformat() + 'Z'}, now=when))
+    print('Queue:', s.list_tasks())
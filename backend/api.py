@@ -1,48 +1,605 @@
 """
 backend.api
 
-A small Flask blueprint exposing a subset of the JSON API.
-This blueprint is provided for future refactoring and is not required
-for the current app (app.py contains the primary endpoints).
+The JSON API blueprint. Registered by ``create_app`` in ``app.py``:
 
-To use this blueprint, import and register it from `app.py`:
-
-    from backend.api import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
+Routes talk to the services of the current app (storage, cache,
+scheduler, ...) through the proxies below, and to the data only through
+``backend.models`` and the storage interface.
+
+Data routes are multi-tenant: they need a session (see ``backend.auth``)
+and always act on the logged-in user (``g.user_id``), never on a
+``user_id`` from the request. Each tenant has its own rate limits and
+storage quota (see ``backend.quotas``).
 """
-from flask import Blueprint, jsonify, request
-from .models import add_reading, get_readings, add_food, get_foods, init_db
+import functools
+import math
+from datetime import datetime, timedelta
+
+from flask import Blueprint, g, request
+
+from . import models
+from .auth import SESSION_COOKIE, AuthError, login_required, request_token
+from .ingest import CommitError
+from .quotas import QuotaExceeded
+from .serialization import compress_response, json_response, list_response
+from .reports import REPORT_DAYS, parse_tz_offset, period
+from .recommendations import parse_timestamp
+from .series import DEFAULT_POINTS, MAX_POINTS
+from .services import service
+from .sync import apply_changes
 
 api_bp = Blueprint('api_bp', __name__)
 
+storage = service('storage')
+startup_metrics = service('startup')
+recommendation_engine = service('recommendations')
+reading_cache = service('cache')
+reading_fragments = service('fragments')
+scheduler = service('scheduler')
+alert_evaluator = service('alerts')
+sessions = service('sessions')
+quotas = service('quotas')
+change_log = service('changes')
+sync_keys = service('sync_keys')
+reading_writer = service('ingest')
+reading_series = service('series')
+reports = service('reports')
+retention = service('retention')
+maintenance = service('maintenance')
+
+
+def _parse_when(value, default):
+    """``YYYY-MM-DD`` or ISO datetime from a query string, as naive UTC."""
+    if not value:
+        return default
+    return parse_timestamp(value)
+
+
+def _login_needed():
+    return json_response({"ok": False, "error": "Please log in"}), 401
+
+
+def tenant_route(view):
+    """Require a session and charge one request to the user's rate limit."""
+    @functools.wraps(view)
+    @login_required(sessions, _login_needed)
+    def wrapper(*args, **kwargs):
+        quotas.check_request(g.user_id)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@api_bp.errorhandler(QuotaExceeded)
+def quota_exceeded(e):
+    response = json_response({"ok": False, "error": str(e)}, e.status)
+    if e.retry_after is not None and math.isfinite(e.retry_after):
+        response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response
+
+
+@api_bp.errorhandler(AuthError)
+def auth_error(e):
+    return json_response({"ok": False, "error": str(e)}, e.status)
+
+
+def _own_reading(reading_id):
+    """The reading if it belongs to the current user, else None."""
+    reading = models.get_reading(storage, reading_id)
+    return reading if reading and reading.get('user_id') == g.user_id else None
+
+
+# ---------------------- Status ----------------------
+
 @api_bp.route('/ping', methods=['GET'])
 def ping():
-    return jsonify({'status': 'ok'})
+    """Ping endpoint to test backend connectivity (liveness)."""
+    return json_response({"status": "ok", "time": datetime.utcnow().isoformat() + 'Z'})
+
+
+@api_bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 once data is loaded, 503 while still loading."""
+    metrics = startup_metrics.snapshot()
+    is_ready = storage.ready
+    status = 200 if is_ready else 503
+    return json_response({"ok": is_ready, "ready": is_ready, "engine": storage.engine, "startup": metrics,
+                          "ingest": reading_writer.stats()}, status)
+
+
+@api_bp.route('/init', methods=['POST'])
+@tenant_route
+def init_route():
+    """Seed empty collections with the sample data."""
+    models.init_db(storage)
+    return json_response({"ok": True})
+
+
+# ---------------------- Login ----------------------
+
+def _session_response(token, user, status=200):
+    """JSON with the token, plus the same token as an HttpOnly cookie for the pages."""
+    response = json_response({"ok": True, "token": token, "user": user}, status)
+    response.set_cookie(SESSION_COOKIE, token, max_age=sessions.ttl_seconds,
+                        httponly=True, samesite='Lax')
+    return response
+
+
+@api_bp.route('/register', methods=['POST'])
+def register():
+    """Create an account (email + 4-8 digit PIN) and log it in."""
+    data = request.get_json() or {}
+    sessions.register(data.get('email'), data.get('pin'))
+    token, user = sessions.login(data.get('email'), data.get('pin'))
+    return _session_response(token, user, 201)
+
+
+@api_bp.route('/login', methods=['POST'])
+def login():
+    """Log in with email and PIN. Returns a session token."""
+    data = request.get_json() or {}
+    token, user = sessions.login(data.get('email'), data.get('pin'))
+    return _session_response(token, user)
+
+
+@api_bp.route('/logout', methods=['POST'])
+def logout():
+    """End the current session."""
+    token = request_token()
+    if token:
+        sessions.logout(token)
+    response = json_response({"ok": True})
+    response.delete_cookie(SESSION_COOKIE)
+    return response
+
+
+# ---------------------- Readings ----------------------
 
 @api_bp.route('/readings', methods=['GET', 'POST'])
+@tenant_route
 def readings_route():
+    """
+    GET: List your readings. POST: Add a reading. The POST returns once the
+    reading is on disk; it shares that write + fsync with every other
+    reading posted in the same few milliseconds (see ``backend.ingest``).
+    """
     if request.method == 'GET':
-        user_id = int(request.args.get('user_id', 1))
-        limit = int(request.args.get('limit', 50))
-        readings = get_readings(user_id=user_id, limit=limit)
-        return jsonify({'ok': True, 'readings': readings})
-    else:
-        data = request.get_json() or {}
-        reading = add_reading(data.get('user_id', 1), data['glucose'], data.get('context', 'general'), data.get('meal', ''), data.get('note', ''))
-        return jsonify({'ok': True, 'reading': reading}), 201
+        limit = request.args.get('limit', 50, type=int)
+        readings = models.get_readings(storage, user_id=g.user_id, limit=limit)
+        return list_response("readings", readings, reading_fragments, ok=True)
+
+    quotas.check_write(g.user_id, 1)
+    try:
+        data = request.get_json()
+        # created_at: when the reading was taken (main.js and CGM uploads send it)
+        reading = reading_writer.submit(models.reading_record(
+            g.user_id, data.get('glucose'), data.get('context', 'fasting'), data.get('meal', ''),
+            data.get('note', ''), created_at=data.get('created_at')))
+        quotas.record_writes(g.user_id, 1)
+        reading_cache.put(reading['id'], reading)
+        alerts = alert_evaluator.observe(reading)
+        return json_response({"ok": True, "reading": reading, "alerts": alerts}), 201
+
+    except CommitError as e:
+        # 503 either way; only a reading that was never written should be resent
+        body = {"ok": False, "error": str(e), "resend": e.stored is None}
+        if isinstance(e.stored, list):
+            quotas.record_writes(g.user_id, 1)
+            body["reading"] = e.stored[0]
+        return json_response(body), 503
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+@api_bp.route('/readings/<int:reading_id>', methods=['GET', 'PUT', 'DELETE'])
+@tenant_route
+def reading_detail(reading_id):
+    """GET: Get a reading. PUT: Update. DELETE: Delete. Other users' readings are 404."""
+    reading = _own_reading(reading_id)
+
+    if not reading:
+        return json_response({"ok": False, "error": "Reading not found"}), 404
+
+    if request.method == 'GET':
+        return json_response({"ok": True, "reading": reading})
+
+    if request.method == 'PUT':
+        try:
+            # Only reading fields are taken from the body, validated like a new reading
+            reading = models.update_reading(storage, reading_id, **dict(request.get_json()))
+            reading_fragments.invalidate(reading_id)
+            reading_cache.put(reading_id, reading)
+            return json_response({"ok": True, "reading": reading})
+        except Exception as e:
+            return json_response({"ok": False, "error": str(e)}), 400
+
+    models.delete_reading(storage, reading_id)
+    quotas.record_deletes(g.user_id, 1)
+    reading_fragments.invalidate(reading_id)
+    reading_cache.pop(reading_id)
+    return json_response({"ok": True})
+
+
+@api_bp.route('/readings/range', methods=['GET'])
+@tenant_route
+def readings_range():
+    """
+    Glucose over a time range: ?from=2025-11-01&to=2025-12-01[&resolution=raw|15m|1h].
+    Short ranges return raw readings; long ranges come from the 15-minute or
+    hourly rollups, so they stay fast however old the data is.
+    """
+    try:
+        end = _parse_when(request.args.get('to'), datetime.utcnow())
+        start = _parse_when(request.args.get('from'), end - timedelta(days=7))
+        resolution = request.args.get('resolution')
+        if resolution not in (None, 'raw', '15m', '1h'):
+            raise ValueError("resolution must be raw, 15m or 1h")
+    except ValueError as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+    resolution, points = retention.query(g.user_id, start, end, resolution)
+    return json_response({"ok": True, "from": start.isoformat() + 'Z', "to": end.isoformat() + 'Z',
+                          "resolution": resolution, "points": points})
+
+
+@api_bp.route('/readings/series', methods=['GET'])
+@tenant_route
+def readings_series():
+    """
+    Chart-ready series: ?from=&to=&points=500[&resolution=raw|15m|1h].
+    At most ``points`` readings (or bucket means) picked with LTTB, as
+    parallel ``t`` / ``glucose`` / ``min`` / ``max`` lists. Always your own
+    data: a ``user_id`` parameter is ignored.
+    """
+    try:
+        # Default end rounded up to the minute, so repeated calls hit the cache
+        now = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = _parse_when(request.args.get('to'), now)
+        start = _parse_when(request.args.get('from'), end - timedelta(days=7))
+        points = int(request.args.get('points', DEFAULT_POINTS))
+        if not 3 <= points <= MAX_POINTS:
+            raise ValueError(f"points must be between 3 and {MAX_POINTS}")
+        resolution = request.args.get('resolution')
+        if resolution not in (None, 'raw', '15m', '1h'):
+            raise ValueError("resolution must be raw, 15m or 1h")
+    except ValueError as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+    result = reading_series.series(g.user_id, start, end, points, resolution)
+    return json_response({"ok": True, "from": start.isoformat() + 'Z', "to": end.isoformat() + 'Z',
+                          "points": len(result['t']), **result})
+
+
+@api_bp.route('/report', methods=['GET'])
+@tenant_route
+def report_route():
+    """
+    Clinician report for the last ?days=14 (1-90) as JSON, in local time
+    ?tz=<minutes east of UTC> (default 0). Built in the background: 202
+    with Retry-After until it is ready, then served from the cache until
+    your data changes. HTML: /report, PDF: /report.pdf.
+    """
+    try:
+        days = int(request.args.get('days', REPORT_DAYS))
+        if not 1 <= days <= 90:
+            raise ValueError("days must be between 1 and 90")
+        tz_offset = parse_tz_offset(request.args.get('tz'))
+    except ValueError as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+    start, end = period(days, tz_offset=tz_offset)
+    report = reports.report(g.user_id, start, end, wait=1, tz_offset=tz_offset)
+    if report is None:
+        response = json_response({"ok": True, "status": "pending"}, 202)
+        response.headers['Retry-After'] = '2'
+        return response
+    return json_response({"ok": True, "status": "ready", "report": report})
+
+
+@api_bp.route('/export', methods=['GET'])
+@tenant_route
+def export_route():
+    """Export your readings as CSV wrapped in JSON."""
+    try:
+        # Archived (older) readings first, then the live ones
+        readings = list(retention.archived_readings(g.user_id))
+        readings += models.get_readings(storage, user_id=g.user_id, limit=None, oldest_first=True)
+        return json_response({
+            "ok": True,
+            "csv": models.readings_csv(readings)
+        })
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+@api_bp.route('/import', methods=['POST'])
+@tenant_route
+def import_route():
+    """
+    Import readings from JSON array. A batch costs one write token per
+    reading from your own bucket, so a big import is refused with 429
+    (and Retry-After) instead of slowing down other users.
+    """
+    data = request.get_json(silent=True) or {}
+    readings = data.get('readings', [])
+    quotas.check_write(g.user_id, len(readings))
+    try:
+        stored = models.import_readings(storage, g.user_id, readings)
+        quotas.record_writes(g.user_id, len(stored))
+        return json_response({"ok": True, "inserted": len(stored)}), 201
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+# ---------------------- Offline sync ----------------------
+
+@api_bp.route('/sync', methods=['GET'])
+@tenant_route
+def sync_pull():
+    """
+    Changes since a cursor: ?since=<seq>&limit=<n>. Without ``since`` (or
+    with 0), or with a cursor so old that some of the deletes since have
+    been compacted away, the response is a full snapshot. Deletes come back as
+    tombstones ``{"op": "del", "id": ...}``. Store ``cursor`` and send it
+    as ``since`` next time; if ``more`` is true, ask again right away.
+    """
+    since = request.args.get('since', 0, type=int)
+    if since <= 0 or since < change_log.horizon:
+        changes, cursor = change_log.snapshot(g.user_id)
+        return json_response({"ok": True, "full": True, "cursor": cursor, "more": False, "changes": changes})
+    limit = min(request.args.get('limit', 1000, type=int), 1000)
+    changes, cursor, more = change_log.changes_since(g.user_id, since, limit)
+    return json_response({"ok": True, "full": False, "cursor": cursor, "more": more, "changes": changes})
+
+
+@api_bp.route('/sync', methods=['POST'])
+@tenant_route
+def sync_push():
+    """
+    Apply a batch of offline writes:
+    {"changes": [{"key": "<unique>", "op": "put"|"del", "collection": "readings"|"foods",
+                  "id": <server id, omit to create>, "record": {...}}]}
+    A change whose key was already applied returns its first result again.
+    """
+    data = request.get_json(silent=True) or {}
+    changes = data.get('changes') or [] if isinstance(data, dict) else None
+    if not isinstance(changes, list) or not all(isinstance(c, dict) for c in changes):
+        return json_response({"ok": False, "error": "changes must be a list of objects"}), 400
+    if any(not isinstance(c.get('key', ''), str) for c in changes):
+        return json_response({"ok": False, "error": "idempotency keys must be strings"}), 400
+    if len(changes) > quotas.max_batch:
+        raise QuotaExceeded(f"At most {quotas.max_batch} changes per request", status=413)
+
+    # Changes with a known key were applied before: answer from the key store
+    known, pending = {}, {}
+    for change in changes:
+        key = change.get('key')
+        if key and key not in pending:
+            result = sync_keys.get(g.user_id, key)
+            if result is not None:
+                known[key] = result
+            else:
+                pending[key] = change
+    creates = sum(1 for c in pending.values()
+                  if c.get('op') == 'put' and c.get('id') is None and c.get('collection', 'readings') == 'readings')
+    quotas.check_write(g.user_id, creates)
+
+    applied = dict(zip(pending, apply_changes(storage, g.user_id, list(pending.values()))))
+    if applied:
+        sync_keys.put_many(g.user_id, applied)
+    for result in applied.values():
+        if result['ok'] and result['collection'] == 'readings':
+            reading_fragments.invalidate(result['id'])
+            reading_cache.pop(result['id'])
+    quotas.record_writes(g.user_id, sum(1 for r in applied.values() if r.get('created') and r['collection'] == 'readings'))
+    quotas.record_deletes(g.user_id, sum(1 for r in applied.values() if r.get('deleted') and r['collection'] == 'readings'))
+
+    results = []
+    for change in changes:
+        key = change.get('key')
+        if not key:
+            results.append({"ok": False, "error": "missing idempotency key"})
+        else:
+            results.append({"key": key, **(applied.get(key) or known[key])})
+    return json_response({"ok": True, "results": results, "cursor": change_log.cursor})
+
+
+# ---------------------- Foods ----------------------
 
 @api_bp.route('/foods', methods=['GET', 'POST'])
+@tenant_route
 def foods_route():
     if request.method == 'GET':
-        foods = get_foods()
-        return jsonify({'ok': True, 'foods': foods})
-    else:
+        return json_response({'ok': True, 'foods': models.get_foods(storage, g.user_id)})
+    data = request.get_json() or {}
+    f = models.add_food(storage, g.user_id, data.get('date'), data.get('time'), data.get('food'))
+    return json_response({'ok': True, 'food': f}), 201
+
+
+# ---------------------- Recommendations ----------------------
+
+@api_bp.route('/suggestions', methods=['POST'])
+@tenant_route
+def suggestions_route():
+    """Get suggestions based on glucose level. May enqueue scheduler tasks."""
+    try:
+        data = request.get_json()
+        glucose = float(data.get('glucose'))
+        context = data.get('context', 'general')
+        user_id = g.user_id
+
+        # Same least-squares slope the trend alerts use, with this value as the newest point
+        trend = recommendation_engine.classify_trend(alert_evaluator.slope(user_id, glucose))
+        rule = recommendation_engine.evaluate(glucose, context, trend)
+        suggestions = list(rule['suggestions']) if rule else []
+        enqueued = []
+
+        if rule and rule.get('notify_doctor'):
+            # Enqueue high-priority reminder, at most once per debounce period per user
+            task = alert_evaluator.submit(user_id, 'doctor_reminder', "Doctor reminder (auto)",
+                                          priority=2, now=datetime.utcnow().timestamp())
+            if task:
+                enqueued = [{"name": task['name'], "priority": task['priority'], "ticks": task['ticks']}]
+
+        return json_response({
+            "ok": True,
+            "suggestions": suggestions,
+            "level": rule['level'] if rule else None,
+            "trend": trend,
+            "enqueued": enqueued
+        })
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+@api_bp.route('/recommendations/batch', methods=['POST'])
+@tenant_route
+def recommendations_batch():
+    """
+    Annotate many readings with level and trend in one pass.
+    Body: {"readings": [...]} to annotate given readings, or
+    {} to annotate your stored history. Readings without a numeric
+    glucose get level null and are counted under "skipped".
+    """
+    try:
         data = request.get_json() or {}
-        f = add_food(data.get('date'), data.get('time'), data.get('food'))
-        return jsonify({'ok': True, 'food': f}), 201
+        readings = data.get('readings')
+        if readings is None:
+            readings = storage.filter('readings', user_id=g.user_id)
 
-@api_bp.route('/init', methods=['POST'])
-def init_route():
-    init_db()
-    return jsonify({'ok': True})
+        annotations = recommendation_engine.annotate(readings)
+        summary = {}
+        skipped = 0
+        for a in annotations:
+            if a['level'] is None:
+                skipped += 1
+                continue
+            summary[a['level']] = summary.get(a['level'], 0) + 1
+
+        return json_response({
+            "ok": True,
+            "count": len(annotations),
+            "skipped": skipped,
+            "summary": summary,
+            "annotations": annotations
+        })
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+# ---------------------- Cache demo ----------------------
+
+@api_bp.route('/cache', methods=['GET'])
+@tenant_route
+def cache_route():
+    """Get cache statistics and your cached items."""
+    stats = reading_cache.stats()
+    items = [(key, value) for key, value in reading_cache.items() if value.get('user_id') == g.user_id]
+    return json_response({"ok": True, **stats, "items": items})
+
+
+@api_bp.route('/cache/get/<int:item_id>', methods=['GET'])
+@tenant_route
+def cache_get(item_id):
+    """Get item from cache (or load from storage if not cached)."""
+    item = reading_cache.get(item_id)
+
+    if not item:
+        item = models.get_reading(storage, item_id)
+        if item:
+            reading_cache.put(item_id, item)
+
+    if item and item.get('user_id') == g.user_id:
+        return json_response({"ok": True, "item": item, "stats": reading_cache.stats()})
+    return json_response({"ok": False, "error": "Item not found"}), 404
+
+
+@api_bp.route('/cache/put', methods=['POST'])
+@tenant_route
+def cache_put():
+    """Load one of your readings into cache."""
+    try:
+        data = request.get_json()
+        item_id = data.get('id')
+        item = _own_reading(item_id)
+
+        if item:
+            reading_cache.put(item_id, item)
+            return json_response({"ok": True, "item": item, "stats": reading_cache.stats()})
+        return json_response({"ok": False, "error": "Item not found"}), 404
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+# ---------------------- Scheduler demo ----------------------
+
+@api_bp.route('/scheduler', methods=['GET', 'POST'])
+@tenant_route
+def scheduler_route():
+    """GET: List your scheduler queue (including your alerts). POST: Submit a task."""
+    if request.method == 'GET':
+        return json_response({
+            "ok": True,
+            "queue": scheduler.list_tasks(g.user_id),
+            "history": scheduler.history(g.user_id)
+        })
+
+    try:
+        data = request.get_json()
+        task = scheduler.submit(data.get('name'), int(data.get('priority', 5)), int(data.get('ticks', 1)),
+                                user_id=g.user_id)
+        return json_response({"ok": True, "task": task}), 201
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+@api_bp.route('/scheduler/run', methods=['POST'])
+@tenant_route
+def scheduler_run():
+    """Run your scheduler tasks for n ticks."""
+    try:
+        ticks = request.args.get('ticks', 1, type=int)
+        executed = scheduler.run_ticks(ticks, g.user_id)
+        return json_response({
+            "ok": True,
+            "executed": executed,
+            "queue": scheduler.list_tasks(g.user_id),
+            "history": scheduler.history(g.user_id)
+        })
+
+    except Exception as e:
+        return json_response({"ok": False, "error": str(e)}), 400
+
+
+@api_bp.route('/maintenance', methods=['GET'])
+@tenant_route
+def maintenance_route():
+    """Recurring background jobs (e.g. retention) and their last runs."""
+    return json_response({
+        "ok": True,
+        "jobs": maintenance.recurring(),
+        "queue": maintenance.list_tasks(),
+        "history": maintenance.history()[-20:]
+    })
+
+
+# ---------------------- CORS & compression ----------------------
+
+@api_bp.after_app_request
+def add_cors_headers(response):
+    """Add CORS headers to all responses."""
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    return response
+
+
+@api_bp.after_app_request
+def compress(response):
+    """Gzip/deflate larger responses when the client accepts it."""
+    return compress_response(response, request.headers.get('Accept-Encoding'))
@@ -0,0 +1,190 @@
+"""
+backend.auth
+
+Users, hashed PINs and session tokens.
+
+- PINs are stored as PBKDF2-SHA256 hashes with a per-user salt.
+- A successful login creates a random session token. Only its SHA-256
+  digest is stored (in the ``sessions`` collection), so a leaked data
+  directory does not leak usable tokens.
+- Every authenticated request resolves its token through an in-memory
+  index of all sessions by token digest, loaded from storage once. An
+  unknown or bogus token is a dictionary miss, never a collection scan.
+  ``purge_expired`` (a maintenance job) deletes expired sessions.
+
+The token is accepted from an ``Authorization: Bearer <token>`` header
+or from the ``tracker_session`` cookie set by ``/api/login``.
+"""
+import functools
+import hashlib
+import hmac
+import re
+import secrets
+import threading
+import time
+
+from flask import g, request
+
+from .models import utc_now_iso
+from .quotas import TenantLimiter
+
+PIN_ITERATIONS = 100_000
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+SESSION_COOKIE = 'tracker_session'
+SESSION_PURGE_SECONDS = 3600
+# Login attempts per email: a 4-digit PIN must not be guessable by brute force
+LOGIN_ATTEMPTS_PER_MINUTE = 5
+
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+_PIN_RE = re.compile(r'^\d{4,8}$')
+
+
+class AuthError(Exception):
+    """Raised for bad credentials or invalid registration data."""
+
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+
+def hash_pin(pin, salt=None):
+    """Return ``(salt_hex, hash_hex)`` for a PIN."""
+    salt = bytes.fromhex(salt) if salt else secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', str(pin).encode('utf-8'), salt, PIN_ITERATIONS)
+    return salt.hex(), digest.hex()
+
+
+def verify_pin(pin, salt, expected):
+    return hmac.compare_digest(hash_pin(pin, salt)[1], expected)
+
+
+def _token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def public_user(user):
+    return {'id': user['id'], 'email': user['email']}
+
+
+class SessionManager:
+    """Registers users, checks PINs and resolves session tokens."""
+
+    def __init__(self, storage, ttl_seconds=SESSION_TTL_SECONDS):
+        self.storage = storage
+        self.ttl_seconds = ttl_seconds
+        # token digest -> (user id, expires at, session record id); None until loaded
+        self._tokens = None
+        self._lock = threading.Lock()
+        self.attempts = TenantLimiter(LOGIN_ATTEMPTS_PER_MINUTE / 60.0, LOGIN_ATTEMPTS_PER_MINUTE)
+
+    def find_user(self, email):
+        matches = self.storage.filter('users', email=(email or '').strip().lower())
+        return matches[0] if matches else None
+
+    def register(self, email, pin):
+        email = (email or '').strip().lower()
+        if not _EMAIL_RE.match(email):
+            raise AuthError("Please enter a valid email address", status=400)
+        if not _PIN_RE.match(str(pin or '')):
+            raise AuthError("PIN must be 4 to 8 digits", status=400)
+        if self.find_user(email):
+            raise AuthError("An account with this email already exists", status=409)
+        salt, digest = hash_pin(pin)
+        user = self.storage.insert('users', {
+            'email': email,
+            'pin_salt': salt,
+            'pin_hash': digest,
+            'created_at': utc_now_iso(),
+        })
+        return public_user(user)
+
+    def login(self, email, pin):
+        """Check credentials and return ``(token, public_user)``."""
+        if self.attempts.take((email or '').strip().lower()):
+            raise AuthError("Too many login attempts, please wait a minute", status=429)
+        user = self.find_user(email)
+        if not user or not verify_pin(pin, user['pin_salt'], user['pin_hash']):
+            raise AuthError("Wrong email or PIN")
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + self.ttl_seconds
+        digest = _token_digest(token)
+        tokens = self._index()
+        session = self.storage.insert('sessions', {'token_hash': digest, 'user_id': user['id'],
+                                                   'expires_at': expires_at})
+        with self._lock:
+            tokens[digest] = (user['id'], expires_at, session['id'])
+        return token, public_user(user)
+
+    def _index(self):
+        """All sessions by token digest, read from storage on first use."""
+        if self._tokens is None:
+            # Read outside our lock: storage takes its own lock
+            sessions = self.storage.all('sessions')
+            with self._lock:
+                if self._tokens is None:
+                    self._tokens = {s['token_hash']: (s['user_id'], s['expires_at'], s['id'])
+                                    for s in sessions}
+        return self._tokens
+
+    def resolve(self, token):
+        """User id for a token, or None if unknown or expired."""
+        if not token:
+            return None
+        entry = self._index().get(_token_digest(token))
+        if entry is None:
+            return None
+        user_id, expires_at, _ = entry
+        if expires_at < time.time():
+            self.logout(token)
+            return None
+        return user_id
+
+    def logout(self, token):
+        tokens = self._index()
+        with self._lock:
+            entry = tokens.pop(_token_digest(token), None)
+        if entry is not None:
+            self.storage.delete('sessions', entry[2])
+
+    def purge_expired(self, now=None):
+        """Delete every expired session in one write. Returns how many."""
+        now = time.time() if now is None else now
+        tokens = self._index()
+        with self._lock:
+            expired = [digest for digest, (_, expires_at, _) in tokens.items() if expires_at < now]
+            ids = [tokens.pop(digest)[2] for digest in expired]
+        if ids:
+            self.storage.delete_many('sessions', ids)
+        return len(ids)
+
+
+def request_token():
+    """Session token from the Authorization header or the session cookie."""
+    header = request.headers.get('Authorization', '')
+    if header.lower().startswith('bearer '):
+        return header[7:].strip()
+    return request.cookies.get(SESSION_COOKIE)
+
+
+def current_user_id(sessions):
+    """Resolve (and memoize on ``g``) the user id of the current request."""
+    if 'user_id' not in g:
+        g.user_id = sessions.resolve(request_token())
+    return g.user_id
+
+
+def login_required(sessions, on_denied):
+    """
+    Decorator factory: run the view only for a logged-in user (``g.user_id``),
+    otherwise return ``on_denied()``. The view module passes its sessions
+    service and its own denial response (JSON 401 for the API, a redirect
+    for pages).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_user_id(sessions) is None:
+                return on_denied()
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
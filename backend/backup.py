@@ -0,0 +1,334 @@
+"""
+backend.backup
+
+Online snapshots, an incremental change journal and point-in-time restore.
+
+Backups live in ``data/backups/`` by default (``TRACKER_BACKUP_DIR`` to
+move them; keep them on the same disk as the data so hard links work):
+
+- ``snapshots/<id>/``: one full snapshot per run, made with
+  ``storage.snapshot()`` while requests keep running. The json engine
+  replaces files on every save and the log engine only appends, so their
+  snapshots are hard links (plus the log length) and cost the same for
+  1 MB or 10 GB. SQLite uses its online backup API, which copies pages
+  but does not block writers. ``manifest.json`` lists the files.
+- ``journal/<id>.jsonl``: every write after a snapshot, one JSON line
+  each (``{"t", "c", "op", "r"}``), appended by a storage watcher. This
+  is the incremental backup; a new file starts with every snapshot and
+  is fsynced whenever the storage syncs.
+- ``archive/``: hard links to the retention archive segments. Segments
+  never change, so each one is linked once, no matter how many
+  snapshots refer to it.
+
+``restore(backup_dir, to, target_dir)`` rebuilds a data folder as it was
+at time ``to``: the newest snapshot taken before it, plus the journal up
+to it. Only the last write per record is applied (puts as upserts by id,
+deletes as "remove if present"), so replaying a change that is already
+in the snapshot is harmless. The time taken is the file copies plus the
+writes since that snapshot, not the size of the whole history.
+
+Run from the project root:
+
+    python -m backend.backup snapshot --engine json
+    python -m backend.backup list
+    python -m backend.backup restore --to 2026-10-19T12:00:00 --target data-restored
+"""
+import argparse
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from .serialization import dumps, loads
+from .storage import ENGINES, open_storage
+from .storage.base import link_or_copy
+
+BACKUP_INTERVAL_SECONDS = 24 * 3600
+KEEP_SNAPSHOTS = 7
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+_ID_FORMAT = '%Y%m%dT%H%M%S%fZ'
+
+
+class BackupError(Exception):
+    """Raised when there is nothing to restore from, or the target is not empty."""
+
+
+def _stamp(when):
+    """Fixed-width UTC time, so journal times compare as strings."""
+    return when.strftime(_TIME_FORMAT)
+
+
+def parse_time(text):
+    """``2026-10-19``, ``2026-10-19T12:00`` or ``...Z`` -> naive UTC datetime."""
+    return datetime.fromisoformat(text.rstrip('Z'))
+
+
+def _engine_name(storage):
+    return next(name for name, cls in ENGINES.items() if type(storage) is cls)
+
+
+def _link_tree(src_dir, dst_dir):
+    """Hard link every file under ``src_dir`` that ``dst_dir`` doesn't have yet."""
+    linked = 0
+    if not src_dir.exists():
+        return linked
+    for src in src_dir.rglob('*'):
+        if not src.is_file() or src.name.endswith('.tmp'):
+            continue
+        dst = dst_dir / src.relative_to(src_dir)
+        if not dst.exists():
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            link_or_copy(src, dst)
+            linked += 1
+    return linked
+
+
+class BackupManager:
+    """
+    Snapshots plus a journal of every write in between.
+
+    Methods:
+    - snapshot() -> summary
+    - snapshot_if_due() -> summary, or None if the newest snapshot is younger
+      than ``interval`` (the maintenance job, see ``Services``; restarts
+      don't add snapshots)
+    - snapshots() -> manifests, oldest first
+    """
+
+    def __init__(self, storage, backup_dir=None, keep=KEEP_SNAPSHOTS, interval=BACKUP_INTERVAL_SECONDS):
+        self.storage = storage
+        self.backup_dir = Path(backup_dir or os.environ.get('TRACKER_BACKUP_DIR')
+                               or storage.data_dir / 'backups')
+        self.keep = keep
+        self.interval = interval
+        self._journal = None
+        self._journal_id = None
+        self._lock = threading.Lock()
+        storage.watch(self._on_write)
+
+    @property
+    def archive_dir(self):
+        return self.storage.data_dir / 'archive'
+
+    # ---------------------- Journal ----------------------
+
+    def _on_write(self, name, op, records):
+        with self._lock:
+            if op == 'sync':
+                if self._journal is not None:
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                return
+            if self._journal is None:
+                self._open_journal(self._latest_journal_id() or datetime.utcnow().strftime(_ID_FORMAT))
+            entry = {'t': _stamp(datetime.utcnow()), 'c': name, 'op': op,
+                     'r': records if op == 'put' else [r['id'] for r in records]}
+            self._journal.write(dumps(entry) + b'\n')
+            self._journal.flush()
+            if name == 'archive_segments' and op == 'put':
+                # The segment file is written before its record, so it can be linked now
+                for segment in records:
+                    self._keep_segment(segment['path'])
+
+    def _keep_segment(self, relative):
+        dst = self.backup_dir / 'archive' / relative
+        if not dst.exists() and (self.archive_dir / relative).exists():
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            link_or_copy(self.archive_dir / relative, dst)
+
+    def _latest_journal_id(self):
+        journals = sorted((self.backup_dir / 'journal').glob('*.jsonl'))
+        return journals[-1].stem if journals else None
+
+    def _open_journal(self, journal_id):
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+        path = self.backup_dir / 'journal' / f'{journal_id}.jsonl'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._journal = open(path, 'ab')
+        self._journal_id = journal_id
+
+    # ---------------------- Snapshots ----------------------
+
+    def snapshot(self):
+        """Take a full snapshot and start a new journal file. Returns its manifest."""
+        started = datetime.utcnow()
+        snapshot_id = started.strftime(_ID_FORMAT)
+        # New journal first: every write from here on is either in the snapshot,
+        # in the new journal, or both (replay is idempotent)
+        with self._lock:
+            self._open_journal(snapshot_id)
+        folder = self.backup_dir / 'snapshots' / snapshot_id
+        files = self.storage.snapshot(folder / 'data')
+        linked = _link_tree(self.archive_dir, self.backup_dir / 'archive')
+        manifest = {
+            'id': snapshot_id,
+            'created_at': _stamp(started),
+            'finished_at': _stamp(datetime.utcnow()),
+            'engine': _engine_name(self.storage),
+            'files': files,
+            'archive_segments_linked': linked,
+        }
+        tmp = folder / 'manifest.json.tmp'
+        tmp.write_bytes(dumps(manifest))
+        os.replace(tmp, folder / 'manifest.json')
+        manifest['pruned'] = self._prune()
+        return manifest
+
+    def snapshot_if_due(self, now=None):
+        """Take a snapshot unless the newest one is younger than ``interval``."""
+        manifests = self.snapshots()
+        now = now or datetime.utcnow()
+        if manifests and (now - parse_time(manifests[-1]['created_at'])).total_seconds() < self.interval:
+            return None
+        return self.snapshot()
+
+    def snapshots(self):
+        return list_snapshots(self.backup_dir)
+
+    def _prune(self):
+        """Drop snapshots beyond ``keep`` and journals older than the oldest kept snapshot."""
+        manifests = self.snapshots()
+        if len(manifests) <= self.keep:
+            return 0
+        drop, kept = manifests[:-self.keep], manifests[-self.keep:]
+        for m in drop:
+            shutil.rmtree(self.backup_dir / 'snapshots' / m['id'], ignore_errors=True)
+        first_needed = _journals_from(self.backup_dir, kept[0]['id'])[0]
+        for path in sorted((self.backup_dir / 'journal').glob('*.jsonl')):
+            if path.stem < first_needed.stem:
+                path.unlink()
+        return len(drop)
+
+
+def list_snapshots(backup_dir):
+    """Manifests of complete snapshots, oldest first."""
+    manifests = []
+    for path in sorted((Path(backup_dir) / 'snapshots').glob('*/manifest.json')):
+        manifests.append(loads(path.read_bytes()))
+    return manifests
+
+
+def _journals_from(backup_dir, snapshot_id):
+    """Journal files to replay after a snapshot: the one that was open when it started, and later ones."""
+    journals = sorted((Path(backup_dir) / 'journal').glob('*.jsonl'))
+    start = 0
+    for i, path in enumerate(journals):
+        if path.stem <= snapshot_id:
+            start = i
+    return journals[start:]
+
+
+def _copy_prefix(src, dst, size, chunk=1 << 20):
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while size > 0:
+            data = fin.read(min(chunk, size))
+            if not data:
+                break
+            fout.write(data)
+            size -= len(data)
+
+
+def restore(backup_dir, to, target_dir):
+    """
+    Rebuild the data folder as of ``to`` (naive UTC datetime) into
+    ``target_dir``, which must not exist or be empty. Returns a summary.
+    """
+    backup_dir, target_dir = Path(backup_dir), Path(target_dir)
+    if target_dir.exists() and any(target_dir.iterdir()):
+        raise BackupError(f"{target_dir} is not empty")
+    until = _stamp(to)
+    candidates = [m for m in list_snapshots(backup_dir) if m['created_at'] <= until]
+    if not candidates:
+        raise BackupError(f"no snapshot taken before {until}")
+    manifest = candidates[-1]
+
+    # 1. Snapshot files: link what never changes, copy the rest
+    source = backup_dir / 'snapshots' / manifest['id'] / 'data'
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for name, info in manifest['files'].items():
+        if info.get('immutable'):
+            link_or_copy(source / name, target_dir / name)
+        elif 'bytes' in info:
+            _copy_prefix(source / name, target_dir / name, info['bytes'])
+        else:
+            shutil.copy2(source / name, target_dir / name)
+
+    # 2. Journal up to ``to``: keep only the last write per record
+    final = {}
+    replayed = 0
+    for path in _journals_from(backup_dir, manifest['id']):
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = loads(line)
+                if entry['t'] > until:
+                    break
+                replayed += 1
+                writes = final.setdefault(entry['c'], {})
+                for r in entry['r']:
+                    if entry['op'] == 'put':
+                        writes[r['id']] = r
+                    else:
+                        writes[r] = None
+
+    storage = open_storage(manifest['engine'], target_dir)
+    storage.load()
+    try:
+        for name, writes in final.items():
+            # Replace changed records in two writes per collection, not one per record
+            storage.delete_many(name, list(writes))
+            puts = [r for r in writes.values() if r is not None]
+            if puts:
+                storage.insert_many(name, puts)
+        storage.sync()
+        segments = [s['path'] for s in storage.all('archive_segments')]
+    finally:
+        storage.close()
+
+    # 3. Archive segments the restored store refers to
+    for relative in segments:
+        src = backup_dir / 'archive' / relative
+        dst = target_dir / 'archive' / relative
+        if src.exists() and not dst.exists():
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            link_or_copy(src, dst)
+
+    return {'snapshot': manifest['id'], 'to': until, 'journal_entries': replayed,
+            'records_changed': sum(len(w) for w in final.values()),
+            'archive_segments': len(segments), 'target': str(target_dir)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot, list and restore tracker backups.')
+    parser.add_argument('command', choices=['snapshot', 'list', 'restore'])
+    parser.add_argument('--data-dir', default=os.environ.get('TRACKER_DATA_DIR', 'data'))
+    parser.add_argument('--engine', default=os.environ.get('TRACKER_STORAGE'))
+    parser.add_argument('--backup-dir', help='default: <data dir>/backups or TRACKER_BACKUP_DIR')
+    parser.add_argument('--to', help='restore: UTC time, e.g. 2026-10-19T12:00:00 (default: now)')
+    parser.add_argument('--target', help='restore: empty folder to rebuild the data into')
+    args = parser.parse_args()
+    backup_dir = Path(args.backup_dir or os.environ.get('TRACKER_BACKUP_DIR')
+                      or Path(args.data_dir) / 'backups')
+
+    if args.command == 'snapshot':
+        # Only the running app journals writes; use this while it is stopped
+        storage = open_storage(args.engine, args.data_dir)
+        manager = BackupManager(storage, backup_dir)
+        print(manager.snapshot())
+    elif args.command == 'list':
+        for m in list_snapshots(backup_dir):
+            print(m['id'], m['engine'], m['created_at'], f"{len(m['files'])} files")
+    else:
+        if not args.target:
+            parser.error('restore needs --target')
+        to = parse_time(args.to) if args.to else datetime.utcnow()
+        print(restore(backup_dir, to, args.target))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,12 @@
 backend.cache
 
 Simple LRUCache implementation for demo and educational purposes.
+
+``UserVersions`` gives each user a data version number that goes up on
+every write to their records, so cached results can be keyed by
+(user, ..., version) instead of being invalidated one by one.
 """
+import threading
 from collections import OrderedDict
 
 class LRUCache:
@@ -11,6 +16,7 @@ class LRUCache:
     Methods:
     - get(key): returns value or None
     - put(key, value): insert/update
+    - pop(key): remove and return value or None
     - items(): list of (key, value) from least->most recent
     - stats(): dict with capacity, size, hits, misses
     """
@@ -36,6 +42,10 @@ class LRUCache:
             self._data.popitem(last=False)  # pop least recently used
         self._data[key] = value
 
+    def pop(self, key):
+        """Remove ``key`` and return its value (None if missing)."""
+        return self._data.pop(key, None)
+
     def items(self):
         return list(self._data.items())
 
@@ -47,6 +57,28 @@ class LRUCache:
             'misses': self.misses,
         }
 
+
+class UserVersions:
+    """Per-user version numbers, bumped by every storage write to ``collections``."""
+
+    def __init__(self, storage, collections):
+        self.collections = tuple(collections)
+        self._versions = {}
+        self._lock = threading.Lock()
+        storage.watch(self._on_write)
+
+    def _on_write(self, name, op, records):
+        if name not in self.collections:
+            return
+        with self._lock:
+            for user_id in {r.get('user_id') for r in records}:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def get(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+
 if __name__ == '__main__':
     # Quick manual test
     c = LRUCache(3)
@@ -0,0 +1,198 @@
+"""
+backend.ingest
+
+Group commit for high-rate reading ingestion (e.g. a CGM posting every
+few seconds for many users).
+
+Instead of one storage write (and one fsync) per request, request
+threads hand their records to a ``GroupCommitWriter`` and wait. A single
+flusher thread collects everything that arrives within ``max_delay_ms``
+of the first waiting record (or until ``max_batch`` records are
+waiting), stores the whole group with one ``insert_many`` and makes it
+durable with one ``storage.sync()``. Then every waiting request gets its
+stored record back, so a response is only sent once the reading is on
+disk.
+
+The flusher only lingers for ``max_delay_ms`` while writes are arriving
+concurrently (the last group held more than one request), and stops
+lingering as soon as as many requests are waiting as were in the last
+group. A lone writer is flushed right away, so light traffic pays no
+extra latency; records that arrive while a flush is running simply join
+the next group.
+
+One writer thread means writes never contend for the storage lock with
+each other, and the cost of a file write + fsync is shared by the whole
+group: the more concurrent writers, the bigger the groups.
+
+A submit that cannot be confirmed raises ``CommitError``. Its ``stored``
+is None when nothing was written (safe to resend), the stored records
+when the insert went through but the fsync failed (must not be resent),
+and ``UNKNOWN`` when the wait timed out while the group was already
+being written.
+"""
+import threading
+import time
+
+MAX_DELAY_MS = 2
+MAX_BATCH = 1000
+SUBMIT_TIMEOUT_SECONDS = 30
+UNKNOWN = 'unknown'
+
+
+class CommitError(Exception):
+    """A write that was not confirmed durable; ``stored`` says what was written."""
+
+    def __init__(self, message, stored=None):
+        super().__init__(message)
+        self.stored = stored
+
+
+class _Ticket:
+    """One waiting submit: its records, then its stored records or error."""
+
+    __slots__ = ('records', 'done', 'stored', 'error')
+
+    def __init__(self, records):
+        self.records = records
+        self.done = threading.Event()
+        self.stored = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    """
+    Batches inserts into one collection. ``submit`` blocks until the
+    record is stored (and fsynced when ``durable``).
+
+    Methods:
+    - submit(record) -> stored record
+    - submit_many(records) -> stored records (kept in one group)
+    - stats() -> batches, records, largest batch, last flush time
+    - stop()
+    """
+
+    def __init__(self, storage, collection='readings', max_delay_ms=MAX_DELAY_MS,
+                 max_batch=MAX_BATCH, durable=True):
+        self.storage = storage
+        self.collection = collection
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_batch = max_batch
+        self.durable = durable
+        self._pending = []
+        self._pending_count = 0
+        self._first_at = None
+        self._last_group = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = {'batches': 0, 'records': 0, 'largest_batch': 0, 'last_flush_ms': None}
+
+    def submit(self, record, timeout=SUBMIT_TIMEOUT_SECONDS):
+        return self.submit_many([record], timeout)[0]
+
+    def submit_many(self, records, timeout=SUBMIT_TIMEOUT_SECONDS):
+        if not records:
+            return []
+        ticket = _Ticket(list(records))
+        with self._cond:
+            self._ensure_started()
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append(ticket)
+            self._pending_count += len(ticket.records)
+            self._cond.notify()
+        if not ticket.done.wait(timeout):
+            with self._cond:
+                if ticket in self._pending:
+                    # Still waiting for a group: withdraw it, nothing was written
+                    self._pending.remove(ticket)
+                    self._pending_count -= len(ticket.records)
+                    raise CommitError("write was not committed in time")
+            if not ticket.done.is_set():
+                raise CommitError("write did not finish in time; it may have been stored", UNKNOWN)
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.stored
+
+    def stats(self):
+        with self._cond:
+            return {**self._stats, 'pending': self._pending_count,
+                    'max_delay_ms': self.max_delay * 1000, 'max_batch': self.max_batch}
+
+    def stop(self):
+        """Flush what is waiting and stop the flusher thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    # ---------------------- Flusher ----------------------
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+            self._thread.start()
+
+    def _next_group(self):
+        """Wait for a full group or for the delay to pass; return its tickets."""
+        with self._cond:
+            while not self._pending and self._running:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            deadline = self._first_at + (self.max_delay if self._last_group > 1 else 0)
+            while (self._running and self._pending_count < self.max_batch
+                   and len(self._pending) < self._last_group):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            group, count = [], 0
+            while self._pending and (not group or count + len(self._pending[0].records) <= self.max_batch):
+                ticket = self._pending.pop(0)
+                group.append(ticket)
+                count += len(ticket.records)
+            self._pending_count -= count
+            self._last_group = len(group)
+            self._first_at = time.monotonic() if self._pending else None
+            return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            if group is None:
+                return
+            self._flush(group)
+
+    def _flush(self, group):
+        started = time.perf_counter()
+        records = [r for ticket in group for r in ticket.records]
+        try:
+            stored = self.storage.insert_many(self.collection, records)
+        except Exception as e:
+            for ticket in group:
+                ticket.error = CommitError(f"write failed: {e}")
+                ticket.done.set()
+            return
+        error = None
+        if self.durable:
+            try:
+                self.storage.sync()
+            except Exception as e:
+                error = e
+        i = 0
+        for ticket in group:
+            ticket.stored = stored[i:i + len(ticket.records)]
+            i += len(ticket.records)
+            if error is not None:
+                ticket.error = CommitError(f"stored but not confirmed on disk: {error}", ticket.stored)
+            ticket.done.set()
+        with self._cond:
+            self._stats['batches'] += 1
+            self._stats['records'] += len(records)
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(records))
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
@@ -1,152 +1,262 @@
 """
 backend.models
 
-Simple JSON-backed data helpers for readings and foods.
-These functions mirror the JSON logic used by app.py but are separated
-so the backend folder is useful for future refactors or tests.
+Readings and foods on top of a storage engine.
+
+Every function takes the storage (see ``backend.storage``) as its first
+argument, so the same helpers work with the JSON, append-log and SQLite
+engines. Routes in ``backend.api`` and ``backend.pages`` call these
+instead of touching files.
 """
-from pathlib import Path
-import json
-from datetime import datetime
-import os
+from datetime import date as Date, datetime, time as Time, timedelta
+
+from .recommendations import glucose_value, parse_timestamp
+
+# Owner of the sample data (and of foods logged before foods had a user_id)
+DEMO_USER_ID = 1
+# A client-sent created_at may be this far ahead of the server clock
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+# Fields a client may set on a reading (everything else, e.g. user_id, is ignored)
+READING_FIELDS = ('glucose', 'context', 'meal', 'note', 'date', 'time', 'tz_offset', 'created_at')
+# Valid UTC offsets in minutes (UTC-12:00 to UTC+14:00)
+MIN_TZ_OFFSET, MAX_TZ_OFFSET = -12 * 60, 14 * 60
+
+SAMPLE_DATA = {
+    # Demo account: user@example.com / PIN 1234 (see backend.auth.hash_pin)
+    'users': [
+        {"id": 1, "email": "user@example.com", "pin_salt": "5f1c3a9e2b7d4c6a8e0f1a2b3c4d5e6f", "pin_hash": "28c3328e03c3738bac5b4810f4f713d2596e9fb9267877810aef7a2a94bbfb92", "created_at": "2025-11-25T00:00:00Z"},
+    ],
+    'readings': [
+        {"id": 1, "user_id": 1, "date": "2025-11-25", "time": "08:00", "glucose": 95.0, "context": "fasting", "meal": "water", "note": "morning check", "created_at": "2025-11-25T08:00:00Z"},
+        {"id": 2, "user_id": 1, "date": "2025-11-25", "time": "12:30", "glucose": 142.0, "context": "pre-meal", "meal": "lunch", "note": "before eating", "created_at": "2025-11-25T12:30:00Z"},
+        {"id": 3, "user_id": 1, "date": "2025-11-25", "time": "15:00", "glucose": 185.0, "context": "post-meal", "meal": "snack", "note": "high reading", "created_at": "2025-11-25T15:00:00Z"},
+        {"id": 4, "user_id": 1, "date": "2025-11-26", "time": "06:30", "glucose": 65.0, "context": "fasting", "meal": "water", "note": "low reading", "created_at": "2025-11-26T06:30:00Z"},
+        {"id": 5, "user_id": 1, "date": "2025-11-26", "time": "11:00", "glucose": 115.0, "context": "pre-meal", "meal": "breakfast", "note": "normal", "created_at": "2025-11-26T11:00:00Z"},
+        {"id": 6, "user_id": 1, "date": "2025-11-27", "time": "14:00", "glucose": 220.0, "context": "post-meal", "meal": "dinner", "note": "elevated", "created_at": "2025-11-27T14:00:00Z"},
+    ],
+    'foods': [
+        {"id": 1, "user_id": 1, "date": "2025-11-25", "time": "08:30", "food": "Oatmeal with berries"},
+        {"id": 2, "user_id": 1, "date": "2025-11-25", "time": "12:30", "food": "Grilled chicken and vegetables"},
+        {"id": 3, "user_id": 1, "date": "2025-11-25", "time": "18:00", "food": "Fish with steamed broccoli"},
+    ],
+}
+
+
+def utc_now_iso():
+    """Current UTC time in the stored ``created_at`` format."""
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def init_db(storage):
+    """Seed empty collections with the sample data."""
+    for name, records in SAMPLE_DATA.items():
+        if storage.count(name) == 0:
+            storage.insert_many(name, records)
+
+
+def history_sort_key(record):
+    """(date, time) for sorting; falls back to created_at for API-added readings."""
+    created = record.get('created_at') or ''
+    return (record.get('date') or created[:10], record.get('time') or created[11:16])
+
+
+def parse_tz_offset(value):
+    """``tz`` (minutes east of UTC, e.g. 120 for UTC+2) -> int; empty is 0. Raises ValueError."""
+    if value in (None, ''):
+        return 0
+    try:
+        offset = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"tz must be a whole number of minutes, not {value!r}") from None
+    if not MIN_TZ_OFFSET <= offset <= MAX_TZ_OFFSET:
+        raise ValueError(f"tz must be between {MIN_TZ_OFFSET} and {MAX_TZ_OFFSET} minutes")
+    return offset
 
-DATA_DIR = Path(__file__).resolve().parents[1] / 'data'
-READINGS_FILE = DATA_DIR / 'readings.json'
-FOODS_FILE = DATA_DIR / 'foods.json'
 
+def is_wall_clock(record):
+    """
+    True for a reading stored before readings recorded their UTC offset:
+    its date/time is the only measurement time and its zone is unknown.
+    Every other reading's created_at (naive UTC) is when it was taken.
+    """
+    return 'tz_offset' not in record and bool(record.get('date') and record.get('time'))
 
-def _ensure_data_dir():
-    DATA_DIR.mkdir(exist_ok=True)
 
+def reading_time(record):
+    """When a reading was taken, naive UTC (see ``is_wall_clock`` for old form readings)."""
+    if is_wall_clock(record):
+        try:
+            return datetime.fromisoformat(f"{record['date']}T{record['time']}")
+        except ValueError:
+            pass
+    return parse_timestamp(record['created_at'])
 
-def load_json(file_path):
-    """Load JSON from a file path; return empty list on errors."""
-    _ensure_data_dir()
-    try:
-        if not os.path.exists(file_path):
-            return []
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return []
 
+def _utc_from_local(date, time, tz_offset):
+    local = datetime.fromisoformat(f"{date}T{time}")
+    return (local - timedelta(minutes=tz_offset)).isoformat() + 'Z'
 
-def save_json(file_path, data):
-    """Save Python object to JSON file. Returns True on success."""
-    _ensure_data_dir()
+
+def try_reading_time(record):
+    """``reading_time``, or None for a record without a usable time."""
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print(f"Error saving {file_path}: {e}")
-        return False
+        return reading_time(record)
+    except (KeyError, TypeError, ValueError):
+        return None
 
 
 # ---------------------- Readings API ----------------------
 
-def init_db():
-    """Seed files with example data if empty."""
-    _ensure_data_dir()
-
-    readings = load_json(READINGS_FILE)
-    if not readings:
-        sample_readings = [
-            {"id": 1, "user_id": 1, "date": "2025-11-25", "time": "08:00", "glucose": 95.0, "context": "fasting", "meal": "water", "note": "morning check", "created_at": "2025-11-25T08:00:00Z"},
-            {"id": 2, "user_id": 1, "date": "2025-11-25", "time": "12:30", "glucose": 142.0, "context": "pre-meal", "meal": "lunch", "note": "before eating", "created_at": "2025-11-25T12:30:00Z"},
-            {"id": 3, "user_id": 1, "date": "2025-11-25", "time": "15:00", "glucose": 185.0, "context": "post-meal", "meal": "snack", "note": "high reading", "created_at": "2025-11-25T15:00:00Z"},
-            {"id": 4, "user_id": 1, "date": "2025-11-26", "time": "06:30", "glucose": 65.0, "context": "fasting", "meal": "water", "note": "low reading", "created_at": "2025-11-26T06:30:00Z"},
-            {"id": 5, "user_id": 1, "date": "2025-11-26", "time": "11:00", "glucose": 115.0, "context": "pre-meal", "meal": "breakfast", "note": "normal", "created_at": "2025-11-26T11:00:00Z"},
-            {"id": 6, "user_id": 1, "date": "2025-11-27", "time": "14:00", "glucose": 220.0, "context": "post-meal", "meal": "dinner", "note": "elevated", "created_at": "2025-11-27T14:00:00Z"},
-        ]
-        save_json(READINGS_FILE, sample_readings)
-
-    foods = load_json(FOODS_FILE)
-    if not foods:
-        sample_foods = [
-            {"id": 1, "date": "2025-11-25", "time": "08:30", "food": "Oatmeal with berries"},
-            {"id": 2, "date": "2025-11-25", "time": "12:30", "food": "Grilled chicken and vegetables"},
-            {"id": 3, "date": "2025-11-25", "time": "18:00", "food": "Fish with steamed broccoli"},
-        ]
-        save_json(FOODS_FILE, sample_foods)
-
-
-def add_reading(user_id, glucose, context='general', meal='', note=''):
+def add_reading(storage, user_id, glucose, context='general', meal='', note='', date=None, time=None,
+                tz_offset=None):
     """Add a reading and return the new record."""
-    readings = load_json(READINGS_FILE)
-    new_id = max([r.get('id', 0) for r in readings], default=0) + 1
-    new_reading = {
-        'id': new_id,
-        'user_id': user_id,
-        'glucose': float(glucose),
+    return storage.insert('readings', reading_record(user_id, glucose, context, meal, note, date, time,
+                                                     tz_offset=tz_offset))
+
+
+def _checked_glucose(glucose):
+    value = glucose_value({'glucose': glucose})
+    if value is None:
+        raise ValueError(f"glucose must be a number, not {glucose!r}")
+    return value
+
+
+def _checked_created_at(created_at):
+    try:
+        when = parse_timestamp(created_at)
+    except (TypeError, ValueError):
+        raise ValueError(f"created_at must be a timestamp, not {created_at!r}") from None
+    if when > datetime.utcnow() + MAX_CLOCK_SKEW:
+        raise ValueError("created_at is in the future")
+    # Stored in one format (naive UTC + 'Z'), whatever offset the client sent
+    return when.isoformat() + 'Z'
+
+
+def _checked_date_time(date, time):
+    try:
+        # Empty means "not given" (reading_time then uses created_at)
+        if date:
+            Date.fromisoformat(date)
+        if time:
+            Time.fromisoformat(time)
+    except (TypeError, ValueError):
+        raise ValueError(f"date/time must look like 2025-11-25 and 08:00, not {date!r} {time!r}") from None
+
+
+def reading_changes(data, existing=None):
+    """
+    The fields of an edit that may be stored: only ``READING_FIELDS``,
+    checked like ``reading_record`` checks a new reading. Raises ValueError.
+    A new date/time or tz_offset for ``existing`` moves its created_at too,
+    unless the edit sets created_at itself.
+    """
+    fields = {k: data[k] for k in READING_FIELDS if k in data}
+    if 'glucose' in fields:
+        fields['glucose'] = _checked_glucose(fields['glucose'])
+    if 'created_at' in fields:
+        fields['created_at'] = _checked_created_at(fields['created_at'])
+    if 'tz_offset' in fields:
+        fields['tz_offset'] = parse_tz_offset(fields['tz_offset'])
+    _checked_date_time(fields.get('date'), fields.get('time'))
+    if existing is not None and 'created_at' not in fields and fields.keys() & {'date', 'time', 'tz_offset'}:
+        merged = {**existing, **fields}
+        if merged.get('date') and merged.get('time'):
+            fields['tz_offset'] = merged.get('tz_offset') or 0
+            fields['created_at'] = _checked_created_at(
+                _utc_from_local(merged['date'], merged['time'], fields['tz_offset']))
+    return fields
+
+
+def reading_record(user_id, glucose, context='general', meal='', note='', date=None, time=None,
+                   created_at=None, tz_offset=None):
+    """A new reading (not stored yet). ``created_at`` is when it was taken,
+    naive UTC: sent by offline clients, else the form's local date/time
+    moved by ``tz_offset`` (minutes east of UTC, default 0), else now.
+    Raises ValueError for a glucose that is not a number, a date/time that
+    is not one, a bad tz_offset, or a created_at that is not a timestamp or
+    lies in the future."""
+    value = _checked_glucose(glucose)
+    _checked_date_time(date, time)
+    tz_offset = parse_tz_offset(tz_offset)
+    if created_at is None and date and time:
+        created_at = _utc_from_local(date, time, tz_offset)
+    if created_at is not None:
+        created_at = _checked_created_at(created_at)
+    record = {'user_id': user_id}
+    if date is not None or time is not None:
+        record.update({'date': date, 'time': time, 'tz_offset': tz_offset})
+    record.update({
+        'glucose': value,
         'context': context,
         'meal': meal,
         'note': note,
-        'created_at': datetime.utcnow().isoformat() + 'Z'
-    }
-    readings.append(new_reading)
-    save_json(READINGS_FILE, readings)
-    return new_reading
+        'created_at': created_at or utc_now_iso(),
+    })
+    return record
 
 
-def get_readings(user_id=None, limit=50):
-    """Return list of readings (newest first)."""
-    readings = load_json(READINGS_FILE)
-    if user_id is not None:
-        readings = [r for r in readings if r.get('user_id') == user_id]
-    readings = sorted(readings, key=lambda r: r.get('created_at', ''), reverse=True)
-    return readings[:limit]
+def import_readings(storage, user_id, readings):
+    """
+    Insert many readings in one write. Returns the stored records.
+    Every reading is checked like a single one (``reading_record``) first;
+    one bad reading raises ValueError and nothing is stored.
+    """
+    created_at = utc_now_iso()
+    records = []
+    for i, r in enumerate(readings):
+        try:
+            records.append(reading_record(user_id, r.get('glucose'), r.get('context', 'general'),
+                                          r.get('meal', ''), r.get('note', ''),
+                                          created_at=r.get('created_at') or created_at))
+        except (AttributeError, ValueError) as e:
+            raise ValueError(f"reading {i}: {e}") from None
+    return storage.insert_many('readings', records)
 
 
-def get_reading(reading_id):
-    readings = load_json(READINGS_FILE)
-    return next((r for r in readings if r.get('id') == reading_id), None)
+def get_readings(storage, user_id=None, limit=50, oldest_first=False):
+    """Return list of readings (newest first unless ``oldest_first``)."""
+    readings = storage.filter('readings', user_id=user_id) if user_id is not None else storage.all('readings')
+    readings = sorted(readings, key=lambda r: r.get('created_at', ''), reverse=not oldest_first)
+    return readings[:limit] if limit is not None else readings
 
 
-def update_reading(reading_id, **fields):
-    readings = load_json(READINGS_FILE)
-    updated = None
-    for r in readings:
-        if r.get('id') == reading_id:
-            r.update(fields)
-            updated = r
-            break
-    if updated:
-        save_json(READINGS_FILE, readings)
-    return updated
+def get_reading(storage, reading_id):
+    return storage.find('readings', reading_id)
+
 
+def update_reading(storage, reading_id, **fields):
+    """Apply an edit (see ``reading_changes``; other fields are ignored). Raises ValueError."""
+    return storage.update('readings', reading_id, reading_changes(fields, storage.find('readings', reading_id)))
 
-def delete_reading(reading_id):
-    readings = load_json(READINGS_FILE)
-    new = [r for r in readings if r.get('id') != reading_id]
-    save_json(READINGS_FILE, new)
-    return True
+
+def delete_reading(storage, reading_id):
+    return storage.delete('readings', reading_id)
+
+
+def readings_csv(readings):
+    """CSV text for the export endpoint."""
+    csv_lines = ["id,user_id,glucose,context,meal,note,created_at"]
+    for r in readings:
+        csv_lines.append(f"{r['id']},{r['user_id']},{r['glucose']},{r['context']},{r['meal']},{r['note']},{r['created_at']}")
+    return "\n".join(csv_lines)
 
 
 # ---------------------- Foods API ----------------------
 
-def add_food(date, time, food_text):
-    foods = load_json(FOODS_FILE)
-    new_id = max([f.get('id', 0) for f in foods], default=0) + 1
-    new_food = {'id': new_id, 'date': date, 'time': time, 'food': food_text}
-    foods.append(new_food)
-    save_json(FOODS_FILE, foods)
-    return new_food
+def add_food(storage, user_id, date, time, food_text):
+    return storage.insert('foods', {'user_id': user_id, 'date': date, 'time': time, 'food': food_text})
 
 
-def get_foods(limit=100):
-    foods = load_json(FOODS_FILE)
-    foods = sorted(foods, key=lambda f: (f.get('date', ''), f.get('time', '')), reverse=True)
-    return foods[:limit]
+def get_foods(storage, user_id, limit=100):
+    """A user's foods (newest first). Foods without a user_id belong to the demo user."""
+    foods = [f for f in storage.all('foods') if f.get('user_id', DEMO_USER_ID) == user_id]
+    foods = sorted(foods, key=history_sort_key, reverse=True)
+    return foods[:limit] if limit is not None else foods
 
 
-def get_food(food_id):
-    foods = load_json(FOODS_FILE)
-    return next((f for f in foods if f.get('id') == food_id), None)
+def get_food(storage, food_id):
+    return storage.find('foods', food_id)
 
 
-def delete_food(food_id):
-    foods = load_json(FOODS_FILE)
-    new = [f for f in foods if f.get('id') != food_id]
-    save_json(FOODS_FILE, new)
-    return True
+def delete_food(storage, food_id):
+    return storage.delete('foods', food_id)
@@ -0,0 +1,164 @@
+"""
+backend.pages
+
+HTML page blueprint (forms and history). Registered by ``create_app``
+in ``app.py`` without a prefix.
+
+Form and history pages need a session (the ``tracker_session`` cookie set
+by ``/api/login``) and show only the logged-in user's data.
+"""
+from datetime import datetime
+
+from flask import Blueprint, Response, g, redirect, render_template, request, url_for
+
+from . import models
+from .auth import login_required
+from .quotas import QuotaExceeded
+from .reports import FPDF, REPORT_DAYS, parse_tz_offset, period, render_html, render_pdf
+from .services import service
+
+pages_bp = Blueprint('pages_bp', __name__)
+
+storage = service('storage')
+recommendation_engine = service('recommendations')
+reading_cache = service('cache')
+alert_evaluator = service('alerts')
+sessions = service('sessions')
+quotas = service('quotas')
+retention = service('retention')
+reports = service('reports')
+
+# How long a page request waits for a report before showing "preparing"
+REPORT_WAIT_SECONDS = 10
+
+
+def _login_page():
+    return redirect('/static/login.html')
+
+
+def get_recommendation(glucose_level, context=None, trend=None):
+    """
+    Return a friendly recommendation based on glucose level.
+    Context (fasting/post-meal) and trend (falling/rising) refine the match.
+    """
+    return recommendation_engine.recommend(glucose_level, context, trend)
+
+
+@pages_bp.route('/')
+def index():
+    """Home page with large friendly buttons."""
+    return render_template('index.html')
+
+
+@pages_bp.route('/add-reading', methods=['GET', 'POST'])
+@login_required(sessions, _login_page)
+def add_reading():
+    """Add a blood sugar reading."""
+    recommendation = None
+
+    if request.method == 'POST':
+        try:
+            glucose = float(request.form.get('glucose'))
+            context = request.form.get('context', 'fasting')
+            trend = recommendation_engine.classify_trend(alert_evaluator.slope(g.user_id, glucose))
+
+            quotas.check_write(g.user_id, 1)
+            new_reading = models.add_reading(
+                storage, g.user_id, glucose, context,
+                request.form.get('meal', ''), request.form.get('note', ''),
+                date=request.form.get('date'), time=request.form.get('time'),
+                tz_offset=request.form.get('tz'),
+            )
+            quotas.record_writes(g.user_id, 1)
+
+            # Get recommendation
+            recommendation = get_recommendation(glucose, context, trend)
+
+            # Add to cache
+            reading_cache.put(new_reading['id'], new_reading)
+            alert_evaluator.observe(new_reading)
+
+            print(f"✓ Added reading: {glucose} mg/dL")
+
+        except (ValueError, QuotaExceeded) as e:
+            print(f"Error: {e}")
+
+    # Pre-fill with today's date and current time
+    today = datetime.now().strftime('%Y-%m-%d')
+    now = datetime.now().strftime('%H:%M')
+
+    return render_template('add_reading.html', recommendation=recommendation, today=today, now=now)
+
+
+@pages_bp.route('/add-food', methods=['GET', 'POST'])
+@login_required(sessions, _login_page)
+def add_food():
+    """Add a food intake record."""
+    if request.method == 'POST':
+        try:
+            food = request.form.get('food')
+            models.add_food(storage, g.user_id, request.form.get('date'), request.form.get('time'), food)
+            print(f"✓ Added food: {food}")
+
+        except Exception as e:
+            print(f"Error: {e}")
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    now = datetime.now().strftime('%H:%M')
+
+    return render_template('add_food.html', today=today, now=now)
+
+
+@pages_bp.route('/history')
+@login_required(sessions, _login_page)
+def history():
+    """Show your history of readings (archived ones included) and food intake."""
+    readings = list(retention.archived_readings(g.user_id)) + storage.filter('readings', user_id=g.user_id)
+    readings = sorted(readings, key=models.history_sort_key, reverse=True)
+    foods = models.get_foods(storage, g.user_id, limit=None)
+
+    return render_template('history.html', readings=readings, foods=foods)
+
+
+def _report_period():
+    """``?days=14`` (1 to 90) and ``?tz=<minutes east of UTC>`` -> (start, end, tz offset)."""
+    try:
+        days = min(max(int(request.args.get('days', REPORT_DAYS)), 1), 90)
+    except ValueError:
+        days = REPORT_DAYS
+    try:
+        tz_offset = parse_tz_offset(request.args.get('tz'))
+    except ValueError:
+        tz_offset = 0
+    return period(days, tz_offset=tz_offset) + (tz_offset,)
+
+
+@pages_bp.route('/report')
+@login_required(sessions, _login_page)
+def report():
+    """Clinician summary: AGP chart, time in ranges, lows/highs, food impact."""
+    start, end, tz_offset = _report_period()
+    html = reports.rendered(g.user_id, start, end, 'html', render_html, wait=REPORT_WAIT_SECONDS,
+                            tz_offset=tz_offset)
+    return html if html is not None else render_html(None)
+
+
+@pages_bp.route('/report.pdf')
+@login_required(sessions, _login_page)
+def report_pdf():
+    """The same report as a PDF (needs the optional fpdf2 package)."""
+    if FPDF is None:
+        return Response("PDF reports need the fpdf2 package: pip install fpdf2", 501, mimetype='text/plain')
+    start, end, tz_offset = _report_period()
+    pdf = reports.rendered(g.user_id, start, end, 'pdf', render_pdf, wait=REPORT_WAIT_SECONDS,
+                           tz_offset=tz_offset)
+    if pdf is None:
+        return Response("Your report is being prepared, try again in a moment.", 503,
+                        mimetype='text/plain', headers={'Retry-After': '3'})
+    return Response(pdf, mimetype='application/pdf')
+
+
+@pages_bp.route('/<path:path>')
+def catch_all(path):
+    """Redirect unknown routes to static index.html"""
+    return redirect(url_for('pages_bp.index'))
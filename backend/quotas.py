@@ -0,0 +1,126 @@
+"""
+backend.quotas
+
+Per-tenant rate limits and storage quotas with token buckets.
+
+Each user (tenant) gets their own buckets, so one patient's bulk import
+drains only that patient's write bucket and never slows down anyone
+else's requests:
+
+- request bucket: every authenticated API call costs 1 token
+- write bucket: every stored reading costs 1 token, so an import of
+  N readings costs N (and is refused, not queued, if the bucket is short)
+- a hard cap on how many readings one user may keep in total
+
+Buckets refill lazily from ``time.monotonic()`` when they are used, so
+there is no background timer.
+"""
+import threading
+import time
+
+from .cache import LRUCache
+
+REQUESTS_PER_SECOND = 20
+REQUEST_BURST = 40
+WRITES_PER_SECOND = 50
+WRITE_BURST = 5000
+MAX_READINGS_PER_USER = 1_000_000
+MAX_IMPORT_BATCH = 5000
+# Keep at most this many buckets; an evicted tenant simply starts full again
+MAX_TRACKED_TENANTS = 100_000
+
+
+class QuotaExceeded(Exception):
+    """Raised when a tenant is over a limit. ``status`` is the HTTP status to return."""
+
+    def __init__(self, message, retry_after=None, status=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second up to ``capacity``."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, cost=1, now=None):
+        """Take ``cost`` tokens. Returns 0 on success, else seconds until possible."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if cost > self.capacity:
+            return float('inf')
+        return (cost - self.tokens) / self.rate
+
+
+class TenantLimiter:
+    """One ``TokenBucket`` per key (user id, email, ...)."""
+
+    def __init__(self, rate, capacity, max_tenants=MAX_TRACKED_TENANTS):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = LRUCache(max_tenants)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost=1):
+        """Returns 0 if allowed, else seconds to wait (inf if cost > capacity)."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets.put(key, bucket)
+            return bucket.take(cost)
+
+
+class TenantQuotas:
+    """Request, write and storage limits for every tenant."""
+
+    def __init__(self, storage, requests_per_second=REQUESTS_PER_SECOND, request_burst=REQUEST_BURST,
+                 writes_per_second=WRITES_PER_SECOND, write_burst=WRITE_BURST,
+                 max_readings=MAX_READINGS_PER_USER, max_batch=MAX_IMPORT_BATCH):
+        self.storage = storage
+        self.requests = TenantLimiter(requests_per_second, request_burst)
+        self.writes = TenantLimiter(writes_per_second, write_burst)
+        self.max_readings = max_readings
+        self.max_batch = max_batch
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def check_request(self, user_id):
+        wait = self.requests.take(user_id)
+        if wait:
+            raise QuotaExceeded("Too many requests, please slow down", retry_after=wait)
+
+    def reading_count(self, user_id):
+        with self._lock:
+            if user_id not in self._counts:
+                self._counts[user_id] = len(self.storage.filter('readings', user_id=user_id))
+            return self._counts[user_id]
+
+    def check_write(self, user_id, count=1):
+        """Reserve room for ``count`` new readings or raise QuotaExceeded."""
+        if count > self.max_batch:
+            raise QuotaExceeded(f"At most {self.max_batch} readings per request", status=413)
+        if self.reading_count(user_id) + count > self.max_readings:
+            raise QuotaExceeded(f"Storage quota of {self.max_readings} readings reached", status=507)
+        wait = self.writes.take(user_id, count)
+        if wait:
+            raise QuotaExceeded("Write rate limit reached, please retry later", retry_after=wait)
+
+    def record_writes(self, user_id, count=1):
+        with self._lock:
+            if user_id in self._counts:
+                self._counts[user_id] += count
+
+    def record_deletes(self, user_id, count=1):
+        self.record_writes(user_id, -count)
@@ -0,0 +1,284 @@
+"""
+backend.recommendations
+
+Data-driven recommendation engine.
+
+Rules live in a JSON config file (``recommendation_rules.json`` next to this
+module by default) instead of if/elif chains. Each rule names a glucose band
+and may be narrowed to a reading context (``fasting``, ``post-meal``, ...)
+and/or a trend (``falling_fast`` ... ``rising_fast``). Bands use any of:
+
+- ``min`` / ``max``: inclusive bounds
+- ``above`` / ``below``: exclusive bounds
+
+At load time the rules are compiled into one sorted threshold table per
+(context, trend) pair, so a lookup is a ``bisect`` instead of a chain of
+comparisons. A lookup tries the most specific table first and falls back:
+(context, trend) -> (context, any) -> (any, trend) -> (any, any).
+"""
+import bisect
+import json
+import math
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+DEFAULT_RULES_FILE = Path(__file__).resolve().parent / 'recommendation_rules.json'
+
+TRENDS = ('falling_fast', 'falling', 'steady', 'rising', 'rising_fast')
+
+DEFAULT_TREND = {
+    'window_minutes': 30,
+    'falling_fast': -2.0,
+    'falling': -1.0,
+    'rising': 1.0,
+    'rising_fast': 2.0,
+}
+
+# Values are compared as (value, 0.5) against edges of the form (bound, 0|1):
+# (b, 0) sits just below b and (b, 1) just above it, which lets inclusive and
+# exclusive bounds share one sorted list.
+_PROBE = 0.5
+
+
+class RuleError(ValueError):
+    """Raised when the rules config is malformed or has overlapping bands."""
+
+
+def parse_timestamp(value):
+    """
+    Parse a stored ``created_at`` string (``...Z``) into a naive UTC datetime.
+    A value with another UTC offset (``+02:00``) is converted to UTC.
+    """
+    when = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).rstrip('Z'))
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def glucose_value(record):
+    """A record's glucose as a float, or None if it is missing or not a finite number."""
+    try:
+        value = float(record.get('glucose'))
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _lower_edge(rule):
+    if 'min' in rule and 'above' in rule:
+        raise RuleError(f"rule {rule.get('level')!r}: use either 'min' or 'above'")
+    if 'min' in rule:
+        return (float(rule['min']), 0)
+    if 'above' in rule:
+        return (float(rule['above']), 1)
+    return (-math.inf, 0)
+
+
+def _upper_edge(rule):
+    if 'max' in rule and 'below' in rule:
+        raise RuleError(f"rule {rule.get('level')!r}: use either 'max' or 'below'")
+    if 'max' in rule:
+        return (float(rule['max']), 1)
+    if 'below' in rule:
+        return (float(rule['below']), 0)
+    return (math.inf, 1)
+
+
+class ThresholdTable:
+    """Non-overlapping glucose bands sorted by lower edge."""
+
+    __slots__ = ('lowers', 'uppers', 'rules')
+
+    def __init__(self, rules):
+        compiled = sorted(((_lower_edge(r), _upper_edge(r), r) for r in rules), key=lambda t: t[0])
+        for (lo, hi, rule) in compiled:
+            if not lo < hi:
+                raise RuleError(f"rule {rule.get('level')!r} has an empty band")
+        for prev, cur in zip(compiled, compiled[1:]):
+            if cur[0] < prev[1]:
+                raise RuleError(f"rules {prev[2].get('level')!r} and {cur[2].get('level')!r} overlap")
+        self.lowers = [c[0] for c in compiled]
+        self.uppers = [c[1] for c in compiled]
+        self.rules = [c[2] for c in compiled]
+
+    def lookup(self, value):
+        """Return the rule whose band contains ``value`` or None."""
+        key = (value, _PROBE)
+        i = bisect.bisect_right(self.lowers, key) - 1
+        if i >= 0 and key < self.uppers[i]:
+            return self.rules[i]
+        return None
+
+    def sweep(self, pairs):
+        """Match ``(value, index)`` pairs sorted by value in one merge pass.
+
+        Returns ``(matched, unmatched)`` where matched is a list of
+        ``(index, rule)`` and unmatched keeps the input order.
+        """
+        matched, unmatched = [], []
+        lowers, uppers, rules = self.lowers, self.uppers, self.rules
+        n = len(lowers)
+        i = -1
+        for value, idx in pairs:
+            key = (value, _PROBE)
+            while i + 1 < n and lowers[i + 1] <= key:
+                i += 1
+            if i >= 0 and key < uppers[i]:
+                matched.append((idx, rules[i]))
+            else:
+                unmatched.append((value, idx))
+        return matched, unmatched
+
+
+class RecommendationEngine:
+    """Compiled rule set with single and batch evaluation."""
+
+    def __init__(self, rules, trend=None):
+        self.trend_config = {**DEFAULT_TREND, **(trend or {})}
+        self.window_minutes = float(self.trend_config['window_minutes'])
+
+        grouped = defaultdict(list)
+        for rule in rules:
+            if 'level' not in rule or 'message' not in rule:
+                raise RuleError(f"rule {rule!r} needs 'level' and 'message'")
+            trend_name = rule.get('trend')
+            if trend_name is not None and trend_name not in TRENDS:
+                raise RuleError(f"rule {rule['level']!r}: unknown trend {trend_name!r}")
+            grouped[(rule.get('context'), trend_name)].append(rule)
+        self.tables = {key: ThresholdTable(group) for key, group in grouped.items()}
+        self._chains = {}
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_RULES_FILE):
+        """Load and compile rules from a JSON config file."""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return cls(config.get('rules', []), config.get('trend'))
+
+    # ---------------------- Single evaluation ----------------------
+
+    def _chain(self, context, trend):
+        """Tables to try for a (context, trend) pair, most specific first."""
+        key = (context, trend)
+        chain = self._chains.get(key)
+        if chain is None:
+            candidates = [(context, trend), (context, None), (None, trend), (None, None)]
+            seen = []
+            for candidate in candidates:
+                if candidate in self.tables and candidate not in seen:
+                    seen.append(candidate)
+            chain = self._chains[key] = [self.tables[c] for c in seen]
+        return chain
+
+    def classify_trend(self, rate):
+        """Map a rate of change (mg/dL per minute) to a trend name."""
+        if rate is None:
+            return None
+        cfg = self.trend_config
+        if rate <= cfg['falling_fast']:
+            return 'falling_fast'
+        if rate <= cfg['falling']:
+            return 'falling'
+        if rate >= cfg['rising_fast']:
+            return 'rising_fast'
+        if rate >= cfg['rising']:
+            return 'rising'
+        return 'steady'
+
+    def evaluate(self, glucose, context=None, trend=None):
+        """Return the matching rule dict for a single reading (or None)."""
+        value = float(glucose)
+        for table in self._chain(context, trend):
+            rule = table.lookup(value)
+            if rule is not None:
+                return rule
+        return None
+
+    def recommend(self, glucose, context=None, trend=None):
+        """Return the recommendation message for a single reading."""
+        rule = self.evaluate(glucose, context, trend)
+        return rule['message'] if rule else None
+
+    # ---------------------- Batch evaluation ----------------------
+
+    def annotate(self, readings):
+        """Annotate many readings in one pass.
+
+        Trends are computed per user with a sliding window over readings
+        sorted by ``created_at``. Readings are then grouped by
+        (context, trend), sorted by glucose, and swept through each group's
+        threshold tables, so the cost is one sort plus one linear merge
+        rather than a bisect chain per reading.
+
+        Returns a list of dicts (same order as ``readings``) with
+        ``id``, ``level``, ``trend`` and ``rate``. A reading without a
+        numeric glucose gets level and trend None instead of failing the batch.
+        """
+        n = len(readings)
+        rates = [None] * n
+        values = [glucose_value(r) for r in readings]
+
+        by_user = defaultdict(list)
+        for idx, r in enumerate(readings):
+            if not r.get('created_at') or values[idx] is None:
+                continue
+            try:
+                by_user[r.get('user_id')].append((parse_timestamp(r['created_at']), idx))
+            except ValueError:
+                continue
+
+        window_seconds = self.window_minutes * 60.0
+        for entries in by_user.values():
+            entries.sort()
+            window = deque()
+            for t, idx in entries:
+                g = values[idx]
+                while window and (t - window[0][0]).total_seconds() > window_seconds:
+                    window.popleft()
+                if window:
+                    minutes = (t - window[0][0]).total_seconds() / 60.0
+                    if minutes > 0:
+                        rates[idx] = (g - window[0][1]) / minutes
+                window.append((t, g))
+
+        trends = [self.classify_trend(rate) for rate in rates]
+
+        groups = defaultdict(list)
+        for idx, r in enumerate(readings):
+            if values[idx] is None:
+                trends[idx] = None
+                continue
+            groups[(r.get('context'), trends[idx])].append((values[idx], idx))
+
+        levels = [None] * n
+        for (context, trend), pairs in groups.items():
+            pairs.sort()
+            for table in self._chain(context, trend):
+                matched, pairs = table.sweep(pairs)
+                for idx, rule in matched:
+                    levels[idx] = rule['level']
+                if not pairs:
+                    break
+
+        return [
+            {
+                'id': readings[i].get('id'),
+                'level': levels[i],
+                'trend': trends[i],
+                'rate': round(rates[i], 3) if rates[i] is not None else None,
+            }
+            for i in range(n)
+        ]
+
+
+if __name__ == '__main__':
+    engine = RecommendationEngine.from_file()
+    for g, ctx in [(65, 'fasting'), (95, 'fasting'), (150, 'fasting'), (185, 'post-meal'), (260, None)]:
+        print(g, ctx, '->', engine.evaluate(g, ctx)['level'])
+    sample = [
+        {'id': 1, 'user_id': 1, 'glucose': 130, 'context': 'general', 'created_at': '2025-11-25T08:00:00Z'},
+        {'id': 2, 'user_id': 1, 'glucose': 110, 'context': 'general', 'created_at': '2025-11-25T08:05:00Z'},
+        {'id': 3, 'user_id': 1, 'glucose': 92, 'context': 'general', 'created_at': '2025-11-25T08:10:00Z'},
+    ]
+    print('Batch:', engine.annotate(sample))
@@ -0,0 +1,556 @@
+"""
+backend.reports
+
+Clinician summary reports: an AGP-style percentile chart, time in
+ranges, lows and highs, and food impact for one user and period.
+
+The pipeline has three steps:
+
+1. ``collect`` reads the period's readings (live ones plus only the
+   archive segments that overlap the period) and foods into compact
+   ``array('d')`` columns. This runs in the app process, next to the
+   storage. Every time is the user's local time: readings (UTC
+   ``created_at``) are moved by the request's ``tz_offset`` (minutes east
+   of UTC); foods and form readings stored before readings recorded their
+   offset already are local. So the AGP chart, days and meals line up.
+2. ``compute_report`` turns those columns into the report. It is a plain
+   function of plain data, so it runs in a process pool: reports for many
+   users (``generate_many``) are computed on all CPU cores at once.
+3. ``render_html`` (Jinja template ``report.html``) and ``render_pdf``
+   (optional, needs the pure-Python ``fpdf2`` package) draw the result.
+   The template only loops over 48 AGP slots and a few summary rows,
+   never over every reading.
+
+``ReportService`` runs steps 1-2 in a background thread pool and caches
+each report, and each rendered format, by (user, period, tz offset, data
+version).
+The version goes up on every write to the user's readings or foods
+(``UserVersions``), so a repeat view costs a dictionary lookup and a
+new reading makes the next view rebuild.
+
+    python -m backend.reports --days 14 --out reports    # every user, all cores
+"""
+import math
+import multiprocessing
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+
+from . import models
+from .models import parse_tz_offset
+from .cache import LRUCache, UserVersions
+
+try:
+    from fpdf import FPDF
+except ImportError:  # optional: PDF reports need ``pip install fpdf2``
+    FPDF = None
+
+REPORT_DAYS = 14
+REPORT_PROCESSES = int(os.environ.get('TRACKER_REPORT_PROCESSES', os.cpu_count() or 1))
+CACHE_SIZE = 64
+# Writes to these collections change a report
+REPORT_COLLECTIONS = ('readings', 'foods')
+
+# Consensus glucose ranges (mg/dL): (key, label, upper bound inclusive)
+RANGES = [
+    ('very_low', 'Very low (<54)', 53.9),
+    ('low', 'Low (54-69)', 69.9),
+    ('in_range', 'In range (70-180)', 180),
+    ('high', 'High (181-250)', 250),
+    ('very_high', 'Very high (>250)', float('inf')),
+]
+LOW, HIGH = 70, 180
+AGP_SLOT_MINUTES = 30
+PERCENTILES = (5, 25, 50, 75, 95)
+# A gap longer than this ends a low/high episode
+EPISODE_GAP_SECONDS = 30 * 60
+# Food impact: baseline up to 1 h before the meal, peak within 3 h after
+FOOD_BASELINE_SECONDS = 60 * 60
+FOOD_WINDOW_SECONDS = 3 * 60 * 60
+TOP_N = 10
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(when):
+    return (when - _EPOCH).total_seconds()
+
+
+def _iso(seconds):
+    return (_EPOCH + timedelta(seconds=seconds)).isoformat(timespec='minutes')
+
+
+def period(days=REPORT_DAYS, end=None, tz_offset=0):
+    """``(start, end)`` of a report in local time: ``days`` whole days ending tonight at midnight."""
+    if end is None:
+        now = datetime.utcnow() + timedelta(minutes=tz_offset)
+        end = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return end - timedelta(days=days), end
+
+
+# ---------------------- Step 1: collect ----------------------
+
+def local_time(record, tz_offset=0):
+    """When a reading was taken in local time, or None if it has no usable time."""
+    when = models.try_reading_time(record)
+    if when is None or models.is_wall_clock(record):
+        return when
+    return when + timedelta(minutes=tz_offset)
+
+
+def collect(storage, retention, user_id, start, end, live=None, tz_offset=0):
+    """
+    ``{"start", "end", "times", "glucose", "food_times", "foods"}`` for one
+    user and local period: readings sorted by local time in two
+    ``array('d')`` columns (seconds since 1970, mg/dL), foods the same
+    way. ``live`` can pass the user's live readings when they were
+    already grouped.
+    """
+    readings = list(storage.filter('readings', user_id=user_id) if live is None else live)
+    # Segments are indexed by stored time; a day either side covers any offset
+    readings += retention.archived_readings(user_id, start - timedelta(days=1), end + timedelta(days=1))
+    points = sorted((_seconds(t), g) for r in readings
+                    if (g := models.glucose_value(r)) is not None
+                    and (t := local_time(r, tz_offset)) is not None and start <= t < end)
+    foods = []
+    for f in models.get_foods(storage, user_id, limit=None):
+        try:
+            when = datetime.fromisoformat(f"{f['date']}T{f['time']}")
+        except (KeyError, TypeError, ValueError):
+            continue
+        if start <= when < end and f.get('food'):
+            foods.append((_seconds(when), f['food']))
+    foods.sort()
+    return {
+        'start': _seconds(start),
+        'end': _seconds(end),
+        'times': array('d', (t for t, _ in points)),
+        'glucose': array('d', (g for _, g in points)),
+        'food_times': array('d', (t for t, _ in foods)),
+        'foods': [name for _, name in foods],
+    }
+
+
+# ---------------------- Step 2: compute ----------------------
+
+def percentile(sorted_values, p):
+    """Linear-interpolated ``p``-th percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _time_in_ranges(glucose):
+    counts = dict.fromkeys((key for key, _, _ in RANGES), 0)
+    for g in glucose:
+        for key, _, upper in RANGES:
+            if g <= upper:
+                counts[key] += 1
+                break
+    n = len(glucose) or 1
+    return [{'key': key, 'label': label, 'count': counts[key], 'percent': round(100 * counts[key] / n, 1)}
+            for key, label, _ in RANGES]
+
+
+def _agp(times, glucose):
+    """Percentiles per time-of-day slot, over every day of the period."""
+    slots = [[] for _ in range(24 * 60 // AGP_SLOT_MINUTES)]
+    slot_seconds = AGP_SLOT_MINUTES * 60
+    for t, g in zip(times, glucose):
+        slots[int(t % 86400 // slot_seconds)].append(g)
+    agp = []
+    for i, values in enumerate(slots):
+        values.sort()
+        minutes = i * AGP_SLOT_MINUTES
+        agp.append({'time': f'{minutes // 60:02d}:{minutes % 60:02d}', 'count': len(values),
+                    **{f'p{p}': (round(percentile(values, p), 1) if values else None) for p in PERCENTILES}})
+    return agp
+
+
+def _episodes(times, glucose, outside, worse):
+    """
+    Runs of consecutive readings where ``outside(g)``; a long gap ends a
+    run. ``worse`` (min or max) picks each run's extreme value.
+    """
+    episodes = []
+    current = None
+    for t, g in zip(times, glucose):
+        if current is not None and (not outside(g) or t - current['end'] > EPISODE_GAP_SECONDS):
+            episodes.append(current)
+            current = None
+        if outside(g):
+            if current is None:
+                current = {'start': t, 'end': t, 'extreme': g, 'readings': 0}
+            current['end'] = t
+            current['readings'] += 1
+            current['extreme'] = worse(current['extreme'], g)
+    if current is not None:
+        episodes.append(current)
+    return episodes
+
+
+def _episode_summary(episodes, worst_first):
+    ranked = sorted(episodes, key=worst_first)[:TOP_N]
+    return {
+        'count': len(episodes),
+        'minutes': round(sum(e['end'] - e['start'] for e in episodes) / 60),
+        'worst': [{'start': _iso(e['start']), 'minutes': round((e['end'] - e['start']) / 60),
+                   'glucose': e['extreme'], 'readings': e['readings']} for e in ranked],
+    }
+
+
+def _food_impact(times, glucose, food_times, foods):
+    """Average rise from the pre-meal baseline to the peak within 3 h, per food."""
+    rises = defaultdict(list)
+    for when, name in zip(food_times, foods):
+        before = bisect_right(times, when)
+        after = bisect_right(times, when + FOOD_WINDOW_SECONDS)
+        if after <= before:
+            continue
+        if before and times[before - 1] >= when - FOOD_BASELINE_SECONDS:
+            baseline = glucose[before - 1]
+        else:
+            baseline = glucose[before]
+        peak = max(glucose[before:after])
+        rises[name.strip().lower()].append((peak - baseline, peak))
+    impact = [{'food': name, 'meals': len(values),
+               'mean_rise': round(sum(r for r, _ in values) / len(values), 1),
+               'mean_peak': round(sum(p for _, p in values) / len(values), 1)}
+              for name, values in rises.items()]
+    return sorted(impact, key=lambda f: -f['mean_rise'])[:TOP_N]
+
+
+def compute_report(data):
+    """
+    The report for one user's ``collect`` output. Pure function of its
+    input, so it can run in a worker process.
+    """
+    times, glucose = data['times'], data['glucose']
+    n = len(glucose)
+    days = max(1, round((data['end'] - data['start']) / 86400))
+    summary = {'readings': n, 'days': days,
+               'days_with_data': len({int(t // 86400) for t in times})}
+    if n:
+        mean = sum(glucose) / n
+        sd = math.sqrt(sum((g - mean) ** 2 for g in glucose) / n)
+        summary.update({
+            'mean': round(mean, 1),
+            'sd': round(sd, 1),
+            'cv_percent': round(100 * sd / mean, 1),
+            # Glucose management indicator (estimated A1C) from the mean
+            'gmi_percent': round(3.31 + 0.02392 * mean, 1),
+            'min': min(glucose),
+            'max': max(glucose),
+        })
+    return {
+        'start': _iso(data['start']),
+        'end': _iso(data['end']),
+        'summary': summary,
+        'ranges': _time_in_ranges(glucose),
+        'agp': _agp(times, glucose),
+        'lows': _episode_summary(_episodes(times, glucose, lambda g: g < LOW, min),
+                                 lambda e: e['extreme']),
+        'highs': _episode_summary(_episodes(times, glucose, lambda g: g > HIGH, max),
+                                  lambda e: -e['extreme']),
+        'food_impact': _food_impact(times, glucose, data['food_times'], data['foods']),
+    }
+
+
+# ---------------------- Step 3: render ----------------------
+
+def agp_svg(report, width=720, height=280, top=350):
+    """The AGP chart as inline SVG: 5-95% and 25-75% bands, median, target range."""
+    pad = 36
+    slots = len(report['agp'])
+    agp = [(i, s) for i, s in enumerate(report['agp']) if s['count']]
+    if not agp:
+        return ''
+
+    def x(i):
+        return pad + (width - 2 * pad) * (i + 0.5) / slots
+
+    def y(value):
+        return height - pad - (height - 2 * pad) * min(value, top) / top
+
+    def band(lo, hi):
+        upper = ' '.join(f"{x(i):.1f},{y(s[hi]):.1f}" for i, s in agp)
+        lower = ' '.join(f"{x(i):.1f},{y(s[lo]):.1f}" for i, s in reversed(agp))
+        return f'{upper} {lower}'
+
+    median = ' '.join(f"{x(i):.1f},{y(s['p50']):.1f}" for i, s in agp)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+             f'role="img" aria-label="Glucose percentiles by time of day">',
+             f'<rect x="{pad}" y="{y(HIGH):.1f}" width="{width - 2 * pad}" '
+             f'height="{y(LOW) - y(HIGH):.1f}" fill="#e8f5e9"/>',
+             f'<polygon points="{band("p5", "p95")}" fill="#bbdefb"/>',
+             f'<polygon points="{band("p25", "p75")}" fill="#64b5f6"/>',
+             f'<polyline points="{median}" fill="none" stroke="#0d47a1" stroke-width="3"/>']
+    for value in (LOW, HIGH):
+        parts.append(f'<line x1="{pad}" x2="{width - pad}" y1="{y(value):.1f}" y2="{y(value):.1f}" '
+                     f'stroke="#388e3c" stroke-dasharray="6 4"/>'
+                     f'<text x="4" y="{y(value) + 5:.1f}" font-size="14">{value}</text>')
+    for hour in range(0, 25, 6):
+        px = pad + (width - 2 * pad) * hour / 24
+        parts.append(f'<text x="{px:.1f}" y="{height - 10}" font-size="14" text-anchor="middle">'
+                     f'{hour:02d}:00</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def render_html(report, title='Glucose Report'):
+    """The report page (needs an app context for the Jinja template). None: "still preparing"."""
+    from flask import render_template
+    return render_template('report.html', report=report, agp_svg=agp_svg(report) if report else '',
+                           title=title)
+
+
+def render_pdf(report, title='Glucose Report'):
+    """The report as PDF bytes with ``fpdf2`` (pure Python). None if it is not installed."""
+    if FPDF is None:
+        return None
+
+    def text(value):
+        return str(value).encode('latin-1', 'replace').decode('latin-1')
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font('helvetica', 'B', 18)
+    pdf.cell(0, 10, text(title))
+    pdf.ln(10)
+    pdf.set_font('helvetica', '', 11)
+    s = report['summary']
+    pdf.cell(0, 7, text(f"{report['start'][:10]} to {report['end'][:10]}  -  {s['readings']} readings "
+                        f"on {s['days_with_data']} of {s['days']} days"))
+    pdf.ln(9)
+    if s['readings']:
+        pdf.cell(0, 7, text(f"Mean {s['mean']} mg/dL   SD {s['sd']}   CV {s['cv_percent']}%   "
+                            f"GMI {s['gmi_percent']}%"))
+        pdf.ln(9)
+
+    # AGP chart: percentile lines in a 180 x 70 mm box
+    left, top_y, w, h, top = 15, pdf.get_y(), 180, 70, 350
+    pdf.set_draw_color(180, 180, 180)
+    pdf.rect(left, top_y, w, h)
+    slots = report['agp']
+
+    def point(i, value):
+        return left + w * (i + 0.5) / len(slots), top_y + h - h * min(value, top) / top
+
+    for value in (LOW, HIGH):
+        pdf.set_draw_color(56, 142, 60)
+        pdf.line(left, point(0, value)[1], left + w, point(0, value)[1])
+    for key, shade, width in (('p5', 170, 0.3), ('p95', 170, 0.3), ('p25', 90, 0.5),
+                              ('p75', 90, 0.5), ('p50', 0, 0.9)):
+        pdf.set_draw_color(shade, shade, 255 if shade else 160)
+        pdf.set_line_width(width)
+        filled = [(i, s[key]) for i, s in enumerate(slots) if s[key] is not None]
+        for (i1, v1), (i2, v2) in zip(filled, filled[1:]):
+            pdf.line(*point(i1, v1), *point(i2, v2))
+    pdf.set_line_width(0.2)
+    pdf.set_y(top_y + h + 4)
+
+    pdf.set_font('helvetica', 'B', 13)
+    pdf.cell(0, 8, 'Time in ranges')
+    pdf.ln(8)
+    pdf.set_font('helvetica', '', 11)
+    for r in report['ranges']:
+        pdf.cell(0, 6, text(f"{r['label']}: {r['percent']}%"))
+        pdf.ln(6)
+    for key, label in (('lows', 'Lows (<70)'), ('highs', 'Highs (>180)')):
+        pdf.set_font('helvetica', 'B', 13)
+        pdf.cell(0, 8, text(f"{label}: {report[key]['count']} episodes, {report[key]['minutes']} min"))
+        pdf.ln(8)
+        pdf.set_font('helvetica', '', 10)
+        for e in report[key]['worst']:
+            pdf.cell(0, 5, text(f"{e['start']}  {e['glucose']} mg/dL  {e['minutes']} min"))
+            pdf.ln(5)
+    pdf.set_font('helvetica', 'B', 13)
+    pdf.cell(0, 8, 'Food impact (rise within 3 h)')
+    pdf.ln(8)
+    pdf.set_font('helvetica', '', 10)
+    for f in report['food_impact']:
+        pdf.cell(0, 5, text(f"{f['food']}: +{f['mean_rise']} mg/dL (peak {f['mean_peak']}, {f['meals']} meals)"))
+        pdf.ln(5)
+    return bytes(pdf.output())
+
+
+# ---------------------- Service ----------------------
+
+class ReportService:
+    """
+    Builds reports in the background and caches them by (user, period,
+    data version).
+
+    Methods:
+    - report(user_id, start, end, wait, tz_offset) -> report, or None while it is built
+    - rendered(user_id, start, end, fmt, render, wait, tz_offset) -> cached HTML / PDF
+    - generate_many(user_ids, start, end, tz_offset) -> {user_id: report}, on all cores
+    """
+
+    def __init__(self, storage, retention, processes=REPORT_PROCESSES, capacity=CACHE_SIZE):
+        self.storage = storage
+        self.retention = retention
+        self.processes = processes
+        self.cache = LRUCache(capacity)
+        self.versions = UserVersions(storage, REPORT_COLLECTIONS)
+        self._building = {}
+        self._lock = threading.Lock()
+        self._threads = None
+        self._pool = None
+
+    def _executors(self):
+        # Created on first use, so app startup pays nothing
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=2, thread_name_prefix='report')
+        if self._pool is None and self.processes > 1:
+            # spawn: forking a process that runs request threads is not safe
+            self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        return self._threads, self._pool
+
+    def _compute(self, data):
+        _, pool = self._executors()
+        return pool.submit(compute_report, data).result() if pool else compute_report(data)
+
+    def _entry(self, user_id, start, end, tz_offset):
+        """The cache entry for the current data version, or None."""
+        entry = self.cache.get((user_id, start, end, tz_offset))
+        if entry is not None and entry['version'] == self.versions.get(user_id):
+            return entry
+        return None
+
+    def submit(self, user_id, start, end, tz_offset=0):
+        """Start building a report (if it is not cached or already being built); returns a Future."""
+        key = (user_id, start, end, tz_offset)
+        version = self.versions.get(user_id)
+        with self._lock:
+            future = self._building.get(key + (version,))
+            if future is not None:
+                return future
+            threads, _ = self._executors()
+            future = threads.submit(self._build, key, version)
+            self._building[key + (version,)] = future
+        return future
+
+    def _build(self, key, version):
+        user_id, start, end, tz_offset = key
+        try:
+            report = self._compute(collect(self.storage, self.retention, user_id, start, end,
+                                           tz_offset=tz_offset))
+            report['version'] = version
+            with self._lock:
+                self.cache.put(key, {'version': version, 'report': report, 'rendered': {}})
+            return report
+        finally:
+            with self._lock:
+                self._building.pop(key + (version,), None)
+
+    def report(self, user_id, start, end, wait=10, tz_offset=0):
+        """The report if cached or built within ``wait`` seconds, else None (still building)."""
+        with self._lock:
+            entry = self._entry(user_id, start, end, tz_offset)
+        if entry is not None:
+            return entry['report']
+        future = self.submit(user_id, start, end, tz_offset)
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeout:
+            return None
+
+    def rendered(self, user_id, start, end, fmt, render, wait=10, tz_offset=0):
+        """``render(report)`` for format ``fmt``, cached with the report. None while building."""
+        report = self.report(user_id, start, end, wait, tz_offset)
+        if report is None:
+            return None
+        with self._lock:
+            entry = self._entry(user_id, start, end, tz_offset)
+            if entry is not None and fmt in entry['rendered']:
+                return entry['rendered'][fmt]
+        output = render(report)
+        with self._lock:
+            if entry is not None and entry['report'] is report:
+                entry['rendered'][fmt] = output
+        return output
+
+    def generate_many(self, user_ids, start, end, tz_offset=0):
+        """Reports for many users: data is read here, computed across all CPU cores."""
+        # One pass over the live readings instead of one filter per user
+        live = defaultdict(list)
+        for r in self.storage.all('readings'):
+            live[r.get('user_id')].append(r)
+        datasets = {uid: collect(self.storage, self.retention, uid, start, end, live.get(uid, []), tz_offset)
+                    for uid in user_ids}
+        _, pool = self._executors()
+        if pool is None:
+            reports = map(compute_report, datasets.values())
+        else:
+            reports = pool.map(compute_report, datasets.values(), chunksize=max(1, len(datasets) // (4 * self.processes)))
+        results = {}
+        for uid, report in zip(datasets, reports):
+            report['version'] = self.versions.get(uid)
+            with self._lock:
+                self.cache.put((uid, start, end, tz_offset),
+                               {'version': report['version'], 'report': report, 'rendered': {}})
+            results[uid] = report
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {**self.cache.stats(), 'building': len(self._building), 'processes': self.processes,
+                    'pdf': FPDF is not None}
+
+    def stop(self):
+        if self._threads is not None:
+            self._threads.shutdown(wait=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self._threads = self._pool = None
+
+
+def main():
+    import argparse
+    from pathlib import Path
+
+    import app as app_module
+
+    parser = argparse.ArgumentParser(description='Write HTML (and PDF) reports for every user.')
+    parser.add_argument('--data-dir', default=None)
+    parser.add_argument('--engine', default=None)
+    parser.add_argument('--days', type=int, default=REPORT_DAYS)
+    parser.add_argument('--out', default='reports')
+    parser.add_argument('--processes', type=int, default=REPORT_PROCESSES)
+    parser.add_argument('--tz', type=parse_tz_offset, default=0,
+                        help='local time of the reports, in minutes east of UTC (e.g. 120)')
+    args = parser.parse_args()
+
+    app = app_module.create_app(data_dir=args.data_dir, engine=args.engine, preload=False, seed=False)
+    services = app.extensions['tracker']
+    reports = services.reports
+    reports.processes = args.processes
+    start, end = period(args.days, tz_offset=args.tz)
+    users = services.storage.all('users')
+    started = datetime.now()
+    results = reports.generate_many([u['id'] for u in users], start, end, args.tz)
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    with app.app_context():
+        for user in users:
+            title = f"Glucose Report - {user.get('email', user['id'])}"
+            report = results[user['id']]
+            (out / f"user-{user['id']}.html").write_text(render_html(report, title), encoding='utf-8')
+            pdf = render_pdf(report, title)
+            if pdf is not None:
+                (out / f"user-{user['id']}.pdf").write_bytes(pdf)
+    reports.stop()
+    print(f"{len(users)} reports in {out}/ ({(datetime.now() - started).total_seconds():.1f}s, "
+          f"{reports.processes} processes)")
+
+
+if __name__ == '__main__':
+    main()
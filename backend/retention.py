@@ -0,0 +1,281 @@
+"""
+backend.retention
+
+Retention, downsampling and archival of old readings.
+
+Readings older than ``raw_days`` leave the live ``readings`` collection:
+
+1. they are written to an immutable, compressed archive segment
+   (``data/archive/user-<id>/r<first id>-<last id>-<UTC time>.jsonl.gz``,
+   or ``.xz`` with lzma), one JSON reading per line. The time makes every
+   segment name unique;
+2. they are summarised into 15-minute and hourly rollups
+   (``rollups_15m`` / ``rollups_1h``: min, mean, max, count per bucket);
+3. the segment is recorded in ``archive_segments`` and the raw readings
+   are deleted in one ``delete_many``.
+
+So the live collection only ever holds the last ``raw_days`` of data, no
+matter how old the account is. ``query`` answers long time ranges from
+the rollups (plus live readings bucketed on the fly), and
+``archived_readings`` streams the raw archive back for exports.
+
+``run`` is meant to be a recurring job on a ``PriorityScheduler`` (see
+``Services``). Readings are only deleted once a segment holding them is
+on disk and recorded. Re-running after a crash is safe: if a recorded
+segment already holds exactly these readings they are not archived or
+rolled up twice; only a crash between the rollup write and the segment
+record can count a bucket twice.
+"""
+import gzip
+import lzma
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from . import models
+from .recommendations import parse_timestamp
+from .serialization import dumps, loads
+
+RAW_RETENTION_DAYS = int(os.environ.get('TRACKER_RETENTION_DAYS', 90))
+RETENTION_INTERVAL_SECONDS = 3600
+ROLLUPS = {15: 'rollups_15m', 60: 'rollups_1h'}
+ARCHIVE_FORMATS = {'gz': gzip.open, 'xz': lzma.open}
+# Ranges up to this long are answered with raw readings, then 15-minute buckets
+RAW_MAX_SPAN = timedelta(days=2)
+ROLLUP_15M_MAX_SPAN = timedelta(days=14)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(when):
+    return (when - _EPOCH).total_seconds()
+
+
+def bucket_start(when, minutes):
+    """Start of the ``minutes``-wide bucket holding ``when``."""
+    width = minutes * 60
+    return _EPOCH + timedelta(seconds=int(_seconds(when) // width * width))
+
+
+def _iso(when):
+    return when.isoformat() + 'Z'
+
+
+class _Bucket:
+    __slots__ = ('min', 'max', 'sum', 'count')
+
+    def __init__(self):
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, glucose):
+        self.min = min(self.min, glucose)
+        self.max = max(self.max, glucose)
+        self.sum += glucose
+        self.count += 1
+
+    def add_rollup(self, r):
+        self.min = min(self.min, r['min'])
+        self.max = max(self.max, r['max'])
+        self.sum += r['sum']
+        self.count += r['count']
+
+    def fields(self):
+        return {'min': self.min, 'max': self.max, 'sum': self.sum, 'count': self.count,
+                'mean': round(self.sum / self.count, 1)}
+
+
+def downsample(readings, minutes):
+    """``{bucket start: _Bucket}`` for readings (dicts with glucose + time)."""
+    buckets = defaultdict(_Bucket)
+    for r in readings:
+        glucose, when = models.glucose_value(r), models.try_reading_time(r)
+        if glucose is None or when is None:
+            continue
+        buckets[bucket_start(when, minutes)].add(glucose)
+    return buckets
+
+
+class RetentionService:
+    """Moves old readings into archive segments + rollups; answers range queries."""
+
+    def __init__(self, storage, data_dir=None, raw_days=RAW_RETENTION_DAYS, archive_format='gz',
+                 on_archived=None):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"archive_format must be one of {', '.join(ARCHIVE_FORMATS)}")
+        self.storage = storage
+        self.data_dir = data_dir
+        self.raw_days = raw_days
+        self.archive_format = archive_format
+        self.on_archived = on_archived
+        self._lock = threading.Lock()
+
+    @property
+    def archive_dir(self):
+        return (self.data_dir or self.storage.data_dir) / 'archive'
+
+    def cutoff(self, now=None):
+        return (now or datetime.utcnow()) - timedelta(days=self.raw_days)
+
+    # ---------------------- Archival ----------------------
+
+    def run(self, now=None):
+        """
+        Archive and roll up every reading older than the cutoff. Returns a
+        summary. Readings without a usable time stay live; a user whose
+        archive fails is listed under ``failed`` and the others still run.
+        """
+        with self._lock:
+            cutoff = self.cutoff(now)
+            old = defaultdict(list)
+            for r in self.storage.all('readings'):
+                when = models.try_reading_time(r)
+                if when is not None and when < cutoff:
+                    old[r.get('user_id')].append(r)
+
+            summary = {'cutoff': _iso(cutoff), 'users': len(old), 'archived': 0, 'segments': 0, 'failed': {}}
+            for user_id, readings in old.items():
+                readings.sort(key=lambda r: r['id'])
+                try:
+                    self._archive_user(user_id, readings)
+                except Exception as e:
+                    # String keys: the summary is shown as JSON by /api/maintenance
+                    summary['failed'][str(user_id)] = str(e)
+                    continue
+                summary['archived'] += len(readings)
+                summary['segments'] += 1
+                if self.on_archived:
+                    self.on_archived(user_id, len(readings))
+            return summary
+
+    def _archive_user(self, user_id, readings):
+        if not self._already_archived(user_id, readings):
+            stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+            name = f"r{readings[0]['id']}-{readings[-1]['id']}-{stamp}.jsonl.{self.archive_format}"
+            path = self.archive_dir / f'user-{user_id}' / name
+            relative = path.relative_to(self.archive_dir).as_posix()
+            self._write_segment(path, readings)
+            for minutes, collection in ROLLUPS.items():
+                self._merge_rollups(collection, user_id, minutes, readings)
+            times = [models.reading_time(r) for r in readings]
+            self.storage.insert('archive_segments', {
+                'user_id': user_id,
+                'path': relative,
+                'count': len(readings),
+                'first_id': readings[0]['id'],
+                'last_id': readings[-1]['id'],
+                'start': _iso(min(times)),
+                'end': _iso(max(times)),
+                'created_at': models.utc_now_iso(),
+            })
+        self.storage.delete_many('readings', [r['id'] for r in readings])
+
+    def _already_archived(self, user_id, readings):
+        """True if a recorded segment holds exactly these readings (a run that crashed before deleting)."""
+        for segment in self.storage.filter('archive_segments', user_id=user_id,
+                                           first_id=readings[0]['id'], last_id=readings[-1]['id']):
+            if segment['count'] == len(readings) and list(self._segment_readings(segment)) == readings:
+                return True
+        return False
+
+    def _segment_readings(self, segment):
+        path = self.archive_dir / segment['path']
+        opener = ARCHIVE_FORMATS[path.suffix.lstrip('.')]
+        with opener(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield loads(line)
+
+    def _write_segment(self, path, readings):
+        """Write a segment atomically (temp file, fsync, rename). Segments never change after."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        with ARCHIVE_FORMATS[self.archive_format](tmp, 'wb') as f:
+            f.write(b''.join(dumps(r) + b'\n' for r in readings))
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _merge_rollups(self, collection, user_id, minutes, readings):
+        buckets = downsample(readings, minutes)
+        touched = {_iso(start) for start in buckets}
+        existing = {r['start']: r for r in self.storage.filter(collection, user_id=user_id)
+                    if r['start'] in touched}
+        new = []
+        for start, bucket in sorted(buckets.items()):
+            key = _iso(start)
+            if key in existing:
+                bucket.add_rollup(existing[key])
+                self.storage.update(collection, existing[key]['id'], bucket.fields())
+            else:
+                new.append({'user_id': user_id, 'start': key, 'minutes': minutes, **bucket.fields()})
+        if new:
+            self.storage.insert_many(collection, new)
+
+    def archived_readings(self, user_id, start=None, end=None):
+        """
+        Yield a user's archived readings, oldest segment first. With
+        ``start``/``end`` only segments overlapping that range are opened
+        (readings inside them are not filtered).
+        """
+        segments = sorted(self.storage.filter('archive_segments', user_id=user_id),
+                          key=lambda s: (s['created_at'], s['first_id']))
+        for segment in segments:
+            if start is not None and parse_timestamp(segment['end']) < start:
+                continue
+            if end is not None and parse_timestamp(segment['start']) >= end:
+                continue
+            yield from self._segment_readings(segment)
+
+    # ---------------------- Queries ----------------------
+
+    def rollups(self, user_id, minutes, start, end):
+        """Stored rollups of one resolution inside [start, end)."""
+        lo, hi = _iso(bucket_start(start, minutes)), _iso(end)
+        return sorted((r for r in self.storage.filter(ROLLUPS[minutes], user_id=user_id)
+                       if lo <= r['start'] < hi), key=lambda r: r['start'])
+
+    def resolution_for(self, start, end):
+        span = end - start
+        if span <= RAW_MAX_SPAN:
+            return 'raw'
+        return '15m' if span <= ROLLUP_15M_MAX_SPAN else '1h'
+
+    def query(self, user_id, start, end, resolution=None):
+        """
+        ``(resolution, points)`` for a time range, oldest first. Each point is
+        ``{"t", "min", "mean", "max", "count"}``. Long ranges are answered
+        from the rollups plus live readings bucketed the same way, so no raw
+        archive is read. Raw answers fall back to 15-minute buckets for the
+        part of the range that is already archived.
+        """
+        resolution = resolution or self.resolution_for(start, end)
+        live = [r for r in self.storage.filter('readings', user_id=user_id)
+                if models.glucose_value(r) is not None
+                and (t := models.try_reading_time(r)) is not None and start <= t < end]
+
+        if resolution == 'raw':
+            points = [{'t': _iso(bucket['start']), **bucket['fields']}
+                      for bucket in self._archived_part(user_id, start, end)]
+            for r in sorted(live, key=models.reading_time):
+                g = models.glucose_value(r)
+                points.append({'t': _iso(models.reading_time(r)), 'min': g, 'mean': g, 'max': g, 'count': 1})
+            return resolution, points
+
+        minutes = 15 if resolution == '15m' else 60
+        buckets = downsample(live, minutes)
+        for rollup in self.rollups(user_id, minutes, start, end):
+            buckets[parse_timestamp(rollup['start'])].add_rollup(rollup)
+        return resolution, [{'t': _iso(when), **{k: v for k, v in b.fields().items() if k != 'sum'}}
+                            for when, b in sorted(buckets.items())]
+
+    def _archived_part(self, user_id, start, end):
+        cutoff = self.cutoff()
+        if start >= cutoff:
+            return []
+        return [{'start': parse_timestamp(r['start']),
+                 'fields': {k: r[k] for k in ('min', 'mean', 'max', 'count')}}
+                for r in self.rollups(user_id, 15, start, min(end, cutoff))]
@@ -2,60 +2,166 @@
 backend.scheduler
 
 Simple priority scheduler for demo and educational purposes.
+
+Tasks can also carry an ``action`` (a function run when the task's last
+tick executes), and ``every()`` registers recurring jobs that
+``submit_due()`` puts back in the queue when they are due. ``start()``
+runs a small background worker doing exactly that, which is how
+maintenance jobs such as data retention run.
+
+A task submitted with a ``user_id`` belongs to that user: passing the
+same ``user_id`` to ``list_tasks``, ``history`` and ``run_tick(s)`` only
+sees and runs that user's tasks, so one queue can be shared by tenants.
 """
 import heapq
+import threading
+import time
+from collections import deque
 from datetime import datetime
 
+# Keep this many executed tasks in history()
+HISTORY_SIZE = 1000
+
+
 class PriorityScheduler:
     """A minimal priority scheduler using a min-heap.
 
     Methods:
-    - submit(name, priority, ticks)
-    - run_tick()
-    - run_ticks(n)
-    - list_tasks()
-    - history()
+    - submit(name, priority, ticks, action=None, user_id=None)
+    - run_tick(user_id=None)
+    - run_ticks(n, user_id=None)
+    - list_tasks(user_id=None)
+    - history(user_id=None)
+    - every(name, seconds, action, priority): recurring job
+    - submit_due(now), start(poll_seconds), stop()
     """
-    def __init__(self):
+    def __init__(self, history_size=HISTORY_SIZE):
         self._heap = []
         self._seq = 0
-        self._history = []
-
-    def submit(self, name, priority=5, ticks=1):
-        self._seq += 1
-        task = {
-            'id': self._seq,
-            'name': name,
-            'priority': int(priority),
-            'ticks': int(ticks),
-            'created_at': datetime.utcnow().isoformat() + 'Z'
-        }
-        heapq.heappush(self._heap, (task['priority'], self._seq, task))
-        return task
-
-    def run_tick(self):
+        self._history = deque(maxlen=history_size)
+        self._actions = {}
+        self._recurring = {}
+        self._lock = threading.RLock()
+        self._worker = None
+        self._stopping = threading.Event()
+
+    def submit(self, name, priority=5, ticks=1, action=None, user_id=None):
+        with self._lock:
+            self._seq += 1
+            task = {
+                'id': self._seq,
+                'name': name,
+                'priority': int(priority),
+                'ticks': int(ticks),
+                'created_at': datetime.utcnow().isoformat() + 'Z'
+            }
+            if user_id is not None:
+                task['user_id'] = user_id
+            if action is not None:
+                self._actions[task['id']] = action
+            heapq.heappush(self._heap, (task['priority'], self._seq, task))
+            return task
+
+    def _pop(self, user_id):
+        """Remove and return the most urgent heap item (of ``user_id``'s tasks if given)."""
+        if user_id is None:
+            return heapq.heappop(self._heap)
+        item = min((i for i in self._heap if i[2].get('user_id') == user_id), default=None)
+        if item is not None:
+            self._heap.remove(item)
+            heapq.heapify(self._heap)
+        return item
+
+    def run_tick(self, user_id=None):
         executed = []
-        if not self._heap:
-            return executed
-        priority, seq, task = heapq.heappop(self._heap)
-        task['ticks'] -= 1
+        with self._lock:
+            if not self._heap:
+                return executed
+            item = self._pop(user_id)
+            if item is None:
+                return executed
+            priority, seq, task = item
+            task['ticks'] -= 1
+            if task['ticks'] > 0:
+                heapq.heappush(self._heap, (task['priority'], seq, task))
+            action = self._actions.pop(task['id'], None) if task['ticks'] <= 0 else None
+        entry = {**task}
+        if action is not None:
+            # Run outside the lock so a slow job does not block submit()
+            try:
+                entry['result'] = action()
+            except Exception as e:
+                entry['error'] = str(e)
+        entry['executed_at'] = datetime.utcnow().isoformat() + 'Z'
+        with self._lock:
+            self._history.append(entry)
         executed.append(task)
-        self._history.append({**task, 'executed_at': datetime.utcnow().isoformat() + 'Z'})
-        if task['ticks'] > 0:
-            heapq.heappush(self._heap, (task['priority'], seq, task))
         return executed
 
-    def run_ticks(self, n):
+    def run_ticks(self, n, user_id=None):
         executed = []
         for _ in range(int(n)):
-            executed.extend(self.run_tick())
+            executed.extend(self.run_tick(user_id))
         return executed
 
-    def list_tasks(self):
-        return [item[2] for item in self._heap]
+    def list_tasks(self, user_id=None):
+        with self._lock:
+            return [item[2] for item in self._heap if user_id is None or item[2].get('user_id') == user_id]
+
+    def history(self, user_id=None):
+        with self._lock:
+            return [entry for entry in self._history if user_id is None or entry.get('user_id') == user_id]
 
-    def history(self):
-        return list(self._history)
+    # ---------------------- Recurring jobs ----------------------
+
+    def every(self, name, seconds, action, priority=5):
+        """Run ``action`` as task ``name`` every ``seconds`` (first run right away)."""
+        with self._lock:
+            self._recurring[name] = {'seconds': seconds, 'action': action, 'priority': priority,
+                                     'next_at': 0.0}
+
+    def submit_due(self, now=None):
+        """Queue every recurring job that is due and not already queued."""
+        now = time.monotonic() if now is None else now
+        submitted = []
+        with self._lock:
+            queued = {task['name'] for task in self.list_tasks()}
+            for name, job in self._recurring.items():
+                if job['next_at'] <= now and name not in queued:
+                    job['next_at'] = now + job['seconds']
+                    submitted.append(self.submit(name, job['priority'], 1, job['action']))
+        return submitted
+
+    def recurring(self):
+        """Recurring jobs with the seconds until each one is next due."""
+        now = time.monotonic()
+        with self._lock:
+            return [{'name': name, 'every_seconds': job['seconds'], 'priority': job['priority'],
+                     'due_in_seconds': max(0.0, round(job['next_at'] - now, 1))}
+                    for name, job in self._recurring.items()]
+
+    def start(self, poll_seconds=1.0):
+        """Background worker: queue due jobs, run the queue, sleep, repeat."""
+        if self._worker is not None:
+            return self._worker
+
+        def run():
+            while not self._stopping.is_set():
+                self.submit_due()
+                while self.run_tick():
+                    pass
+                self._stopping.wait(poll_seconds)
+
+        self._stopping.clear()
+        self._worker = threading.Thread(target=run, name='scheduler-worker', daemon=True)
+        self._worker.start()
+        return self._worker
+
+    def stop(self):
+        self._stopping.set()
+        if self._worker is not None:
+            self._worker.join()
+        self._worker = None
 
 if __name__ == '__main__':
     s = PriorityScheduler()
@@ -64,4 +170,7 @@ if __name__ == '__main__':
     print('Queue:', s.list_tasks())
     print('Run 1 tick:', s.run_tick())
     print('Run 2 ticks:', s.run_ticks(2))
+    s.every('Cleanup', 60, lambda: 'cleaned', priority=4)
+    print('Due:', s.submit_due())
+    print('Run 1 tick:', s.run_tick())
     print('History:', s.history())
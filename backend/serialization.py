@@ -0,0 +1,153 @@
+"""
+backend.serialization
+
+Fast JSON responses.
+
+- ``dumps`` uses ``orjson`` when it is installed and falls back to the
+  standard library with compact separators. Both accept the same input:
+  non-string dict keys (ints, None) become strings, as ``json`` does.
+- ``FragmentCache`` keeps the encoded bytes of individual records, so a
+  list response is assembled by joining cached fragments instead of
+  re-encoding every record on every request. Call ``invalidate`` when a
+  record changes.
+- ``compress_response`` negotiates gzip/deflate from ``Accept-Encoding``
+  for bodies above a size threshold.
+"""
+import json
+import zlib
+
+from flask import Response
+
+from .cache import LRUCache
+
+try:
+    import orjson
+except ImportError:  # optional speed-up, stdlib fallback below
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+COMPRESS_MIN_SIZE = 1024
+# Level 1 already shrinks reading lists ~10x and costs a fraction of level 6
+COMPRESS_LEVEL = 1
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/html', 'text/plain',
+                          'text/css', 'application/javascript', 'text/javascript'}
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def dumps(obj):
+    """Encode ``obj`` as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return _encoder.encode(obj).encode('utf-8')
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FragmentCache:
+    """Encoded-bytes cache for records, keyed by record id."""
+
+    def __init__(self, capacity=50000, key='id'):
+        self.key = key
+        self._lru = LRUCache(capacity)
+
+    def encode(self, record):
+        """Return the encoded bytes for ``record``, encoding on first use."""
+        record_key = record.get(self.key)
+        if record_key is None:
+            return dumps(record)
+        fragment = self._lru.get(record_key)
+        if fragment is None:
+            fragment = dumps(record)
+            self._lru.put(record_key, fragment)
+        return fragment
+
+    def encode_list(self, records):
+        """Encode a list of records by concatenating cached fragments."""
+        return b'[' + b','.join([self.encode(r) for r in records]) + b']'
+
+    def invalidate(self, record_key):
+        """Drop the cached fragment for a record that changed or was deleted."""
+        self._lru.pop(record_key)
+
+    def stats(self):
+        return self._lru.stats()
+
+
+def json_response(payload, status=200):
+    """Like ``jsonify`` but using the fast encoder."""
+    return Response(dumps(payload), status=status, mimetype=JSON_MIMETYPE)
+
+
+def list_response(name, records, fragments=None, status=200, **fields):
+    """JSON object with ``fields`` plus ``name`` -> list of records.
+
+    With a ``FragmentCache`` the list is spliced in from pre-encoded bytes.
+    """
+    body = dumps(fields)
+    if fragments is not None:
+        encoded = fragments.encode_list(records)
+    else:
+        encoded = dumps(records)
+    prefix = body[:-1] + (b',' if fields else b'')
+    body = prefix + dumps(name) + b':' + encoded + b'}'
+    return Response(body, status=status, mimetype=JSON_MIMETYPE)
+
+
+def _accepted_encodings(header):
+    """Parse ``Accept-Encoding`` into {coding: q}."""
+    accepted = {}
+    for part in (header or '').split(','):
+        bits = part.strip().split(';')
+        coding = bits[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in bits[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """Pick 'gzip' or 'deflate' from an Accept-Encoding header (or None)."""
+    accepted = _accepted_encodings(header)
+    best, best_q = None, 0.0
+    for coding in ('gzip', 'deflate'):
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress_response(response, accept_encoding, min_size=COMPRESS_MIN_SIZE):
+    """Compress a buffered response in place when the client accepts it."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    coding = choose_encoding(accept_encoding)
+    if coding is None:
+        return response
+
+    # wbits 31 = gzip container, 15 = zlib container (HTTP "deflate")
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31 if coding == 'gzip' else 15)
+    response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers['Content-Encoding'] = coding
+    return response
@@ -0,0 +1,120 @@
+"""
+backend.series
+
+Chart-ready glucose series for any time range.
+
+A multi-month CGM history holds tens of thousands of readings, but a
+chart is only a few hundred pixels wide. ``SeriesService.series`` takes
+the points ``RetentionService.query`` returns for the range (raw
+readings for short ranges, 15-minute or hourly rollups for long ones),
+puts their times and values into ``array('d')`` columns and keeps
+``points`` of them with Largest-Triangle-Three-Buckets (LTTB): the
+series is cut into equal buckets and each bucket keeps the point that
+makes the largest triangle with its neighbours, so peaks and dips
+survive where a plain average would flatten them.
+
+Results are cached per (user, range, resolution, points). Every write to
+a user's readings or rollups bumps that user's version number
+(``UserVersions``), so a cached series is used only while the data
+behind it is unchanged.
+"""
+import threading
+from array import array
+from datetime import datetime
+
+from .cache import LRUCache, UserVersions
+
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+CACHE_SIZE = 256
+# Writes to these collections change what a series looks like
+SERIES_COLLECTIONS = ('readings', 'rollups_15m', 'rollups_1h')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def lttb(xs, ys, threshold):
+    """
+    Indices of the ``threshold`` points Largest-Triangle-Three-Buckets
+    keeps from ``xs``/``ys`` (sorted by x). The first and last points
+    are always kept; short series are returned whole.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # Average of the next bucket (the last point for the last bucket)
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        width = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / width
+        avg_y = sum(ys[next_start:next_end]) / width
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+class SeriesService:
+    """Downsampled, cached glucose series per user."""
+
+    def __init__(self, storage, retention, capacity=CACHE_SIZE):
+        self.storage = storage
+        self.retention = retention
+        self.cache = LRUCache(capacity)
+        self.versions = UserVersions(storage, SERIES_COLLECTIONS)
+        self._lock = threading.Lock()
+
+    def series(self, user_id, start, end, points=DEFAULT_POINTS, resolution=None):
+        """
+        ``{"resolution", "source_points", "t", "glucose", "min", "max"}``
+        with at most ``points`` entries, oldest first. ``glucose`` is the
+        reading (or bucket mean); ``min``/``max`` are the bucket range.
+        """
+        resolution = resolution or self.retention.resolution_for(start, end)
+        key = (user_id, start, end, resolution, points)
+        version = self.versions.get(user_id)
+        with self._lock:
+            cached = self.cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        resolution, rows = self.retention.query(user_id, start, end, resolution)
+        xs = array('d', ((datetime.fromisoformat(p['t'].rstrip('Z')) - _EPOCH).total_seconds() for p in rows))
+        ys = array('d', (p['mean'] for p in rows))
+        picked = [rows[i] for i in lttb(xs, ys, points)]
+        result = {
+            'resolution': resolution,
+            'source_points': len(rows),
+            't': [p['t'] for p in picked],
+            'glucose': [p['mean'] for p in picked],
+            'min': [p['min'] for p in picked],
+            'max': [p['max'] for p in picked],
+        }
+        with self._lock:
+            self.cache.put(key, (version, result))
+        return result
+
+    def stats(self):
+        with self._lock:
+            return self.cache.stats()
+
+
+if __name__ == '__main__':
+    # Quick manual test: a sine-like day of 5-minute readings down to 20 points
+    import math
+    xs = array('d', (i * 300.0 for i in range(288)))
+    ys = array('d', (120 + 60 * math.sin(i / 20) for i in range(288)))
+    kept = lttb(xs, ys, 20)
+    print('Kept indices:', kept)
+    print('Values:', [round(ys[i]) for i in kept])
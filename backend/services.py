@@ -0,0 +1,99 @@
+"""
+backend.services
+
+Per-app services (storage, cache, scheduler, ...).
+
+``create_app`` builds one ``Services`` object and stores it in
+``app.extensions['tracker']``. Every service can be passed in instead of
+built, so tests, benchmarks and alternative deployments can inject their
+own cache, scheduler or storage engine. Route modules reach services
+through ``get_services()`` or the ``service(name)`` proxies.
+"""
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from .alerts import TrendAlertEvaluator
+from .auth import SESSION_PURGE_SECONDS, SessionManager
+from .backup import BACKUP_INTERVAL_SECONDS, BackupManager
+from .cache import LRUCache
+from .ingest import GroupCommitWriter
+from .recommendations import RecommendationEngine
+from .reports import ReportService
+from .quotas import TenantQuotas
+from .retention import RETENTION_INTERVAL_SECONDS, RetentionService
+from .scheduler import PriorityScheduler
+from .serialization import FragmentCache
+from .series import SeriesService
+from .startup import StartupMetrics
+from .sync import COMPACT_INTERVAL_SECONDS, ChangeLog, SyncKeys
+
+EXTENSION_KEY = 'tracker'
+
+
+class Services:
+    """Container for the services one app instance uses."""
+
+    def __init__(self, storage, cache=None, scheduler=None, recommendations=None,
+                 fragments=None, alerts=None, startup=None, sessions=None, quotas=None,
+                 changes=None, sync_keys=None, ingest=None, retention=None, maintenance=None,
+                 backups=None, series=None, reports=None):
+        self.storage = storage
+        self.startup = startup or StartupMetrics()
+        self.cache = cache if cache is not None else LRUCache(capacity=5)
+        self.scheduler = scheduler if scheduler is not None else PriorityScheduler()
+        # Rules live in backend/recommendation_rules.json, compiled into bisect tables
+        self.recommendations = recommendations or RecommendationEngine.from_file()
+        # Pre-encoded JSON bytes per reading id, so list responses are joined, not re-encoded
+        self.fragments = fragments if fragments is not None else FragmentCache()
+        # Trend alerts for new readings; debounced so repeated highs don't flood the queue
+        # (one trend window for alerts and recommendation trends)
+        self.alerts = alerts or TrendAlertEvaluator(self.scheduler,
+                                                    window_minutes=self.recommendations.window_minutes)
+        # Users and session tokens (token lookups go through an in-memory index)
+        self.sessions = sessions or SessionManager(storage)
+        # Per-tenant token buckets for requests and writes, plus storage caps
+        self.quotas = quotas or TenantQuotas(storage)
+        # Change sequence numbers + tombstones for /api/sync, and pushed idempotency keys
+        self.changes = changes or ChangeLog(storage)
+        self.sync_keys = sync_keys or SyncKeys(storage)
+        # Group commit: POSTed readings are stored and fsynced together, every few ms
+        self.ingest = ingest or GroupCommitWriter(storage)
+        # Old readings -> compressed archive segments + 15 min / hourly rollups
+        self.retention = retention or RetentionService(storage, on_archived=self.quotas.record_deletes)
+        # LTTB-downsampled chart series, cached per (user, range, resolution)
+        self.series = series or SeriesService(storage, self.retention)
+        # Clinician reports, computed in background workers and cached per data version
+        self.reports = reports or ReportService(storage, self.retention)
+        # Background jobs (separate from the demo scheduler queue); see start_background_jobs()
+        self.maintenance = maintenance if maintenance is not None else PriorityScheduler()
+        self.maintenance.every('Retention: archive old readings', RETENTION_INTERVAL_SECONDS,
+                               self.retention.run, priority=4)
+        self.maintenance.every('Sync: compact old tombstones and keys', COMPACT_INTERVAL_SECONDS,
+                               self.compact_sync, priority=6)
+        self.maintenance.every('Sessions: purge expired', SESSION_PURGE_SECONDS,
+                               self.sessions.purge_expired, priority=6)
+        # Daily online snapshot + a journal of every write since (point-in-time restore)
+        self.backups = backups or BackupManager(storage)
+        self.maintenance.every('Backup: snapshot', BACKUP_INTERVAL_SECONDS,
+                               self.backups.snapshot_if_due, priority=5)
+
+    def init_app(self, app):
+        app.extensions[EXTENSION_KEY] = self
+
+    def compact_sync(self):
+        """Drop old sync tombstones and expired idempotency keys."""
+        return {'tombstones': self.changes.compact(), 'keys': self.sync_keys.purge_expired()}
+
+    def start_background_jobs(self):
+        """Run recurring maintenance jobs (retention, backups) in a worker thread."""
+        self.maintenance.start()
+
+
+def get_services():
+    """Services of the current app."""
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def service(name):
+    """Proxy to one service of the current app, e.g. ``storage = service('storage')``."""
+    return LocalProxy(lambda: getattr(get_services(), name))
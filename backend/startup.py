@@ -0,0 +1,49 @@
+"""
+backend.startup
+
+Startup timing and readiness.
+
+Liveness (``/api/ping``) only says the process answers requests.
+Readiness (``/api/ready``) says the data has been loaded and every route
+can answer without waiting. ``StartupMetrics`` records how long each
+phase took so startup time can be tracked as the data grows.
+"""
+import time
+
+
+class StartupMetrics:
+    """Timestamps (``time.perf_counter``) for import, app creation and readiness."""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.created = None
+        self.ready = None
+        self.error = None
+
+    def mark_created(self):
+        self.created = time.perf_counter()
+
+    def mark_ready(self, error=None):
+        self.error = error
+        self.ready = time.perf_counter()
+
+    @property
+    def state(self):
+        if self.error:
+            return 'failed'
+        if self.ready is not None:
+            return 'ready'
+        return 'loading' if self.created is not None else 'starting'
+
+    def _ms(self, end):
+        return round((end - self.started) * 1000, 1) if end is not None else None
+
+    def snapshot(self):
+        """Dict of the startup phases in milliseconds since ``started``."""
+        return {
+            'state': self.state,
+            'app_created_ms': self._ms(self.created),
+            'ready_ms': self._ms(self.ready),
+            'uptime_s': round(time.perf_counter() - self.started, 1),
+            'error': self.error,
+        }
@@ -0,0 +1,43 @@
+"""
+backend.storage
+
+One storage interface, several engines.
+
+Data is kept in named collections ("readings", "foods", ...) of dict
+records with an integer ``id``. Every engine implements the same small
+interface (see ``Storage``), so routes and models never care where the
+data lives:
+
+- ``json``:   one ``<name>.json`` file per collection, rewritten on change
+- ``log``:    one append-only ``<name>.log`` JSON-lines file per collection
+- ``sqlite``: one ``tracker.db`` SQLite database
+
+Pick one with ``open_storage(engine, data_dir)``. Run
+``python -m backend.storage.conformance`` to check every engine against
+the same behaviour and compare their speed.
+"""
+from .base import Storage, StorageError
+from .json_engine import JsonStorage
+from .log_engine import AppendLogStorage
+from .sqlite_engine import SqliteStorage
+
+ENGINES = {
+    'json': JsonStorage,
+    'log': AppendLogStorage,
+    'sqlite': SqliteStorage,
+}
+
+DEFAULT_ENGINE = 'json'
+
+
+def open_storage(engine, data_dir, **kwargs):
+    """Create a storage engine by name (json, log or sqlite). Nothing is read yet."""
+    try:
+        cls = ENGINES[engine or DEFAULT_ENGINE]
+    except KeyError:
+        raise StorageError(f"unknown storage engine {engine!r} (choose from {', '.join(ENGINES)})")
+    return cls(data_dir, **kwargs)
+
+
+__all__ = ['Storage', 'StorageError', 'JsonStorage', 'AppendLogStorage', 'SqliteStorage',
+           'ENGINES', 'DEFAULT_ENGINE', 'open_storage']
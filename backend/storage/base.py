@@ -0,0 +1,315 @@
+"""
+backend.storage.base
+
+The storage interface shared by every engine.
+
+Engines implement the underscore hooks (``_open``, ``_all``, ``_find``,
+``_insert_many``, ``_update``, ``_delete``, ``_delete_many``, ``_sync``,
+``_snapshot``, ``_close``, ``_high_water``, ``_save_high_water``); this
+base class adds lazy loading, background preloading, seeding, id
+assignment and locking so each engine only deals with its own file format.
+
+Ids are never reused, not even after a restart that follows deleting the
+newest records: before a delete, the highest id handed out so far is
+saved (``_save_high_water``), and new ids start above it.
+
+Records handed out by ``all``/``find``/``filter`` may be shared with the
+engine's in-memory state: treat them as read-only and change data only
+through ``insert``/``update``/``delete``.
+
+Other services can ``watch`` every successful write (the sync change log
+and the backup journal do). Watchers run under the storage lock, so they
+see writes in the order they happened.
+"""
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+
+COLLECTIONS = ('readings', 'foods')
+
+_NAME_RE = re.compile(r'^[a-z][a-z0-9_]*$')
+
+
+class StorageError(Exception):
+    """Raised for invalid collection names or unknown engines."""
+
+
+def link_or_copy(src, dst):
+    """Hard link ``src`` to ``dst`` (no data copied); copy if linking is not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class Storage:
+    """Base class for storage engines.
+
+    Methods:
+    - load(): open the engine (once); called automatically on first use
+    - start_background_load(): load from a daemon thread
+    - all(name), find(name, id), filter(name, **equals), count(name)
+    - insert(name, record), insert_many(name, records)
+    - update(name, id, fields), delete(name, id), delete_many(name, ids)
+    - watch(callback): call ``callback(name, op, records)`` after each write
+    - sync(): make every write so far durable (fsync)
+    - snapshot(target_dir): consistent copy of all collections (hard links where possible)
+    - close()
+    """
+
+    engine = None
+
+    def __init__(self, data_dir, collections=COLLECTIONS, seed=None, on_load=None):
+        self.data_dir = Path(data_dir)
+        self.collections = tuple(collections)
+        self.seed = seed or {}
+        self.on_load = on_load
+        self.load_seconds = None
+        self.error = None
+        self._lock = threading.RLock()
+        self._loaded = threading.Event()
+        self._next_ids = {}
+        self._watchers = []
+
+    # ---------------------- Lifecycle ----------------------
+
+    def load(self):
+        """Open the engine (once) and seed it if the data folder has no data of this engine yet."""
+        if self._loaded.is_set():
+            return
+        with self._lock:
+            if self._loaded.is_set():
+                return
+            started = time.perf_counter()
+            try:
+                # Only a brand-new folder is seeded: collections emptied by use
+                # (e.g. every reading archived) must stay empty
+                new = not self._has_data()
+                self._open()
+                for name in self.collections + tuple(n for n in self.seed if n not in self.collections):
+                    self._check_name(name)
+                    if new and self.seed.get(name):
+                        self._insert_many(name, self._with_ids(name, self.seed[name]))
+            except Exception as e:
+                self.error = str(e)
+                if self.on_load:
+                    self.on_load(self)
+                raise
+            self.load_seconds = time.perf_counter() - started
+            self.error = None
+            self._loaded.set()
+        if self.on_load:
+            self.on_load(self)
+
+    def start_background_load(self):
+        """Load in a daemon thread so the app can serve /api/ping meanwhile."""
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"Error loading data: {e}")
+
+        thread = threading.Thread(target=run, name='storage-loader', daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def ready(self):
+        return self._loaded.is_set()
+
+    def close(self):
+        with self._lock:
+            if self._loaded.is_set():
+                self._close()
+            self._loaded.clear()
+            self._next_ids.clear()
+
+    # ---------------------- Public API ----------------------
+
+    def all(self, name):
+        """All records of a collection in insertion order."""
+        self._check_name(name)
+        self.load()
+        return self._all(name)
+
+    def find(self, name, record_id):
+        self._check_name(name)
+        self.load()
+        return self._find(name, record_id)
+
+    def filter(self, name, **equals):
+        """Records whose fields equal all of ``equals``."""
+        records = self.all(name)
+        for key, value in equals.items():
+            records = [r for r in records if r.get(key) == value]
+        return records
+
+    def count(self, name):
+        return len(self.all(name))
+
+    def insert(self, name, record):
+        """Store one record, assigning the next id if it has none."""
+        return self.insert_many(name, [record])[0]
+
+    def insert_many(self, name, records):
+        """Store several records in one write. Returns the stored records."""
+        self._check_name(name)
+        self.load()
+        with self._lock:
+            stored = self._with_ids(name, records)
+            if stored:
+                self._insert_many(name, stored)
+                self._notify(name, 'put', stored)
+            return stored
+
+    def update(self, name, record_id, fields):
+        """Merge ``fields`` into a record (its id never changes). None if missing."""
+        self._check_name(name)
+        self.load()
+        fields = {k: v for k, v in fields.items() if k != 'id'}
+        with self._lock:
+            record = self._update(name, record_id, fields)
+            if record is not None:
+                self._notify(name, 'put', [record])
+            return record
+
+    def delete(self, name, record_id):
+        """Delete a record. Returns False if it did not exist."""
+        self._check_name(name)
+        self.load()
+        with self._lock:
+            record = self._find(name, record_id) if self._watchers else None
+            self._keep_high_water(name)
+            deleted = self._delete(name, record_id)
+            if deleted and record is not None:
+                self._notify(name, 'del', [record])
+            return deleted
+
+    def delete_many(self, name, record_ids):
+        """Delete several records in one write. Returns how many existed."""
+        self._check_name(name)
+        self.load()
+        with self._lock:
+            records = [r for r in (self._find(name, i) for i in dict.fromkeys(record_ids)) if r is not None]
+            if records:
+                self._keep_high_water(name)
+                self._delete_many(name, [r['id'] for r in records])
+                self._notify(name, 'del', records)
+            return len(records)
+
+    def sync(self):
+        """
+        fsync everything written since the last sync. Writes are not
+        fsynced one by one; a caller that needs durability (the group
+        commit writer) batches many writes and then calls ``sync`` once.
+        """
+        if not self._loaded.is_set():
+            return
+        with self._lock:
+            self._sync()
+            self._notify(None, 'sync', [])
+
+    def snapshot(self, target_dir):
+        """
+        Write a consistent copy of every collection into ``target_dir``
+        while requests keep running. Returns ``{file name: info}`` where
+        info says how to restore the file: ``{"immutable": True}`` (safe to
+        hard link), ``{"bytes": n}`` (only the first n bytes belong to the
+        snapshot) or ``{}`` (copy it).
+        """
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        return self._snapshot(target_dir)
+
+    def watch(self, callback):
+        """
+        Call ``callback(name, op, records)`` after every successful write:
+        op is ``'put'`` (inserted/updated records) or ``'del'`` (the
+        records as they were before deletion). After ``sync()`` watchers
+        get ``(None, 'sync', [])`` so they can make their own files durable.
+        """
+        self._watchers.append(callback)
+
+    # ---------------------- Helpers ----------------------
+
+    def _check_name(self, name):
+        if not _NAME_RE.match(name or ''):
+            raise StorageError(f"invalid collection name {name!r}")
+
+    def _notify(self, name, op, records):
+        for callback in self._watchers:
+            callback(name, op, records)
+
+    def _next_id(self, name):
+        if name not in self._next_ids:
+            self._next_ids[name] = max(self._max_id(name), self._high_water(name)) + 1
+        return self._next_ids[name]
+
+    def _keep_high_water(self, name):
+        """Save the highest id handed out before records (maybe the newest) are deleted."""
+        high = self._next_id(name) - 1
+        if high > self._high_water(name):
+            self._save_high_water(name, high)
+
+    def _with_ids(self, name, records):
+        """Copy records, giving each one without an id the next free id."""
+        next_id = self._next_id(name)
+        stored = []
+        for r in records:
+            r = dict(r)
+            if r.get('id') is None:
+                r = {'id': next_id, **{k: v for k, v in r.items() if k != 'id'}}
+            next_id = max(next_id, r['id'] + 1)
+            stored.append(r)
+        self._next_ids[name] = next_id
+        return stored
+
+    # ---------------------- Engine hooks ----------------------
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _has_data(self):
+        """True if the data folder already holds files of this engine (checked before ``_open``)."""
+        raise NotImplementedError
+
+    def _all(self, name):
+        raise NotImplementedError
+
+    def _find(self, name, record_id):
+        raise NotImplementedError
+
+    def _insert_many(self, name, records):
+        raise NotImplementedError
+
+    def _update(self, name, record_id, fields):
+        raise NotImplementedError
+
+    def _delete(self, name, record_id):
+        raise NotImplementedError
+
+    def _delete_many(self, name, record_ids):
+        for record_id in record_ids:
+            self._delete(name, record_id)
+
+    def _max_id(self, name):
+        return max((r.get('id', 0) for r in self._all(name)), default=0)
+
+    def _high_water(self, name):
+        """Highest id ever handed out in a collection, as saved by ``_save_high_water``."""
+        return 0
+
+    def _save_high_water(self, name, high):
+        pass
+
+    def _sync(self):
+        pass
+
+    def _snapshot(self, target_dir):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
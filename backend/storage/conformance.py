@@ -0,0 +1,373 @@
+"""
+backend.storage.conformance
+
+Conformance suite for storage engines.
+
+Every ``check_*`` function takes a ``factory(data_dir)`` that opens an
+engine on a directory, and raises ``AssertionError`` if the engine does
+not behave like the others. ``run`` executes all checks against every
+registered engine, then times a small workload so the fastest engine can
+be picked per deployment:
+
+    python -m backend.storage.conformance            # all engines
+    python -m backend.storage.conformance sqlite     # just one
+    python -m backend.storage.conformance --records 20000
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from . import ENGINES
+
+SEED = {
+    'readings': [
+        {'id': 1, 'user_id': 1, 'glucose': 95.0, 'created_at': '2025-11-25T08:00:00Z'},
+        {'id': 2, 'user_id': 2, 'glucose': 142.0, 'created_at': '2025-11-25T12:30:00Z'},
+    ],
+}
+
+
+def _reading(user_id=1, glucose=100.0, **extra):
+    return {'user_id': user_id, 'glucose': glucose, 'context': 'general',
+            'created_at': '2025-11-26T08:00:00Z', **extra}
+
+
+# ---------------------- Checks ----------------------
+
+def check_empty(factory, tmp):
+    s = factory(tmp)
+    assert s.all('readings') == []
+    assert s.count('readings') == 0
+    assert s.find('readings', 1) is None
+    s.close()
+
+
+def check_insert_assigns_ids(factory, tmp):
+    s = factory(tmp)
+    a = s.insert('readings', _reading())
+    b = s.insert('readings', _reading())
+    assert (a['id'], b['id']) == (1, 2), (a, b)
+    c = s.insert('readings', _reading(id=10))
+    d = s.insert('readings', _reading())
+    assert (c['id'], d['id']) == (10, 11), (c, d)
+    assert [r['id'] for r in s.all('readings')] == [1, 2, 10, 11]
+    s.close()
+
+
+def check_insert_many(factory, tmp):
+    s = factory(tmp)
+    stored = s.insert_many('readings', [_reading(glucose=g) for g in (90, 100, 110)])
+    assert [r['id'] for r in stored] == [1, 2, 3]
+    assert [r['glucose'] for r in s.all('readings')] == [90, 100, 110]
+    assert s.insert_many('readings', []) == []
+    s.close()
+
+
+def check_find_and_filter(factory, tmp):
+    s = factory(tmp)
+    s.insert_many('readings', [_reading(user_id=1), _reading(user_id=2), _reading(user_id=1, context='fasting')])
+    assert s.find('readings', 2)['user_id'] == 2
+    assert [r['id'] for r in s.filter('readings', user_id=1)] == [1, 3]
+    assert [r['id'] for r in s.filter('readings', user_id=1, context='fasting')] == [3]
+    assert s.filter('readings', user_id=99) == []
+    s.close()
+
+
+def check_update(factory, tmp):
+    s = factory(tmp)
+    s.insert('readings', _reading())
+    updated = s.update('readings', 1, {'note': 'after walk', 'id': 99})
+    assert updated['note'] == 'after walk' and updated['id'] == 1, updated
+    assert s.find('readings', 1)['note'] == 'after walk'
+    assert s.find('readings', 99) is None
+    assert s.update('readings', 42, {'note': 'x'}) is None
+    s.close()
+
+
+def check_delete(factory, tmp):
+    s = factory(tmp)
+    s.insert_many('readings', [_reading(), _reading(), _reading()])
+    assert s.delete('readings', 2) is True
+    assert s.delete('readings', 2) is False
+    assert [r['id'] for r in s.all('readings')] == [1, 3]
+    # ids are not reused after a delete
+    assert s.insert('readings', _reading())['id'] == 4
+    s.close()
+
+
+def check_delete_many(factory, tmp):
+    s = factory(tmp)
+    s.insert_many('readings', [_reading() for _ in range(5)])
+    assert s.delete_many('readings', [2, 4, 99]) == 2
+    assert [r['id'] for r in s.all('readings')] == [1, 3, 5]
+    assert s.find('readings', 2) is None
+    s.close()
+    s = factory(tmp)
+    assert [r['id'] for r in s.all('readings')] == [1, 3, 5]
+    s.close()
+
+
+def check_ids_not_reused_after_restart(factory, tmp):
+    s = factory(tmp)
+    s.insert_many('readings', [_reading() for _ in range(3)])
+    s.delete_many('readings', [1, 2, 3])
+    s.insert('foods', {'food': 'toast'})
+    s.delete('foods', 1)
+    s.close()
+    s = factory(tmp)
+    # The newest records were deleted: new ids must still start above them
+    assert s.insert('readings', _reading())['id'] == 4
+    assert s.insert('foods', {'food': 'tea'})['id'] == 2
+    s.close()
+
+
+def check_persistence(factory, tmp):
+    s = factory(tmp)
+    s.insert_many('readings', [_reading(glucose=g) for g in (90, 100, 110)])
+    s.update('readings', 1, {'note': 'kept'})
+    s.delete('readings', 2)
+    s.insert('foods', {'food': 'Oatmeal'})
+    s.close()
+
+    s = factory(tmp)
+    assert [r['id'] for r in s.all('readings')] == [1, 3]
+    assert s.find('readings', 1)['note'] == 'kept'
+    assert s.all('foods')[0]['food'] == 'Oatmeal'
+    assert s.insert('readings', _reading())['id'] == 4
+    s.close()
+
+
+def check_other_collections(factory, tmp):
+    s = factory(tmp)
+    s.insert('sessions', {'user_id': 1, 'token': 'abc'})
+    assert s.filter('sessions', token='abc')[0]['id'] == 1
+    s.close()
+    s = factory(tmp)
+    assert s.count('sessions') == 1
+    s.close()
+
+
+def check_invalid_name(factory, tmp):
+    s = factory(tmp)
+    try:
+        s.all('readings; DROP TABLE foods')
+    except Exception as e:
+        assert type(e).__name__ == 'StorageError', e
+    else:
+        raise AssertionError('invalid collection name was accepted')
+    s.close()
+
+
+def check_seed(factory, tmp):
+    s = factory(tmp, seed=SEED)
+    assert [r['id'] for r in s.all('readings')] == [1, 2]
+    assert s.insert('readings', _reading())['id'] == 3
+    s.close()
+    s = factory(tmp, seed=SEED)
+    assert s.count('readings') == 3
+    s.delete_many('readings', [1, 2, 3])
+    s.close()
+    # Seeding only happens for a brand-new folder, not for an emptied collection
+    s = factory(tmp, seed=SEED)
+    assert s.count('readings') == 0
+    s.close()
+
+
+def check_torn_tail(factory, tmp):
+    s = factory(tmp)
+    if s.engine != 'log':
+        # Only append-only files can end in half a record after a crash
+        s.close()
+        return
+    s.insert_many('readings', [_reading(), _reading()])
+    s.sync()
+    s.close()
+    with open(s.path('readings'), 'ab') as f:
+        f.write(b'{"op": "put", "r": {"id": 3, "glu')
+    s = factory(tmp)
+    assert [r['id'] for r in s.all('readings')] == [1, 2]
+    s.insert('readings', _reading())
+    s.sync()
+    s.close()
+    # The record written after the torn line must survive the next open
+    s = factory(tmp)
+    assert [r['id'] for r in s.all('readings')] == [1, 2, 3], s.all('readings')
+    s.close()
+
+
+def check_lazy_and_background_load(factory, tmp):
+    loaded = []
+    s = factory(tmp, on_load=lambda st: loaded.append(st.error))
+    assert not s.ready
+    s.start_background_load().join(5)
+    assert s.ready and loaded == [None], loaded
+    s.close()
+
+
+def check_watchers(factory, tmp):
+    s = factory(tmp)
+    events = []
+    s.watch(lambda name, op, records: events.append((name, op, [r['id'] for r in records])))
+    s.insert_many('readings', [_reading(), _reading()])
+    s.update('readings', 2, {'note': 'x'})
+    s.update('readings', 42, {'note': 'x'})
+    s.delete('readings', 1)
+    s.delete('readings', 1)
+    assert events == [('readings', 'put', [1, 2]), ('readings', 'put', [2]), ('readings', 'del', [1])], events
+    s.close()
+
+
+def check_sync(factory, tmp):
+    s = factory(tmp)
+    s.sync()  # nothing loaded yet: a no-op
+    s.insert_many('readings', [_reading(), _reading()])
+    s.update('readings', 1, {'note': 'x'})
+    s.sync()
+    s.sync()
+    s.close()
+    s = factory(tmp)
+    assert s.count('readings') == 2 and s.find('readings', 1)['note'] == 'x'
+    s.close()
+
+
+def check_snapshot(factory, tmp):
+    s = factory(tmp / 'live')
+    s.insert_many('readings', [_reading(), _reading()])
+    s.insert('foods', {'user_id': 1, 'food': 'toast'})
+    files = s.snapshot(tmp / 'snap')
+    # Writes after the snapshot must not leak into it
+    s.update('readings', 1, {'glucose': 1.0})
+    s.delete('readings', 2)
+    s.insert('readings', _reading())
+    s.close()
+    (tmp / 'restored').mkdir()
+    for name, info in files.items():
+        data = (tmp / 'snap' / name).read_bytes()
+        (tmp / 'restored' / name).write_bytes(data[:info['bytes']] if 'bytes' in info else data)
+    r = factory(tmp / 'restored')
+    assert [x['glucose'] for x in r.all('readings')] == [100.0, 100.0]
+    assert r.count('foods') == 1
+    r.close()
+
+
+def check_concurrent_inserts(factory, tmp):
+    s = factory(tmp)
+
+    def worker():
+        for _ in range(50):
+            s.insert('readings', _reading())
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ids = [r['id'] for r in s.all('readings')]
+    assert len(ids) == 200 and len(set(ids)) == 200
+    s.close()
+
+
+CHECKS = [
+    check_empty,
+    check_insert_assigns_ids,
+    check_insert_many,
+    check_find_and_filter,
+    check_update,
+    check_delete,
+    check_delete_many,
+    check_ids_not_reused_after_restart,
+    check_persistence,
+    check_other_collections,
+    check_invalid_name,
+    check_seed,
+    check_torn_tail,
+    check_lazy_and_background_load,
+    check_watchers,
+    check_sync,
+    check_snapshot,
+    check_concurrent_inserts,
+]
+
+
+# ---------------------- Runner ----------------------
+
+def _fresh_dir():
+    return Path(tempfile.mkdtemp(prefix='storage-conformance-'))
+
+
+def run_checks(engine):
+    """Run every check against one engine. Returns a list of (check, error)."""
+    cls = ENGINES[engine]
+    failures = []
+    for check in CHECKS:
+        tmp = _fresh_dir()
+        try:
+            check(lambda d, **kw: cls(d, **kw), tmp)
+        except Exception:
+            failures.append((check.__name__, traceback.format_exc()))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return failures
+
+
+def benchmark(engine, records=2000):
+    """Time a small workload; returns {step: milliseconds}."""
+    cls = ENGINES[engine]
+    tmp = _fresh_dir()
+    timings = {}
+
+    def timed(step, fn):
+        t0 = time.perf_counter()
+        fn()
+        timings[step] = (time.perf_counter() - t0) * 1000
+
+    try:
+        s = cls(tmp)
+        single = max(1, records // 10)
+        timed(f'insert x{single}', lambda: [s.insert('readings', _reading(user_id=i % 5)) for i in range(single)])
+        timed(f'insert_many {records}', lambda: s.insert_many('readings', [_reading(user_id=i % 5) for i in range(records)]))
+        timed('filter user x20', lambda: [s.filter('readings', user_id=i % 5) for i in range(20)])
+        timed('find x1000', lambda: [s.find('readings', 1 + i % records) for i in range(1000)])
+        timed(f'update x{single}', lambda: [s.update('readings', 1 + i, {'note': 'x'}) for i in range(single)])
+        s.close()
+        s = cls(tmp)
+        timed('reopen + all', lambda: s.all('readings'))
+        s.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return timings
+
+
+def run(engines=None, records=2000):
+    """Check and benchmark engines. Returns True if every engine conforms."""
+    ok = True
+    results = {}
+    for engine in engines or list(ENGINES):
+        failures = run_checks(engine)
+        status = 'ok' if not failures else f'{len(failures)} FAILED'
+        print(f'{engine:<8} {len(CHECKS) - len(failures)}/{len(CHECKS)} checks {status}')
+        for name, tb in failures:
+            ok = False
+            print(f'  - {name}\n{tb}')
+        results[engine] = benchmark(engine, records)
+
+    steps = list(next(iter(results.values())))
+    print('\n' + 'ms'.ljust(22) + ''.join(e.rjust(10) for e in results))
+    for step in steps:
+        print(step.ljust(22) + ''.join(f'{results[e][step]:10.1f}' for e in results))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Storage engine conformance suite')
+    parser.add_argument('engines', nargs='*', help=f"engines to check (default: {' '.join(ENGINES)})")
+    parser.add_argument('--records', type=int, default=2000)
+    args = parser.parse_args()
+    unknown = [e for e in args.engines if e not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engine(s): {', '.join(unknown)}")
+    raise SystemExit(0 if run(args.engines or None, args.records) else 1)
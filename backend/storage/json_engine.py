@@ -0,0 +1,163 @@
+"""
+backend.storage.json_engine
+
+The original storage format: one ``<name>.json`` array per collection.
+
+Each collection is read once into memory (list + id index) on first use;
+every write rewrites that collection's file atomically (temp file +
+rename). Simple and human-readable, but writes cost O(collection size).
+``_ids.json`` keeps the highest id handed out per collection, so ids of
+deleted records are not reused after a restart.
+"""
+import os
+
+from ..serialization import dumps, loads
+from .base import Storage, link_or_copy
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Not supported for directories on every platform (e.g. Windows)
+        pass
+    finally:
+        os.close(fd)
+
+
+# Not a valid collection name, so it can't clash with one
+_IDS = '_ids'
+
+
+class JsonStorage(Storage):
+    engine = 'json'
+
+    def _open(self):
+        self._lists = {}
+        self._index = {}
+        self._dirty = set()
+        self._ids = self._read(_IDS, default={})
+        for name in self.collections:
+            self._collection(name)
+
+    def _has_data(self):
+        return any(self.data_dir.glob('*.json'))
+
+    def path(self, name):
+        return self.data_dir / f'{name}.json'
+
+    def _collection(self, name):
+        records = self._lists.get(name)
+        if records is None:
+            with self._lock:
+                records = self._lists.get(name)
+                if records is None:
+                    records = self._read(name)
+                    self._index[name] = {r.get('id'): r for r in records}
+                    self._lists[name] = records
+        return records
+
+    def _read(self, name, default=None):
+        default = [] if default is None else default
+        path = self.path(name)
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            data = loads(raw) if raw.strip() else default
+            return data if isinstance(data, type(default)) else default
+        except FileNotFoundError:
+            return default
+        except ValueError as e:
+            print(f"Error reading {path}: {e}")
+            return default
+
+    def _save(self, name):
+        """Write a collection atomically. Returns True on success."""
+        path = self.path(name)
+        tmp = path.with_suffix('.json.tmp')
+        try:
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(dumps(self._ids if name == _IDS else self._lists[name]))
+            os.replace(tmp, path)
+            self._dirty.add(name)
+            return True
+        except OSError as e:
+            print(f"Error saving {path}: {e}")
+            return False
+
+    def _all(self, name):
+        return self._collection(name)
+
+    def _find(self, name, record_id):
+        self._collection(name)
+        return self._index[name].get(record_id)
+
+    def _insert_many(self, name, records):
+        self._collection(name).extend(records)
+        index = self._index[name]
+        for r in records:
+            index[r['id']] = r
+        self._save(name)
+
+    def _update(self, name, record_id, fields):
+        record = self._find(name, record_id)
+        if record is None:
+            return None
+        record.update(fields)
+        self._save(name)
+        return record
+
+    def _delete(self, name, record_id):
+        if self._find(name, record_id) is None:
+            return False
+        del self._index[name][record_id]
+        # Rebind rather than mutate so readers iterating the old list are unaffected
+        self._lists[name] = [r for r in self._lists[name] if r.get('id') != record_id]
+        self._save(name)
+        return True
+
+    def _delete_many(self, name, record_ids):
+        index = self._index[name]
+        for record_id in record_ids:
+            index.pop(record_id, None)
+        gone = set(record_ids)
+        self._lists[name] = [r for r in self._lists[name] if r.get('id') not in gone]
+        self._save(name)
+
+    def _high_water(self, name):
+        return self._ids.get(name, 0)
+
+    def _save_high_water(self, name, high):
+        self._ids[name] = high
+        self._save(_IDS)
+
+    def _sync(self):
+        # fsync the replaced files, then the directory that holds the new names
+        for name in self._dirty:
+            fd = os.open(self.path(name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if self._dirty:
+            _fsync_dir(self.data_dir)
+        self._dirty.clear()
+
+    def _snapshot(self, target_dir):
+        # Every save replaces the file (a new inode), so a hard link is a frozen copy
+        files = {}
+        with self._lock:
+            for path in sorted(self.data_dir.glob('*.json')):
+                link_or_copy(path, target_dir / path.name)
+                files[path.name] = {'immutable': True}
+        return files
+
+    def _close(self):
+        self._lists = {}
+        self._index = {}
+        self._ids = {}
@@ -0,0 +1,187 @@
+"""
+backend.storage.log_engine
+
+Append-only log engine: one ``<name>.log`` JSON-lines file per collection.
+
+Every change appends a single line (``{"op": "put", "r": {...}}`` or
+``{"op": "del", "id": n}``), so a write costs O(record) instead of
+rewriting the whole collection. Opening a collection replays its log into
+memory. When the log holds many more lines than live records it is
+compacted (rewritten with one ``put`` per record) on open; the compacted
+log starts with ``{"op": "ids", "high": n}`` so the ids of deleted records
+are still not reused.
+"""
+import os
+
+from ..serialization import dumps, loads
+from .base import Storage, link_or_copy
+
+# Compact on open when the log has this many times more lines than records
+COMPACT_RATIO = 2
+COMPACT_MIN_LINES = 1000
+
+
+class AppendLogStorage(Storage):
+    engine = 'log'
+
+    def __init__(self, data_dir, fsync=False, **kwargs):
+        super().__init__(data_dir, **kwargs)
+        self.fsync = fsync
+
+    def _open(self):
+        self._records = {}
+        self._high = {}
+        self._files = {}
+        self._dirty = set()
+        for name in self.collections:
+            self._collection(name)
+
+    def _has_data(self):
+        return any(self.data_dir.glob('*.log'))
+
+    def path(self, name):
+        return self.data_dir / f'{name}.log'
+
+    def _collection(self, name):
+        records = self._records.get(name)
+        if records is None:
+            with self._lock:
+                records = self._records.get(name)
+                if records is None:
+                    records, lines, self._high[name] = self._replay(name)
+                    self._records[name] = records
+                    if lines >= COMPACT_MIN_LINES and lines > COMPACT_RATIO * len(records):
+                        self.compact(name)
+        return records
+
+    def _replay(self, name):
+        records = {}
+        lines = 0
+        high = 0
+        try:
+            with open(self.path(name), 'rb+') as f:
+                end = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # A torn last line from a crash mid-append: cut it off,
+                        # or the next append would be glued onto it
+                        f.truncate(end)
+                        break
+                    end += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = loads(line)
+                    except ValueError:
+                        continue
+                    lines += 1
+                    if entry.get('op') == 'put':
+                        record = entry['r']
+                        records[record['id']] = record
+                        high = max(high, record['id'])
+                    elif entry.get('op') == 'del':
+                        records.pop(entry['id'], None)
+                    elif entry.get('op') == 'ids':
+                        high = max(high, entry['high'])
+        except FileNotFoundError:
+            pass
+        return records, lines, high
+
+    def _file(self, name):
+        f = self._files.get(name)
+        if f is None:
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            f = self._files[name] = open(self.path(name), 'ab')
+        return f
+
+    def _append(self, name, entries):
+        f = self._file(name)
+        f.write(b''.join(dumps(e) + b'\n' for e in entries))
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        else:
+            self._dirty.add(name)
+
+    def compact(self, name):
+        """Rewrite a collection's log with one line per live record."""
+        with self._lock:
+            records = self._collection(name)
+            f = self._files.pop(name, None)
+            if f is not None:
+                f.close()
+            path = self.path(name)
+            tmp = path.with_suffix('.log.tmp')
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            high = max(self._high.get(name, 0), self._next_ids.get(name, 1) - 1, max(records, default=0))
+            with open(tmp, 'wb') as out:
+                out.write(dumps({'op': 'ids', 'high': high}) + b'\n')
+                out.write(b''.join(dumps({'op': 'put', 'r': r}) + b'\n' for r in records.values()))
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, path)
+
+    def _all(self, name):
+        return list(self._collection(name).values())
+
+    def _find(self, name, record_id):
+        return self._collection(name).get(record_id)
+
+    def _insert_many(self, name, records):
+        stored = self._collection(name)
+        self._append(name, [{'op': 'put', 'r': r} for r in records])
+        for r in records:
+            stored[r['id']] = r
+
+    def _update(self, name, record_id, fields):
+        record = self._find(name, record_id)
+        if record is None:
+            return None
+        record.update(fields)
+        self._append(name, [{'op': 'put', 'r': record}])
+        return record
+
+    def _delete(self, name, record_id):
+        if self._find(name, record_id) is None:
+            return False
+        self._append(name, [{'op': 'del', 'id': record_id}])
+        del self._records[name][record_id]
+        return True
+
+    def _delete_many(self, name, record_ids):
+        self._append(name, [{'op': 'del', 'id': i} for i in record_ids])
+        for record_id in record_ids:
+            del self._records[name][record_id]
+
+    def _max_id(self, name):
+        return max(self._collection(name), default=0)
+
+    def _high_water(self, name):
+        # Every put stays in the log until compaction, which writes an "ids" line
+        self._collection(name)
+        return self._high.get(name, 0)
+
+    def _sync(self):
+        for name in self._dirty:
+            f = self._files.get(name)
+            if f is not None:
+                os.fsync(f.fileno())
+        self._dirty.clear()
+
+    def _snapshot(self, target_dir):
+        # Logs only grow (compaction writes a new file), so a hard link plus
+        # the current length is a consistent copy
+        files = {}
+        with self._lock:
+            for path in sorted(self.data_dir.glob('*.log')):
+                size = path.stat().st_size
+                link_or_copy(path, target_dir / path.name)
+                files[path.name] = {'bytes': size}
+        return files
+
+    def _close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._records = {}
+        self._high = {}
@@ -0,0 +1,149 @@
+"""
+backend.storage.sqlite_engine
+
+SQLite engine: one ``tracker.db`` file, one table per collection.
+
+Each table keeps the record as a JSON ``body`` plus an ``id`` primary key
+and an indexed ``user_id`` column, so ``find`` and per-user ``filter`` are
+index lookups instead of full scans. WAL mode lets readers run while a
+write is in progress. Tables use ``AUTOINCREMENT``, so SQLite remembers
+the highest id ever used and ids of deleted records are never reused;
+older tables without it are rebuilt once on open.
+"""
+import os
+import sqlite3
+
+from ..serialization import dumps, loads
+from .base import Storage
+
+DB_NAME = 'tracker.db'
+
+
+class SqliteStorage(Storage):
+    engine = 'sqlite'
+
+    def _open(self):
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.data_dir / DB_NAME), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._tables = set()
+        for name in self.collections:
+            self._table(name)
+
+    def _has_data(self):
+        return (self.data_dir / DB_NAME).exists()
+
+    def _table(self, name):
+        # name is validated by Storage._check_name, so it is safe to interpolate
+        if name not in self._tables:
+            with self._lock, self._db:
+                rows = self._db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                        (name,)).fetchall()
+                old = bool(rows) and 'AUTOINCREMENT' not in rows[0][0].upper()
+                if old:
+                    self._db.execute(f'DROP INDEX IF EXISTS "{name}_user_id"')
+                    self._db.execute(f'ALTER TABLE "{name}" RENAME TO "{name}__old"')
+                self._db.execute(f'CREATE TABLE IF NOT EXISTS "{name}" '
+                                 '(id INTEGER PRIMARY KEY AUTOINCREMENT, user_id, body TEXT NOT NULL)')
+                if old:
+                    self._db.execute(f'INSERT INTO "{name}" (id, user_id, body) '
+                                     f'SELECT id, user_id, body FROM "{name}__old" ORDER BY id')
+                    self._db.execute(f'DROP TABLE "{name}__old"')
+                self._db.execute(f'CREATE INDEX IF NOT EXISTS "{name}_user_id" ON "{name}" (user_id)')
+            self._tables.add(name)
+        return name
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _all(self, name):
+        rows = self._query(f'SELECT body FROM "{self._table(name)}" ORDER BY id')
+        return [loads(body) for (body,) in rows]
+
+    def _find(self, name, record_id):
+        rows = self._query(f'SELECT body FROM "{self._table(name)}" WHERE id = ?', (record_id,))
+        return loads(rows[0][0]) if rows else None
+
+    def filter(self, name, **equals):
+        if 'user_id' not in equals:
+            return super().filter(name, **equals)
+        self._check_name(name)
+        self.load()
+        user_id = equals.pop('user_id')
+        rows = self._query(f'SELECT body FROM "{self._table(name)}" WHERE user_id = ? ORDER BY id', (user_id,))
+        records = [loads(body) for (body,) in rows]
+        for key, value in equals.items():
+            records = [r for r in records if r.get(key) == value]
+        return records
+
+    def _insert_many(self, name, records):
+        table = self._table(name)
+        with self._lock, self._db:
+            self._db.executemany(f'INSERT INTO "{table}" (id, user_id, body) VALUES (?, ?, ?)',
+                                 [(r['id'], r.get('user_id'), dumps(r).decode('utf-8')) for r in records])
+
+    def _update(self, name, record_id, fields):
+        record = self._find(name, record_id)
+        if record is None:
+            return None
+        record.update(fields)
+        with self._lock, self._db:
+            self._db.execute(f'UPDATE "{self._table(name)}" SET user_id = ?, body = ? WHERE id = ?',
+                             (record.get('user_id'), dumps(record).decode('utf-8'), record_id))
+        return record
+
+    def _delete(self, name, record_id):
+        with self._lock, self._db:
+            cur = self._db.execute(f'DELETE FROM "{self._table(name)}" WHERE id = ?', (record_id,))
+        return cur.rowcount > 0
+
+    def _delete_many(self, name, record_ids):
+        with self._lock, self._db:
+            self._db.executemany(f'DELETE FROM "{self._table(name)}" WHERE id = ?',
+                                 [(i,) for i in record_ids])
+
+    def _max_id(self, name):
+        rows = self._query(f'SELECT COALESCE(MAX(id), 0) FROM "{self._table(name)}"')
+        return rows[0][0]
+
+    def _high_water(self, name):
+        rows = self._query('SELECT seq FROM sqlite_sequence WHERE name = ?', (self._table(name),))
+        return rows[0][0] if rows else 0
+
+    def count(self, name):
+        self._check_name(name)
+        self.load()
+        return self._query(f'SELECT COUNT(*) FROM "{self._table(name)}"')[0][0]
+
+    def _sync(self):
+        # With synchronous=NORMAL a WAL commit is not fsynced; this makes all
+        # committed transactions durable at once (what synchronous=FULL does per commit)
+        wal = self.data_dir / (DB_NAME + '-wal')
+        try:
+            fd = os.open(wal, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _snapshot(self, target_dir):
+        # SQLite's online backup from a separate connection reads one consistent
+        # WAL snapshot and does not block writers. It copies every page.
+        path = self.data_dir / DB_NAME
+        if not path.exists():
+            return {}
+        source = sqlite3.connect(str(path))
+        target = sqlite3.connect(str(target_dir / DB_NAME))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return {DB_NAME: {}}
+
+    def _close(self):
+        self._db.close()
@@ -0,0 +1,332 @@
+"""
+backend.sync
+
+Offline-first delta sync for the static frontend.
+
+- ``ChangeLog`` watches the storage and gives every change to a reading
+  or food a server-side sequence number (``seq``). It keeps one entry
+  per record in the ``changes`` collection (the latest change wins, a
+  delete leaves a tombstone), and an in-memory index per user: a list of
+  seqs in ascending order plus ``record -> latest seq``. ``changes_since``
+  bisects into that list, so a delta costs O(log n + changes) instead of
+  a scan over the whole history. The changes of one storage write are
+  saved with one ``delete_many`` and one ``insert_many``, however many
+  records it touched.
+- ``compact`` (a maintenance job) drops tombstones older than
+  ``TOMBSTONE_TTL_SECONDS`` and raises the ``horizon`` to the newest seq
+  it dropped. A client whose cursor is below the horizon may have missed
+  a delete, so ``/api/sync`` answers it with a full snapshot instead.
+- ``SyncKeys`` remembers the result of every pushed change by its
+  client-chosen idempotency key, so a batch retried after a dropped
+  connection is not applied twice. Keys older than ``KEY_TTL_SECONDS``
+  are deleted by the same maintenance job as the tombstones.
+- ``apply_changes`` applies a pushed batch for a user, creating new
+  records with one ``insert_many`` per collection.
+
+A change can show up in two consecutive deltas (a write that lands while
+a delta is being read); clients apply puts as upserts by id and deletes
+as "remove if present", so that is harmless.
+"""
+import threading
+import time
+from bisect import bisect_right
+
+from . import models
+
+SYNCED_COLLECTIONS = ('readings', 'foods')
+DELTA_LIMIT = 1000
+# Idempotency keys are kept this long; a client offline for longer re-sends as new
+KEY_TTL_SECONDS = 30 * 24 * 3600
+# Deletes are remembered this long; a client that last synced before that gets a full resync
+TOMBSTONE_TTL_SECONDS = KEY_TTL_SECONDS
+COMPACT_INTERVAL_SECONDS = 24 * 3600
+
+_FOOD_FIELDS = ('date', 'time', 'food')
+
+
+class SyncError(Exception):
+    """Raised for a malformed pushed change."""
+
+
+def _owner(record):
+    return record.get('user_id', models.DEMO_USER_ID)
+
+
+class _UserLog:
+    """Per-user index: seqs in ascending order, and the latest seq per record."""
+
+    __slots__ = ('seqs', 'keys', 'latest')
+
+    def __init__(self):
+        self.seqs = []
+        self.keys = []
+        self.latest = {}
+
+    def add(self, seq, key):
+        self.seqs.append(seq)
+        self.keys.append(key)
+        self.latest[key] = seq
+        # Superseded entries are skipped on read; drop them once they dominate
+        if len(self.seqs) > 64 and len(self.seqs) > 2 * len(self.latest):
+            self.drop_superseded()
+
+    def drop_superseded(self):
+        live = [(s, k) for s, k in zip(self.seqs, self.keys) if self.latest.get(k) == s]
+        self.seqs = [s for s, _ in live]
+        self.keys = [k for _, k in live]
+
+
+class ChangeLog:
+    """Sequence numbers and tombstones for synced collections."""
+
+    def __init__(self, storage, collections=SYNCED_COLLECTIONS, tombstone_ttl=TOMBSTONE_TTL_SECONDS):
+        self.storage = storage
+        self.collections = tuple(collections)
+        self.tombstone_ttl = tombstone_ttl
+        self._users = None
+        # (collection, record id) -> (change entry id, op, time)
+        self._entries = {}
+        self._seq = 0
+        self._horizon = 0
+        # Lock order: storage, then this lock. Storage is never called while holding it.
+        self._lock = threading.RLock()
+        storage.watch(self._on_write)
+
+    @property
+    def cursor(self):
+        """The newest seq handed out so far."""
+        self._ensure_index()
+        return self._seq
+
+    @property
+    def horizon(self):
+        """Deltas are complete only for cursors at or above this seq."""
+        self._ensure_index()
+        return self._horizon
+
+    def _ensure_index(self):
+        if self._users is not None:
+            return
+        entries = sorted(self.storage.all('changes'), key=lambda c: c['seq'])
+        horizon = max((h['horizon'] for h in self.storage.all('sync_horizon')), default=0)
+        with self._lock:
+            if self._users is not None:
+                return
+            users = {}
+            for c in entries:
+                key = (c['collection'], c['record_id'])
+                self._entries[key] = (c['id'], c['op'], c.get('time', 0))
+                users.setdefault(c['user_id'], _UserLog()).add(c['seq'], key)
+            self._seq = max(entries[-1]['seq'] if entries else 0, horizon)
+            self._horizon = horizon
+            self._users = users
+
+    def _on_write(self, name, op, records):
+        if name not in self.collections:
+            return
+        self._ensure_index()
+        now = time.time()
+        new_entries = {}
+        with self._lock:
+            replaced = []
+            for record in records:
+                self._seq += 1
+                key = (name, record['id'])
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    replaced.append(old[0])
+                new_entries[key] = {'collection': name, 'record_id': record['id'], 'seq': self._seq,
+                                    'op': op, 'user_id': _owner(record), 'time': now}
+                self._users.setdefault(_owner(record), _UserLog()).add(self._seq, key)
+        # One write per storage write, not one per record (we are inside the storage lock here)
+        if replaced:
+            self.storage.delete_many('changes', replaced)
+        stored = self.storage.insert_many('changes', list(new_entries.values()))
+        with self._lock:
+            for entry in stored:
+                self._entries[(name, entry['record_id'])] = (entry['id'], op, now)
+
+    def changes_since(self, user_id, since, limit=DELTA_LIMIT):
+        """
+        ``(changes, cursor, more)`` for one user: every record changed after
+        ``since``, oldest first. Puts carry the current record, deletes are
+        tombstones with just the id. Check ``horizon`` first: below it,
+        deletes may be missing.
+        """
+        self._ensure_index()
+        more = False
+        with self._lock:
+            log = self._users.get(user_id)
+            cursor = self._seq
+            if log is None:
+                return [], cursor, False
+            picked = []
+            for i in range(bisect_right(log.seqs, since), len(log.seqs)):
+                seq, key = log.seqs[i], log.keys[i]
+                if log.latest.get(key) != seq:
+                    continue
+                if len(picked) == limit:
+                    cursor, more = picked[-1][0], True
+                    break
+                picked.append((seq, key))
+        # Records are read after releasing the lock (storage lock first, never inside ours)
+        return self._expand(picked), cursor, more
+
+    def _expand(self, picked):
+        changes = []
+        for seq, (name, record_id) in picked:
+            record = self.storage.find(name, record_id)
+            if record is None:
+                changes.append({'seq': seq, 'op': 'del', 'collection': name, 'id': record_id})
+            else:
+                changes.append({'seq': seq, 'op': 'put', 'collection': name, 'id': record_id, 'record': record})
+        return changes
+
+    def compact(self, now=None):
+        """
+        Forget tombstones older than ``tombstone_ttl`` and move the horizon
+        past them. Returns how many were dropped.
+        """
+        self._ensure_index()
+        cutoff = (time.time() if now is None else now) - self.tombstone_ttl
+        with self._lock:
+            old = [key for key, (_, op, when) in self._entries.items() if op == 'del' and when < cutoff]
+            if not old:
+                return 0
+            ids = []
+            horizon = self._horizon
+            for key in old:
+                ids.append(self._entries.pop(key)[0])
+                for log in self._users.values():
+                    seq = log.latest.pop(key, None)
+                    if seq is not None:
+                        horizon = max(horizon, seq)
+                        log.drop_superseded()
+                        break
+            self._horizon = horizon
+        self.storage.delete_many('changes', ids)
+        saved = self.storage.all('sync_horizon')
+        if saved:
+            self.storage.update('sync_horizon', saved[0]['id'], {'horizon': horizon})
+        else:
+            self.storage.insert('sync_horizon', {'horizon': horizon})
+        return len(ids)
+
+    def snapshot(self, user_id):
+        """Full state for a first sync: ``(changes, cursor)``."""
+        cursor = self.cursor
+        changes = []
+        for name in self.collections:
+            for record in self.storage.all(name):
+                if _owner(record) == user_id:
+                    changes.append({'seq': cursor, 'op': 'put', 'collection': name,
+                                    'id': record['id'], 'record': record})
+        return changes, cursor
+
+
+class SyncKeys:
+    """Results of already-applied pushes, by (user id, idempotency key)."""
+
+    def __init__(self, storage, ttl_seconds=KEY_TTL_SECONDS):
+        self.storage = storage
+        self.ttl_seconds = ttl_seconds
+        self._results = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._results is None:
+            cutoff = time.time() - self.ttl_seconds
+            self._results = {(k['user_id'], k['key']): k['result']
+                             for k in self.storage.all('sync_keys') if k['created'] >= cutoff}
+
+    def get(self, user_id, key):
+        with self._lock:
+            self._ensure_loaded()
+            return self._results.get((user_id, key))
+
+    def put_many(self, user_id, results):
+        """Remember ``{key: result}`` for a user in one write."""
+        with self._lock:
+            self._ensure_loaded()
+            now = time.time()
+            self.storage.insert_many('sync_keys', [
+                {'user_id': user_id, 'key': key, 'result': result, 'created': now}
+                for key, result in results.items()
+            ])
+            for key, result in results.items():
+                self._results[(user_id, key)] = result
+
+    def purge_expired(self, now=None):
+        """Delete every key older than ``ttl_seconds`` in one write. Returns how many."""
+        cutoff = (time.time() if now is None else now) - self.ttl_seconds
+        with self._lock:
+            expired = [k for k in self.storage.all('sync_keys') if k['created'] < cutoff]
+            if self._results is not None:
+                for k in expired:
+                    self._results.pop((k['user_id'], k['key']), None)
+        if expired:
+            self.storage.delete_many('sync_keys', [k['id'] for k in expired])
+        return len(expired)
+
+
+def _new_record(name, user_id, data):
+    """Record to insert for a pushed create (same fields as the add forms)."""
+    if name == 'foods':
+        return {'user_id': user_id, **{k: data.get(k) for k in _FOOD_FIELDS}}
+    return models.reading_record(user_id, data['glucose'], data.get('context', 'general'),
+                                 data.get('meal', ''), data.get('note', ''), data.get('date'),
+                                 data.get('time'), data.get('created_at'), data.get('tz_offset'))
+
+
+def _apply_one(storage, user_id, name, op, record_id, data):
+    existing = storage.find(name, record_id)
+    if existing is None or _owner(existing) != user_id:
+        # Deleting something already gone is a success for an offline client
+        if op == 'del':
+            return {'ok': True, 'op': 'del', 'collection': name, 'id': record_id, 'deleted': False}
+        return {'ok': False, 'collection': name, 'id': record_id, 'error': 'not found'}
+    if op == 'del':
+        storage.delete(name, record_id)
+        return {'ok': True, 'op': 'del', 'collection': name, 'id': record_id, 'deleted': True}
+    if name == 'readings':
+        fields = models.reading_changes(data, existing)
+    else:
+        fields = {k: data[k] for k in _FOOD_FIELDS if k in data}
+    storage.update(name, record_id, fields)
+    return {'ok': True, 'op': 'put', 'collection': name, 'id': record_id}
+
+
+def apply_changes(storage, user_id, changes):
+    """
+    Apply pushed changes and return one result per change, in order:
+    ``{"ok", "op", "collection", "id"}`` or ``{"ok": False, "error"}``.
+    A put without an id creates a record (``"created": True``); puts with
+    an id and deletes only touch the user's own records. Creates are
+    gathered into one ``insert_many`` per collection.
+    """
+    results = [None] * len(changes)
+    creates = {name: [] for name in SYNCED_COLLECTIONS}
+    for i, change in enumerate(changes):
+        op = change.get('op')
+        name = change.get('collection', 'readings')
+        data = change.get('record') or {}
+        try:
+            if not isinstance(name, str) or name not in SYNCED_COLLECTIONS or op not in ('put', 'del'):
+                raise SyncError(f"unsupported change: {op!r} on {name!r}")
+            if not isinstance(data, dict):
+                raise SyncError("record must be an object")
+            if change.get('id') is None:
+                if op == 'del':
+                    raise SyncError("delete needs an id")
+                creates[name].append((i, _new_record(name, user_id, data)))
+            else:
+                results[i] = _apply_one(storage, user_id, name, op, change['id'], data)
+        except (SyncError, KeyError, TypeError, ValueError) as e:
+            results[i] = {'ok': False, 'error': str(e) if not isinstance(e, KeyError) else f"missing {e}"}
+
+    for name, pending in creates.items():
+        if pending:
+            stored = storage.insert_many(name, [record for _, record in pending])
+            for (i, _), record in zip(pending, stored):
+                results[i] = {'ok': True, 'op': 'put', 'collection': name, 'id': record['id'], 'created': True}
+    return results
@@ -0,0 +1,129 @@
+"""
+benchmarks/bench_ingest.py
+
+Readings per second for POST /api/readings as concurrent writers increase,
+with and without group commit.
+
+Each writer is a thread posting readings as fast as it can, either
+through the Flask test client (target "http") or straight into the
+writer (target "writer", which shows what the storage side alone can
+take). "per-request" stores and fsyncs every reading on its own (group
+size 1); "group" is the default GroupCommitWriter. A write returns only
+after its reading is fsynced in both modes. Runs in a temporary folder;
+the real data/ folder is never touched. Usage (from the project root):
+
+    python benchmarks/bench_ingest.py --engines log sqlite --writers 1 4 16 64 --seconds 3
+"""
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import app as app_module  # noqa: E402
+from backend.ingest import GroupCommitWriter  # noqa: E402
+from backend.quotas import TenantQuotas  # noqa: E402
+from backend.storage import open_storage  # noqa: E402
+from backend.models import SAMPLE_DATA, reading_record  # noqa: E402
+
+MODES = {
+    'per-request': dict(max_batch=1, max_delay_ms=0),
+    'group': dict(),
+}
+
+
+def make_app(engine, data_dir, mode):
+    storage = open_storage(engine, data_dir, seed=SAMPLE_DATA)
+    unlimited = 10 ** 9
+    quotas = TenantQuotas(storage, requests_per_second=unlimited, request_burst=unlimited,
+                          writes_per_second=unlimited, write_burst=unlimited,
+                          max_readings=unlimited)
+    return app_module.create_app(storage=storage, quotas=quotas, preload=False,
+                                 ingest=GroupCommitWriter(storage, **MODES[mode]))
+
+
+def run(engine, mode, target, writers, seconds):
+    data_dir = tempfile.mkdtemp(prefix='bench-ingest-')
+    app = make_app(engine, data_dir, mode)
+    login = app.test_client().post('/api/login', json={'email': 'user@example.com', 'pin': '1234'})
+    headers = {'Authorization': 'Bearer ' + login.json['token']}
+    latencies = [[] for _ in range(writers)]
+    errors = [0] * writers
+    start = threading.Barrier(writers + 1)
+    stop_at = [0.0]
+
+    ingest = app.extensions['tracker'].ingest
+
+    def post(client, i):
+        resp = client.post('/api/readings', json={'glucose': 100 + i % 50, 'context': 'general'},
+                           headers=headers)
+        return resp.status_code == 201
+
+    def submit(client, i):
+        return ingest.submit(reading_record(1, 100 + i % 50)) is not None
+
+    def writer(i):
+        client = app.test_client()
+        write = post if target == 'http' else submit
+        start.wait()
+        while time.perf_counter() < stop_at[0]:
+            t0 = time.perf_counter()
+            ok = write(client, i)
+            latencies[i].append((time.perf_counter() - t0) * 1000)
+            if not ok:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    stop_at[0] = time.perf_counter() + seconds
+    started = time.perf_counter()
+    start.wait()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    services = app.extensions['tracker']
+    stats = services.ingest.stats()
+    services.ingest.stop()
+    services.storage.close()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    all_ms = sorted(ms for per in latencies for ms in per)
+    return {
+        'per_second': len(all_ms) / elapsed,
+        'p50': statistics.median(all_ms) if all_ms else 0,
+        'p99': all_ms[int(len(all_ms) * 0.99) - 1] if all_ms else 0,
+        'avg_batch': stats['records'] / stats['batches'] if stats['batches'] else 0,
+        'errors': sum(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[2])
+    parser.add_argument('--engines', nargs='+', default=['log', 'sqlite'])
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--targets', nargs='+', default=['http', 'writer'], choices=['http', 'writer'])
+    parser.add_argument('--writers', nargs='+', type=int, default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    print(f"{'engine':<8}{'target':<8}{'mode':<13}{'writers':>8}{'readings/s':>12}{'p50 ms':>9}"
+          f"{'p99 ms':>9}{'avg batch':>11}{'errors':>8}")
+    for engine in args.engines:
+        for target in args.targets:
+            for mode in args.modes:
+                for writers in args.writers:
+                    r = run(engine, mode, target, writers, args.seconds)
+                    print(f"{engine:<8}{target:<8}{mode:<13}{writers:>8}{r['per_second']:>12.0f}"
+                          f"{r['p50']:>9.2f}{r['p99']:>9.2f}{r['avg_batch']:>11.1f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+benchmarks/bench_serialization.py
+
+Time GET /api/readings and GET /api/export against a synthetic history.
+
+Runs the Flask test client inside a temporary working directory, so the
+real data/ folder is never touched. Usage (from the project root):
+
+    python benchmarks/bench_serialization.py --readings 20000 --repeat 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def make_readings(n, user_id=1):
+    start = datetime(2025, 1, 1)
+    contexts = ['fasting', 'pre-meal', 'post-meal', 'general']
+    rnd = random.Random(42)
+    readings = []
+    for i in range(n):
+        t = start + timedelta(minutes=5 * i)
+        readings.append({
+            'id': i + 1,
+            'user_id': user_id,
+            'date': t.strftime('%Y-%m-%d'),
+            'time': t.strftime('%H:%M'),
+            'glucose': round(rnd.uniform(60, 260), 1),
+            'context': rnd.choice(contexts),
+            'meal': '',
+            'note': 'cgm',
+            'created_at': t.isoformat() + 'Z',
+        })
+    return readings
+
+
+def timed(client, url, repeat, headers=None):
+    times, size = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resp = client.get(url, headers=headers or {})
+        body = resp.get_data()
+        times.append((time.perf_counter() - t0) * 1000)
+        size = len(body)
+    return statistics.median(times), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-serialization-')
+    os.chdir(workdir)
+    os.makedirs('data', exist_ok=True)
+    with open(os.path.join('data', 'readings.json'), 'w') as f:
+        json.dump(make_readings(args.readings), f)
+
+    import app as app_module
+    from backend.models import SAMPLE_DATA
+    from backend.quotas import TenantQuotas
+    with open(os.path.join('data', 'users.json'), 'w') as f:
+        json.dump(SAMPLE_DATA['users'], f)
+
+    app = app_module.create_app(data_dir='data', preload=False, seed=False)
+    services = app.extensions['tracker']
+    # Measure serialization, not the per-tenant request limit
+    services.quotas = TenantQuotas(services.storage, requests_per_second=1e9, request_burst=1e9)
+    client = app.test_client()
+    client.post('/api/login', json={'email': 'user@example.com', 'pin': '1234'})
+
+    n = args.readings
+    cases = [
+        ('/api/readings', f'/api/readings?limit={n}', None),
+        ('/api/readings gzip', f'/api/readings?limit={n}', {'Accept-Encoding': 'gzip'}),
+        ('/api/export', '/api/export', None),
+        ('/api/export gzip', '/api/export', {'Accept-Encoding': 'gzip'}),
+    ]
+    print(f'{n} readings, median of {args.repeat} requests')
+    for name, url, headers in cases:
+        ms, size = timed(client, url, args.repeat, headers)
+        print(f'  {name:<22} {ms:8.1f} ms  {size / 1024:9.1f} KiB')
+
+
+if __name__ == '__main__':
+    main()
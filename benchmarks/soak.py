@@ -0,0 +1,423 @@
+"""
+benchmarks/soak.py
+
+Load and soak test: N virtual patients against a running server.
+
+Each virtual patient has its own account and, like a CGM plus the
+frontend, it:
+
+- posts a reading every ``--cadence`` seconds (300 = a real CGM; use a
+  few seconds to compress hours of traffic into minutes), a random walk
+  around 130 mg/dL;
+- polls ``GET /api/readings`` and ``GET /api/sync?since=`` every
+  ``--poll`` seconds, like ``static/js/main.js``;
+- reads one of its readings through ``GET /api/cache/get/<id>`` after
+  each post;
+- submits a scheduler demo task (and runs a tick) every ``--task-every``
+  seconds.
+
+Events for all patients go into one time-ordered heap served by
+``--workers`` threads, each with its own keep-alive connection, so a few
+threads can drive thousands of patients. Every ``--report-every``
+seconds one row is printed: requests/s, error %, latency percentiles,
+server memory (RSS) and the size of the data folder. At the end there
+is a table per endpoint and the growth of memory, data and latency
+between the first and the last interval. Memory or p95 latency that
+keeps climbing under constant load points at something unbounded (a
+history that is never trimmed, a write that rewrites a whole file).
+
+By default the server is started here, on a free port with a temporary
+data folder (``--engine`` picks the storage engine), and stopped at the
+end. Point ``--url`` at a server you started yourself instead (add
+``--pid`` and ``--data-dir`` to see its memory and files). Usage (from
+the project root):
+
+    python benchmarks/soak.py --patients 200 --cadence 5 --duration 120
+    python benchmarks/soak.py --engine sqlite --patients 1000 --cadence 30 --duration 3600 --json soak.json
+    python benchmarks/soak.py --url http://127.0.0.1:5000 --pid 12345 --data-dir data
+"""
+import argparse
+import heapq
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).resolve().parents[1]
+
+SERVER_CODE = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+app.create_app().run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True, use_reloader=False)
+"""
+
+
+# ---------------------- Server ----------------------
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(engine, data_dir):
+    """Run app.py's app on a free port; returns (process, url)."""
+    port = _free_port()
+    env = {**os.environ, 'TRACKER_DATA_DIR': str(data_dir), 'TRACKER_STORAGE': engine}
+    log = open(Path(data_dir).parent / 'server.log', 'wb')
+    proc = subprocess.Popen([sys.executable, '-c', SERVER_CODE, str(ROOT), str(port)],
+                            env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f'server exited early, see {log.name}')
+        try:
+            status, _ = Client(url).request('GET', '/api/ready')
+            if status == 200:
+                return proc, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit('server did not become ready within 30s')
+
+
+def rss_bytes(pid):
+    """Resident memory of a process (Linux /proc; psutil elsewhere if installed)."""
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def open_files(pid):
+    try:
+        return len(os.listdir(f'/proc/{pid}/fd')) if pid is not None else None
+    except OSError:
+        return None
+
+
+def dir_bytes(path):
+    if path is None:
+        return None
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+# ---------------------- HTTP ----------------------
+
+class Client:
+    """One keep-alive connection; reconnects after errors."""
+
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        self.host, self.port, self.timeout = parts.hostname, parts.port or 80, timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request(method, path, data, headers)
+            resp = self.conn.getresponse()
+            payload = resp.read()
+            return resp.status, payload
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            raise
+
+
+# ---------------------- Virtual patients ----------------------
+
+class Patient:
+    __slots__ = ('email', 'token', 'glucose', 'reading_ids', 'cursor')
+
+    def __init__(self, email):
+        self.email = email
+        self.token = None
+        self.glucose = 130.0
+        self.reading_ids = []
+        self.cursor = 0
+
+    def next_glucose(self, rnd):
+        # CGM-like random walk, pulled back towards 130
+        self.glucose += rnd.gauss(0, 6) + (130 - self.glucose) * 0.05
+        self.glucose = min(max(self.glucose, 40), 400)
+        return round(self.glucose, 1)
+
+
+class Stats:
+    """Latencies and errors per endpoint, for the current interval and in total."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = defaultdict(list)
+        self.total = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.interval_errors = 0
+
+    def record(self, endpoint, ms, status):
+        with self.lock:
+            self.interval[endpoint].append(ms)
+            self.total[endpoint].append(ms)
+            if status == 429:
+                self.throttled[endpoint] += 1
+            elif status is None or status >= 400:
+                self.errors[endpoint] += 1
+                self.interval_errors += 1
+
+    def take_interval(self):
+        with self.lock:
+            interval, errors = self.interval, self.interval_errors
+            self.interval, self.interval_errors = defaultdict(list), 0
+        return interval, errors
+
+
+def pct(sorted_ms, p):
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * p / 100))] if sorted_ms else 0.0
+
+
+class Soak:
+    def __init__(self, args, url):
+        self.args = args
+        self.url = url
+        self.stats = Stats()
+        self.heap = []
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.stop_at = None
+        self.rnd = random.Random(args.seed)
+
+    def schedule(self, due, patient, action):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (due, self.seq, patient, action))
+            self.cond.notify()
+
+    def call(self, client, endpoint, method, path, body=None, token=None):
+        t0 = time.perf_counter()
+        try:
+            status, payload = client.request(method, path, body, token)
+        except (OSError, http.client.HTTPException):
+            status, payload = None, b''
+        self.stats.record(endpoint, (time.perf_counter() - t0) * 1000, status)
+        if status is not None and status < 400:
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return None
+        return None
+
+    # Actions: do one request (or two) and schedule the next one
+
+    def post_reading(self, client, p, rnd):
+        data = self.call(client, 'POST /api/readings', 'POST', '/api/readings',
+                         {'glucose': p.next_glucose(rnd), 'context': 'general', 'note': 'cgm'}, p.token)
+        if data and data.get('reading'):
+            p.reading_ids.append(data['reading']['id'])
+            del p.reading_ids[:-100]
+        if p.reading_ids:
+            self.call(client, 'GET /api/cache/get', 'GET', f'/api/cache/get/{rnd.choice(p.reading_ids)}',
+                      token=p.token)
+        return self.args.cadence
+
+    def poll(self, client, p, rnd):
+        self.call(client, 'GET /api/readings', 'GET', '/api/readings?limit=50', token=p.token)
+        data = self.call(client, 'GET /api/sync', 'GET', f'/api/sync?since={p.cursor}', token=p.token)
+        if data and 'cursor' in data:
+            p.cursor = data['cursor']
+        return self.args.poll
+
+    def scheduler_task(self, client, p, rnd):
+        self.call(client, 'POST /api/scheduler', 'POST', '/api/scheduler',
+                  {'name': f'soak-{rnd.randrange(1000)}', 'priority': rnd.randint(1, 9), 'ticks': 1},
+                  token=p.token)
+        self.call(client, 'POST /api/scheduler/run', 'POST', '/api/scheduler/run?ticks=1', token=p.token)
+        return self.args.task_every
+
+    def worker(self):
+        client = Client(self.url)
+        rnd = random.Random()
+        while True:
+            with self.cond:
+                while True:
+                    if time.monotonic() >= self.stop_at:
+                        return
+                    if self.heap and self.heap[0][0] <= time.monotonic():
+                        due, _, patient, action = heapq.heappop(self.heap)
+                        break
+                    wait = self.heap[0][0] - time.monotonic() if self.heap else 0.1
+                    self.cond.wait(min(max(wait, 0.001), self.stop_at - time.monotonic(), 0.5))
+            every = action(client, patient, rnd)
+            # Keep the cadence even when the server is slow: next due time, not now + every
+            self.schedule(max(due + every, time.monotonic()), patient, action)
+
+    def login_all(self):
+        run = uuid.uuid4().hex[:8]
+        client = Client(self.url)
+        patients = []
+        for i in range(self.args.patients):
+            p = Patient(f'soak-{run}-{i}@example.com')
+            data = self.call(client, 'POST /api/register', 'POST', '/api/register',
+                             {'email': p.email, 'pin': '1234'})
+            if not data:
+                raise SystemExit(f'could not register {p.email}; is {self.url} a tracker server?')
+            p.token = data['token']
+            patients.append(p)
+        return patients
+
+    def run(self, pid, data_dir):
+        args = self.args
+        patients = self.login_all()
+        self.stats = Stats()
+        start = time.monotonic()
+        self.stop_at = start + args.duration
+        # Spread first events over one period, so patients are not in lockstep
+        for p in patients:
+            self.schedule(start + self.rnd.uniform(0, args.cadence), p, self.post_reading)
+            self.schedule(start + self.rnd.uniform(0, args.poll), p, self.poll)
+            if args.task_every:
+                self.schedule(start + self.rnd.uniform(0, args.task_every), p, self.scheduler_task)
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(args.workers)]
+        for t in threads:
+            t.start()
+
+        timeline = []
+        print(f"{'t s':>6}{'req/s':>9}{'err %':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'rss MB':>9}{'data MB':>9}{'files':>7}{'backlog':>9}")
+        last = start
+        while time.monotonic() < self.stop_at:
+            time.sleep(min(args.report_every, max(0.0, self.stop_at - time.monotonic())))
+            now = time.monotonic()
+            interval, errors = self.stats.take_interval()
+            all_ms = sorted(ms for values in interval.values() for ms in values)
+            with self.cond:
+                backlog = sum(1 for e in self.heap if e[0] < now - 1)
+            row = {
+                't': round(now - start, 1),
+                'requests_per_second': len(all_ms) / max(now - last, 1e-9),
+                'error_percent': 100 * errors / len(all_ms) if all_ms else 0.0,
+                'p50_ms': pct(all_ms, 50), 'p95_ms': pct(all_ms, 95), 'p99_ms': pct(all_ms, 99),
+                'rss_bytes': rss_bytes(pid), 'data_bytes': dir_bytes(data_dir),
+                'open_files': open_files(pid), 'backlog': backlog,
+            }
+            timeline.append(row)
+            last = now
+            mb = lambda b: f'{b / 1e6:9.1f}' if b is not None else f"{'-':>9}"
+            print(f"{row['t']:>6.0f}{row['requests_per_second']:>9.1f}{row['error_percent']:>7.2f}"
+                  f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+                  f"{mb(row['rss_bytes'])}{mb(row['data_bytes'])}"
+                  f"{row['open_files'] if row['open_files'] is not None else '-':>7}{backlog:>9}", flush=True)
+        for t in threads:
+            t.join()
+        return self.summary(timeline)
+
+    def summary(self, timeline):
+        s = self.stats
+        print(f"\n{'endpoint':<26}{'requests':>10}{'errors':>8}{'429s':>7}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'max ms':>9}")
+        endpoints = {}
+        for endpoint in sorted(s.total):
+            ms = sorted(s.total[endpoint])
+            endpoints[endpoint] = {'requests': len(ms), 'errors': s.errors[endpoint],
+                                   'throttled': s.throttled[endpoint], 'p50_ms': pct(ms, 50),
+                                   'p95_ms': pct(ms, 95), 'p99_ms': pct(ms, 99), 'max_ms': ms[-1]}
+            e = endpoints[endpoint]
+            print(f"{endpoint:<26}{e['requests']:>10}{e['errors']:>8}{e['throttled']:>7}{e['p50_ms']:>9.1f}"
+                  f"{e['p95_ms']:>9.1f}{e['p99_ms']:>9.1f}{e['max_ms']:>9.1f}")
+
+        growth = {}
+        if len(timeline) >= 2:
+            first, final = timeline[0], timeline[-1]
+            hours = max(final['t'] - first['t'], 1e-9) / 3600
+            print()
+            for key, label in (('rss_bytes', 'server memory'), ('data_bytes', 'data folder')):
+                if first[key] is not None and final[key] is not None:
+                    delta = final[key] - first[key]
+                    growth[key] = {'first': first[key], 'last': final[key], 'per_hour': delta / hours}
+                    print(f"{label:<14} {first[key] / 1e6:8.1f} MB -> {final[key] / 1e6:8.1f} MB "
+                          f"({delta / hours / 1e6:+.1f} MB/hour)")
+            ratio = final['p95_ms'] / first['p95_ms'] if first['p95_ms'] else 0
+            growth['p95_ratio'] = ratio
+            print(f"p95 latency    {first['p95_ms']:8.1f} ms -> {final['p95_ms']:8.1f} ms (x{ratio:.2f})")
+            if ratio > 2:
+                print("  p95 latency more than doubled under the same load: look for O(n) work per request")
+        return {'args': vars(self.args), 'timeline': timeline, 'endpoints': endpoints, 'growth': growth}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[2])
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--cadence', type=float, default=5.0, help='seconds between readings (CGM: 300)')
+    parser.add_argument('--poll', type=float, default=30.0, help='seconds between reading/sync polls')
+    parser.add_argument('--task-every', type=float, default=60.0, help='seconds between scheduler tasks (0: off)')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds to run')
+    parser.add_argument('--workers', type=int, default=16, help='client threads (one connection each)')
+    parser.add_argument('--report-every', type=float, default=10.0)
+    parser.add_argument('--engine', default='log', help='storage engine of the started server')
+    parser.add_argument('--url', help='test this server instead of starting one')
+    parser.add_argument('--pid', type=int, help='with --url: server process for memory / open files')
+    parser.add_argument('--data-dir', help='with --url: server data folder for size growth')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the timeline and totals to this file')
+    args = parser.parse_args()
+
+    proc = tmp = None
+    if args.url:
+        url, pid, data_dir = args.url, args.pid, args.data_dir
+    else:
+        tmp = Path(tempfile.mkdtemp(prefix='soak-'))
+        data_dir = tmp / 'data'
+        proc, url = start_server(args.engine, data_dir)
+        pid = proc.pid
+    print(f"{args.patients} patients against {url} for {args.duration:.0f}s "
+          f"(reading every {args.cadence}s, poll every {args.poll}s, {args.workers} client threads)")
+    try:
+        result = Soak(args, url).run(pid, data_dir)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+            shutil.rmtree(tmp, ignore_errors=True)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
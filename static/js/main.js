@@ -6,16 +6,19 @@
 const API_BASE = 'http://127.0.0.1:5000';
 
 /**
- * Helper function to make API calls
+ * Helper function to make API calls (sends the session token if logged in)
  */
 async function apiFetch(path, options = {}) {
     try {
+        const token = localStorage.getItem('token');
         const response = await fetch(`${API_BASE}${path}`, {
+            ...options,
+            credentials: 'include',
             headers: {
                 'Content-Type': 'application/json',
+                ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
                 ...options.headers
-            },
-            ...options
+            }
         });
 
         if (!response.ok) {
@@ -41,6 +44,7 @@ async function login(email, pin) {
         });
 
         if (data.ok) {
+            localStorage.setItem('token', data.token);
             localStorage.setItem('user_id', data.user.id);
             localStorage.setItem('email', data.user.email);
             return data.user;
@@ -58,12 +62,10 @@ async function login(email, pin) {
  */
 async function logout() {
     try {
-        const userId = localStorage.getItem('user_id') || 1;
-        await apiFetch('/api/logout', {
-            method: 'POST',
-            body: JSON.stringify({ user_id: userId })
-        });
+        await apiFetch('/api/logout', { method: 'POST' });
 
+        localStorage.removeItem(syncStorageKey());
+        localStorage.removeItem('token');
         localStorage.removeItem('user_id');
         localStorage.removeItem('email');
         window.location.href = '/static/login.html';
@@ -73,41 +75,94 @@ async function logout() {
 }
 
 /**
- * Load readings from API
+ * Offline sync
+ * Readings and foods are kept in localStorage. syncNow() first pushes
+ * writes made while offline (the "outbox"), then asks /api/sync only for
+ * what changed since the last cursor, so the full list is downloaded once.
  */
-async function loadReadings(limit = 50) {
-    try {
-        const userId = localStorage.getItem('user_id') || 1;
-        const data = await apiFetch(`/api/readings?user_id=${userId}&limit=${limit}`, {
-            method: 'GET'
+function syncStorageKey() {
+    return `sync_${localStorage.getItem('user_id') || 'anon'}`;
+}
+
+function loadSyncState() {
+    const saved = JSON.parse(localStorage.getItem(syncStorageKey()) || 'null');
+    return saved || { cursor: 0, records: { readings: {}, foods: {} }, outbox: [] };
+}
+
+function saveSyncState(state) {
+    localStorage.setItem(syncStorageKey(), JSON.stringify(state));
+}
+
+function newChangeKey() {
+    return window.crypto && crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
+}
+
+async function syncNow() {
+    const state = loadSyncState();
+
+    if (state.outbox.length) {
+        // Each change has an idempotency key, so resending after a lost reply is safe
+        await apiFetch('/api/sync', {
+            method: 'POST',
+            body: JSON.stringify({ changes: state.outbox })
         });
+        // Drop the local placeholders; the pull below brings the server copies
+        state.outbox.forEach(c => { if (c.localId) delete state.records[c.collection][c.localId]; });
+        state.outbox = [];
+        saveSyncState(state);
+    }
 
-        if (data.ok) {
-            return data.readings;
-        } else {
-            throw new Error(data.error);
+    let more = true;
+    while (more) {
+        const data = await apiFetch(`/api/sync?since=${state.cursor}`, { method: 'GET' });
+        if (data.full) {
+            state.records = { readings: {}, foods: {} };
         }
+        data.changes.forEach(c => {
+            if (c.op === 'del') {
+                delete state.records[c.collection][c.id];
+            } else {
+                state.records[c.collection][c.id] = c.record;
+            }
+        });
+        state.cursor = data.cursor;
+        more = data.more;
+    }
+    saveSyncState(state);
+    return state;
+}
+
+/**
+ * Load readings (synced copy; still works offline)
+ */
+async function loadReadings(limit = 50) {
+    let state;
+    try {
+        state = await syncNow();
     } catch (error) {
-        console.error('Failed to load readings:', error);
-        return [];
+        console.error('Sync failed, showing saved readings:', error);
+        state = loadSyncState();
     }
+    return Object.values(state.records.readings)
+        .sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''))
+        .slice(0, limit);
 }
 
 /**
- * Submit a new reading
+ * Submit a new reading (queued for the next sync when offline)
  */
 async function submitReading(glucose, context, meal, note) {
+    const reading = {
+        glucose: parseFloat(glucose),
+        context,
+        meal,
+        note,
+        created_at: new Date().toISOString().replace(/\.\d+Z$/, 'Z')
+    };
     try {
-        const userId = localStorage.getItem('user_id') || 1;
         const data = await apiFetch('/api/readings', {
             method: 'POST',
-            body: JSON.stringify({
-                user_id: userId,
-                glucose: parseFloat(glucose),
-                context,
-                meal,
-                note
-            })
+            body: JSON.stringify(reading)
         });
 
         if (data.ok) {
@@ -116,8 +171,18 @@ async function submitReading(glucose, context, meal, note) {
             throw new Error(data.error);
         }
     } catch (error) {
-        console.error('Failed to submit reading:', error);
-        throw error;
+        if (!(error instanceof TypeError)) {
+            console.error('Failed to submit reading:', error);
+            throw error;
+        }
+        // Network error: keep it locally and push it with the next sync
+        const state = loadSyncState();
+        const key = newChangeKey();
+        const localId = `local-${key}`;
+        state.outbox.push({ key, op: 'put', collection: 'readings', record: reading, localId });
+        state.records.readings[localId] = { id: localId, ...reading, pending: true };
+        saveSyncState(state);
+        return state.records.readings[localId];
     }
 }
 
@@ -165,7 +230,7 @@ async function testAPI() {
  * Check if user is logged in
  */
 function isLoggedIn() {
-    return !!localStorage.getItem('user_id');
+    return !!localStorage.getItem('token');
 }
 
 /**
@@ -175,10 +240,31 @@ function getCurrentUserId() {
     return localStorage.getItem('user_id') || 1;
 }
 
+/**
+ * Links marked data-local-time (the report) get ?tz=<minutes east of UTC>,
+ * so the server shows times in this browser's time zone
+ */
+function addLocalTimezone() {
+    const tz = -new Date().getTimezoneOffset();
+    document.querySelectorAll('a[data-local-time]').forEach(link => {
+        const url = new URL(link.href, window.location.href);
+        url.searchParams.set('tz', tz);
+        link.href = url.pathname + url.search;
+    });
+}
+
 /**
  * Initialize page on load
  */
 document.addEventListener('DOMContentLoaded', () => {
     console.log('📱 Diabetes Tracker loaded');
+    addLocalTimezone();
     testAPI();
 });
+
+// Push offline writes as soon as the connection is back
+window.addEventListener('online', () => {
+    if (isLoggedIn()) {
+        syncNow().catch(error => console.error('Sync failed:', error));
+    }
+});
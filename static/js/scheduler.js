@@ -10,12 +10,16 @@ const API_BASE = 'http://127.0.0.1:5000';
  */
 async function schedulerApiFetch(path, options = {}) {
     try {
+        // The queue is per user (it holds your glucose alerts), so send the session token
+        const token = localStorage.getItem('token');
         const response = await fetch(`${API_BASE}${path}`, {
+            ...options,
+            credentials: 'include',
             headers: {
                 'Content-Type': 'application/json',
+                ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
                 ...options.headers
-            },
-            ...options
+            }
         });
 
         if (!response.ok) {